@@ -41,6 +41,11 @@ class Ui_OpenPrintTagGui(object):
         self.actionLoad.setObjectName(u"actionLoad")
         self.actionSave = QAction(OpenPrintTagGui)
         self.actionSave.setObjectName(u"actionSave")
+        self.actionMultiReader = QAction(OpenPrintTagGui)
+        self.actionMultiReader.setObjectName(u"actionMultiReader")
+        self.actionMultiReader.setCheckable(True)
+        self.actionDiagnostics = QAction(OpenPrintTagGui)
+        self.actionDiagnostics.setObjectName(u"actionDiagnostics")
         self.centralwidget = QWidget(OpenPrintTagGui)
         self.centralwidget.setObjectName(u"centralwidget")
         self.gridLayout = QGridLayout(self.centralwidget)
@@ -490,6 +495,11 @@ class Ui_OpenPrintTagGui(object):
 
         self.horizontalLayout_23.addWidget(self.writetagbtn)
 
+        self.updateweightbtn = QPushButton(self.basictab)
+        self.updateweightbtn.setObjectName(u"updateweightbtn")
+
+        self.horizontalLayout_23.addWidget(self.updateweightbtn)
+
 
         self.verticalLayout_6.addLayout(self.horizontalLayout_23)
 
@@ -923,6 +933,9 @@ class Ui_OpenPrintTagGui(object):
         self.menubar.addAction(self.menuFile.menuAction())
         self.menuFile.addAction(self.actionLoad)
         self.menuFile.addAction(self.actionSave)
+        self.menuFile.addSeparator()
+        self.menuFile.addAction(self.actionMultiReader)
+        self.menuFile.addAction(self.actionDiagnostics)
 
         self.retranslateUi(OpenPrintTagGui)
 
@@ -937,6 +950,8 @@ class Ui_OpenPrintTagGui(object):
         OpenPrintTagGui.setWindowTitle(QCoreApplication.translate("OpenPrintTagGui", u"OpenPrintTag - GUI", None))
         self.actionLoad.setText(QCoreApplication.translate("OpenPrintTagGui", u"Open", None))
         self.actionSave.setText(QCoreApplication.translate("OpenPrintTagGui", u"Save as ...", None))
+        self.actionMultiReader.setText(QCoreApplication.translate("OpenPrintTagGui", u"Use all PC/SC readers", None))
+        self.actionDiagnostics.setText(QCoreApplication.translate("OpenPrintTagGui", u"Reader diagnostics ...", None))
         self.brandnamelabel.setText(QCoreApplication.translate("OpenPrintTagGui", u"Brand name", None))
         self.brandnamebox.setPlaceholderText(QCoreApplication.translate("OpenPrintTagGui", u"Prusament", None))
         self.materialnamelabel.setText(QCoreApplication.translate("OpenPrintTagGui", u"Material name", None))
@@ -975,6 +990,7 @@ class Ui_OpenPrintTagGui(object):
         self.expdateedit.setPlaceholderText("")
         self.readtagbtn.setText(QCoreApplication.translate("OpenPrintTagGui", u"Read Tag", None))
         self.writetagbtn.setText(QCoreApplication.translate("OpenPrintTagGui", u"Write Tag", None))
+        self.updateweightbtn.setText(QCoreApplication.translate("OpenPrintTagGui", u"Update Weight", None))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.basictab), QCoreApplication.translate("OpenPrintTagGui", u"Basic Info", None))
         self.materialpropgroup.setTitle(QCoreApplication.translate("OpenPrintTagGui", u"Material Properties and Tags", None))
         self.groupBox.setTitle(QCoreApplication.translate("OpenPrintTagGui", u"Material classification", None))
@@ -1,13 +1,19 @@
+from contextlib import contextmanager
 from enum import Enum
 
 import smartcard
 from smartcard.CardType import AnyCardType
 from smartcard.CardRequest import CardRequest
+from smartcard.CardService import CardService
 from smartcard.Exceptions import CardRequestTimeoutException
 from smartcard.util import toHexString
 from smartcard.ATR import ATR
 import os, sys
 import platform
+import time
+
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS, iso15_command_name
+from openprinttaggui.Library.nfc_transport import replaying, transport_connection
 
 script_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -51,21 +57,62 @@ class Layer(Enum):
     Layer_Part3 = 0x3
     Layer_Part4 = 0x4
 
+def acs_apdu_label(apdu) -> str:
+    """
+    Metrics label of an APDU, transparent exchanges by their ISO15693 command byte
+    """
+    if len(apdu) < 4 or apdu[0] != 0xFF:
+        return "apdu"
+    if apdu[1] == 0xC2:
+        if apdu[3] == 0x01 and len(apdu) > 8:
+            # FF C2 00 01 Lc 95 len flags cmd ...
+            return iso15_command_name(apdu[8])
+        return {0x00: "manage_session", 0x02: "switch_protocol"}.get(apdu[3], "transparent")
+    return {0xCA: "get_data", 0xB0: "read_binary", 0xD6: "update_binary", 0xFB: "pass_through"}.get(
+        apdu[1], f"apdu_{apdu[1]:02x}")
+
+
 class ACS:
-    def __init__(self, port: str = None, logger=print):
+    def __init__(self, port: str = None, logger=print, connect: bool = True, reader_name: str = None):
         self.sw1 = 0x90
         self.sw2 = 0x00
         self.logger = logger
-        cardtype = AnyCardType()
-        cardrequest = CardRequest(timeout=1, cardType=cardtype)
-        try:
-            self.cardservice = cardrequest.waitforcard()
-        except CardRequestTimeoutException:
-            logger("Timeout waiting for nfc tag")
-            return
+        self.cardservice = None
+        # PC/SC reader to use, any reader if None
+        self.reader_name = reader_name
+        # Transparent session state, see enter_transparent()
+        self.transparent_active = False
+        self.transparent_protocol = None
+        self.transparent_depth = 0
+        self.transparent_held = False
+        if connect:
+            self.connect_card()
+
+    def connect_card(self, timeout: int = 1, card=None) -> bool:
+        """
+        Waits up to timeout seconds for a card, or connects to card if one was reported by a CardMonitor
+        """
+        self.reset_transparent()
+        if replaying():
+            # The trace stands in for the card
+            self.cardservice = CardService(None)
+        elif card is not None:
+            self.cardservice = CardService(card.createConnection())
+        else:
+            cardtype = AnyCardType()
+            if self.reader_name is not None:
+                cardrequest = CardRequest(timeout=timeout, cardType=cardtype, readers=[self.reader_name])
+            else:
+                cardrequest = CardRequest(timeout=timeout, cardType=cardtype)
+            try:
+                self.cardservice = cardrequest.waitforcard()
+            except CardRequestTimeoutException:
+                self.logger("Timeout waiting for nfc tag")
+                return False
+        self.cardservice.connection = transport_connection(self.trace_channel(), self.cardservice.connection)
         self.cardservice.connection.connect()
         atr = self.cardservice.connection.getATR()
-        logger("ATR detected: "+toHexString(atr))
+        self.logger("ATR detected: "+toHexString(atr))
         hb = toHexString(ATR(atr).getHistoricalBytes())
         cardname = hb[-17:-12]
         cardnameMap = {
@@ -92,21 +139,43 @@ class ACS:
 
         }
         name = cardnameMap.get(cardname, "unknown")
-        logger("Card Name: " + name)
-        logger("T0 supported: ", ATR(atr).isT0Supported())
-        logger("T1 supported: ", ATR(atr).isT1Supported())
-        logger("T15 suppoerted: ", ATR(atr).isT15Supported())
+        self.logger("Card Name: " + name)
+        self.logger(f"T0 supported: {ATR(atr).isT0Supported()}")
+        self.logger(f"T1 supported: {ATR(atr).isT1Supported()}")
+        self.logger(f"T15 suppoerted: {ATR(atr).isT15Supported()}")
+        return True
+
+    def trace_channel(self) -> str:
+        return "acs" if self.reader_name is None else f"acs:{self.reader_name}"
 
+    def disconnect_card(self):
+        # The reader ends the transparent session on its own once the card is gone
+        self.reset_transparent()
+        if self.cardservice is not None:
+            try:
+                self.cardservice.connection.disconnect()
+            except Exception:
+                pass
+            self.cardservice = None
 
+    def close(self):
+        if self.transparent_held:
+            self.transparent_held = False
+            self.leave_transparent()
+        self.disconnect_card()
 
     def hex(self, byte_array):
         return toHexString(list(byte_array))
 
     def send_apdu(self, apdu):
+        start = time.perf_counter()
         response, sw1, sw2 = self.cardservice.connection.transmit(apdu)
+        if NFC_METRICS.enabled:
+            NFC_METRICS.observe("acs", acs_apdu_label(apdu), "apdu", (time.perf_counter() - start) * 1000)
         self.sw1=sw1
         self.sw2=sw2
         if sw1 != 0x90 or sw2 != 0x00:
+            NFC_METRICS.inc("acs", acs_apdu_label(apdu), "errors")
             raise ValueError(f"Bad response! sw1={sw1:02X}, sw2={sw2:02X}, data={self.hex(apdu)}")
         return response
 
@@ -155,6 +224,57 @@ class ACS:
     def end_transparent(self):
         return self.manage_session([0x82, 0x00])==0x9000
 
+    def enter_transparent(self, protocol: Protocol = Protocol.ISO15693, layer: Layer = Layer.Layer_Part3):
+        """
+        Starts the transparent session and selects the protocol, unless an outer caller already did.
+        Every call has to be paired with leave_transparent(), the outermost one ends the session.
+        """
+        try:
+            if not self.transparent_active:
+                self.start_transparent()
+                self.transparent_active = True
+            if self.transparent_protocol != (protocol, layer):
+                self.select_protocol(protocol=protocol, layer=layer)
+                self.transparent_protocol = (protocol, layer)
+        except Exception:
+            if self.transparent_depth == 0:
+                self.leave_transparent()
+            raise
+        self.transparent_depth += 1
+
+    def leave_transparent(self):
+        if self.transparent_depth > 0:
+            self.transparent_depth -= 1
+        if self.transparent_depth == 0 and self.transparent_active:
+            self.transparent_active = False
+            self.transparent_protocol = None
+            try:
+                self.end_transparent()
+            except Exception:
+                pass
+
+    @contextmanager
+    def transparent_session(self, protocol: Protocol = Protocol.ISO15693, layer: Layer = Layer.Layer_Part3):
+        self.enter_transparent(protocol=protocol, layer=layer)
+        try:
+            yield self
+        finally:
+            self.leave_transparent()
+
+    def hold_transparent(self, protocol: Protocol = Protocol.ISO15693, layer: Layer = Layer.Layer_Part3):
+        """
+        Keeps the transparent session open across operations until the card is disconnected or close()
+        """
+        if not self.transparent_held:
+            self.enter_transparent(protocol=protocol, layer=layer)
+            self.transparent_held = True
+
+    def reset_transparent(self):
+        self.transparent_active = False
+        self.transparent_protocol = None
+        self.transparent_depth = 0
+        self.transparent_held = False
+
     def detect_os(self):
         os_name = platform.system()  # Returns 'Windows', 'Linux', 'Darwin' (for macOS), or others
         if os_name == 'Darwin':
@@ -7,8 +7,9 @@ sys.path.insert(1, script_path)
 sys.path.insert(2, os.path.join(script_path, "Library", "OpenPrintTag", "utils"))
 
 from acs_generic import ACS, ReadMode
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS
 from openprinttaggui.Library.iso15693 import ISO15_TAG_T, ISO15693_UID_LENGTH, ISO15693_TAG_MAX_PAGES, ISO15693_TAG_MAX_SIZE, \
-    ISO15693_ATQB_LENGTH
+    ISO15693_ATQB_LENGTH, ISO15_DUMP_CACHE_T, get_dirty_blocks, read_ndef_blocks
 
 class ISO15693_CMD(Enum):
     INVENTORY = 0x01
@@ -45,13 +46,30 @@ class ISO15693_CMD(Enum):
     # PROPRIETARY: 0xE0 - 0xFF
 
 
+ISO15_REQ_DATARATE_HIGH = 0x02
+ISO15_REQ_OPTION = 0x40
+ISO15_RES_ERROR = 0x01
+# Status objects in front of the tag response of a transparent exchange
+ACS_TRANSPARENT_RESPONSE_HEADER = 14
+# Short APDU response (256 bytes) minus header and the iso15 response flags
+ACS_READ_MULTI_MAX_BYTES = 0x100 - ACS_TRANSPARENT_RESPONSE_HEADER - 1
+# Upper bound of blocks per READ_MULTI_BLOCK request, most SLIX/SLIX2 tags accept 32 at once
+ISO15693_READ_MULTI_MAX_BLOCKS = 32
+
+
 class ACS_HF15(ACS):
 
-    def __init__(self, port: str, logger=print):
-        super().__init__(port=port)
+    def __init__(self, port: str, logger=print, connect: bool = True, reader_name: str = None):
+        self.dump_cache = ISO15_DUMP_CACHE_T()
+        super().__init__(port=port, logger=logger, connect=connect, reader_name=reader_name)
         self.uid = b""
         self.logger = logger
 
+    def disconnect_card(self):
+        # Card removed or reader closed, whatever comes next has to be read again
+        self.dump_cache.clear()
+        super().disconnect_card()
+
 
     def pass_through(self, function, data):
         res=self.send_apdu([0xFF,0xFB,0x00,function,len(data)] + data)
@@ -61,23 +79,29 @@ class ACS_HF15(ACS):
         return self.manage_session([0x82, 0x00])==0x9000
 
     def getUID(self):
-        if self.cardservice is None:
+        if self.cardservice is None and not self.connect_card():
+            return None
+        try:
+            # One transparent session as long as the card stays, polls and reads reuse it
+            self.hold_transparent()
+            res=self.get_system_info()
+        except Exception:
+            # Tag left the field, the next call waits for a new one
+            self.disconnect_card()
             return None
-        res=self.get_system_info()
         if "uid" in res:
             self.uid=res["uid"]
         else:
             self.uid=b""
+        self.dump_cache.check_uid(self.uid)
         if self.uid != b"":
             self.logger(f'UID detected: {bytearray(self.uid).hex()}')
         return self.uid
 
     def get_system_info(self):
-        self.start_transparent()
-        self.select_iso15693()
-        resp=self.transparent_exchange(data=[0x02,ISO15693_CMD.GET_SYSTEM_INFO.value])
-        #resp2=self.transparent_exchange(data=[0x02,ISO15693_CMD.EXTENDED_GET_SYSTEM_INFO.value])
-        self.end_transparent()
+        with self.transparent_session():
+            resp=self.transparent_exchange(data=[0x02,ISO15693_CMD.GET_SYSTEM_INFO.value])
+            #resp2=self.transparent_exchange(data=[0x02,ISO15693_CMD.EXTENDED_GET_SYSTEM_INFO.value])
         if len(resp)>0:
             flag = resp[0]
             info_flag = resp[1]
@@ -114,6 +138,45 @@ class ACS_HF15(ACS):
                 self.logger(f"Error on reading block {address}: {e}")
         return -1, b""
 
+    def read_multi_block(self, address: int, count: int, blocksize: int = 4):
+        """
+        Reads count blocks with a single READ_MULTI_BLOCK (EXTENDED_READ_MULTI_BLOCKS beyond block 255)
+        through the transparent session. Returns a list of (security status, data) tuples or None if the
+        tag or reader refused.
+        """
+        flags = ISO15_REQ_DATARATE_HIGH | ISO15_REQ_OPTION
+        if address + count > 0x100:
+            cmd = [flags, ISO15693_CMD.EXTENDED_READ_MULTI_BLOCKS.value, address & 0xFF, (address >> 8) & 0xFF,
+                   (count - 1) & 0xFF, ((count - 1) >> 8) & 0xFF]
+        else:
+            cmd = [flags, ISO15693_CMD.READ_MULTI_BLOCK.value, address & 0xFF, (count - 1) & 0xFF]
+        try:
+            resp = self.transparent_exchange(data=cmd)
+        except ValueError:
+            return None
+        expected = 1 + count * (blocksize + 1)
+        # Depending on the firmware the tag crc is passed on
+        if len(resp) not in (expected, expected + 2) or resp[0] & ISO15_RES_ERROR:
+            return None
+        blocks = []
+        for i in range(count):
+            pos = 1 + i * (blocksize + 1)
+            blocks.append((resp[pos], resp[pos + 1:pos + 1 + blocksize]))
+        return blocks
+
+    def read_system_info(self, tag: ISO15_TAG_T) -> bool:
+        """
+        Updates block count and size of tag, the transparent session has to be active
+        """
+        try:
+            resp = self.transparent_exchange(data=[ISO15_REQ_DATARATE_HIGH, ISO15693_CMD.GET_SYSTEM_INFO.value])
+        except ValueError:
+            return False
+        if len(resp) < 10 or resp[0] & ISO15_RES_ERROR:
+            return False
+        tag.parse(resp)
+        return True
+
     def read_value_block(self, block):
         return bytes(self.send_apdu([0xFF, 0xB1, 00, block, 0x04]))
 
@@ -146,33 +209,65 @@ class ACS_HF15(ACS):
             self.logger(str(err))
             return -1, b""
 
-    def dump(self, filename: str = None, fast: bool = True, blocksize: int = 4, progress=None):
-        self.start_transparent()
-        self.select_iso15693()
-        tag = ISO15_TAG_T(blocksize)
-        tag.uid = self.uid
-        for blocknum in range(tag.pagesCount):
-            if progress:
-                progress(blocknum / tag.pagesCount * 100)
-            lock, pgdata = self.read_block(address=blocknum, length=blocksize)
-            if lock==0xF:
-                break
-            if pgdata==b"" and self.logger:
-                self.logger(f"Error on reading block {blocknum}")
-            tag.locks[blocknum] = lock
-            if lock==0:
-                tag.data[blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage] = bytearray(
-                    pgdata[:tag.bytesPerPage])
+    def dump(self, filename: str = None, fast: bool = True, blocksize: int = 4, progress=None, lazy: bool = False,
+             multiblock: bool = True):
+        """
+        lazy: only read the blocks up to the end of the NDEF message, ignored when saving to filename
+        multiblock: read up to ACS_READ_MULTI_MAX_BYTES per APDU, falls back to single blocks if refused
+        """
+        with self.transparent_session():
+            tag = ISO15_TAG_T(blocksize)
+            tag.uid = self.uid
+            self.read_system_info(tag)
+            blocksize = tag.bytesPerPage
+            multi_count = min(ACS_READ_MULTI_MAX_BYTES // (blocksize + 1), ISO15693_READ_MULTI_MAX_BLOCKS)
+
+            def read_blocks(start, end):
+                nonlocal multiblock
+                while multiblock and start < end:
+                    count = min(multi_count, end - start)
+                    blocks = self.read_multi_block(address=start, count=count, blocksize=blocksize)
+                    if blocks is None:
+                        NFC_METRICS.inc("acs", "read_multiple_blocks", "retries")
+                        multiblock = False
+                        break
+                    for blocknum, (lock, pgdata) in enumerate(blocks, start):
+                        tag.locks[blocknum] = lock
+                        tag.data[blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage] = bytearray(
+                            pgdata[:tag.bytesPerPage])
+                    start += count
+                    if progress:
+                        progress(start / tag.pagesCount * 100)
+                for blocknum in range(start, end):
+                    if progress:
+                        progress(blocknum / tag.pagesCount * 100)
+                    lock, pgdata = self.read_block(address=blocknum, length=blocksize)
+                    if lock==0xF:
+                        return blocknum
+                    if pgdata==b"" and self.logger:
+                        self.logger(f"Error on reading block {blocknum}")
+                    tag.locks[blocknum] = lock
+                    if lock==0:
+                        tag.data[blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage] = bytearray(
+                            pgdata[:tag.bytesPerPage])
+                    else:
+                        return blocknum
+                return end
+
+            if lazy and filename is None:
+                blocks = read_ndef_blocks(read_blocks, tag)
+                tag.data[blocks * tag.bytesPerPage:] = bytes(len(tag.data) - blocks * tag.bytesPerPage)
             else:
-                break
-        self.end_transparent()
+                blocks = read_blocks(0, tag.pagesCount)
+        self.dump_cache.store(tag.uid, tag.data[:blocks * tag.bytesPerPage])
         if progress:
             progress(100)
         if filename is not None:
             tag.save(filename=filename)
         return tag
 
-    def restore(self, data_or_filename, fast: bool = False, blocksize: int = 4, progress=None):
+    def restore(self, data_or_filename, fast: bool = False, blocksize: int = 4, progress=None, diff: bool = False,
+                blocklist: list = None):
         _ = fast
         tag = ISO15_TAG_T(blocksize)
         tag.uid = self.uid
@@ -186,20 +281,53 @@ class ACS_HF15(ACS):
         blocks = len(filldata) // tag.bytesPerPage
         if progress:
             progress(0)
-        blockstowrite = min(blocks, tag.pagesCount)
-        for blocknum in range(blockstowrite):
-            if progress:
-                progress(blocknum / blockstowrite * 100)
-            lock, result = self.update_block(address=blocknum, length=blocksize,
-                                              data=tag.data[
-                                                  blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) +
-                                                                              tag.bytesPerPage])
-            if lock!=0x0:
-                if lock!=0xF and self.logger:
-                    self.logger(f"Error on writing block {blocknum}")
-                    break
-                else:
-                    break
+        blockstowrite = list(range(min(blocks, tag.pagesCount)))
+        if blocklist is not None:
+            blockstowrite = [blocknum for blocknum in blockstowrite if blocknum in blocklist]
+        candidates = blockstowrite
+        from_cache = False
+
+        def write_blocks(blocknums):
+            for idx, blocknum in enumerate(blocknums):
+                if progress:
+                    progress(idx / len(blocknums) * 100)
+                lock, result = self.update_block(address=blocknum, length=blocksize,
+                                                  data=tag.data[
+                                                      blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) +
+                                                                                  tag.bytesPerPage])
+                if lock!=0x0:
+                    # Partially written, the cached copy can't be trusted anymore
+                    self.dump_cache.clear()
+                    if lock!=0xF and self.logger:
+                        self.logger(f"Error on writing block {blocknum}")
+                    return False
+            return True
+
+        # The diff dump and all writes share one transparent session
+        with self.transparent_session():
+            if diff:
+                current = self.dump_cache.get(tag.uid)
+                from_cache = current is not None and \
+                    len(current) >= (max(blockstowrite, default=-1) + 1) * tag.bytesPerPage
+                if not from_cache:
+                    self.logger("Reading tag to find changed blocks ...")
+                    current = self.dump(blocksize=blocksize).data
+                dirty = get_dirty_blocks(current, filldata, tag.bytesPerPage, min(blocks, tag.pagesCount))
+                blockstowrite = [blocknum for blocknum in blockstowrite if blocknum in dirty]
+                self.logger(f"Writing {len(blockstowrite)} changed blocks ...")
+            written = write_blocks(blockstowrite)
+            if written and from_cache:
+                # The tag may have been changed elsewhere and put back between two polls, then the cached
+                # dump is outdated. Read it back and write what the diff missed.
+                current = self.dump(blocksize=blocksize).data
+                dirty = get_dirty_blocks(current, filldata, tag.bytesPerPage, min(blocks, tag.pagesCount))
+                missed = [blocknum for blocknum in candidates if blocknum in dirty]
+                if missed:
+                    self.logger(f"Tag differed from the cached dump, writing {len(missed)} more blocks ...")
+                    written = write_blocks(missed)
+                    blockstowrite = blockstowrite + missed
+            if written:
+                self.dump_cache.update(tag.uid, filldata, blockstowrite, tag.bytesPerPage)
         if progress:
             progress(100)
         return True
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Compiled cache of the YAML databases (openprinttag-database, OpenPrintTag enums, material temps), no Qt in here.
+# All parsed files are kept in one pickle in the user cache dir, a file is parsed again only if its
+# mtime or size changed. OPENPRINTTAG_DB_CACHE=0 keeps the cache in memory only,
+# OPENPRINTTAG_CACHE_DIR moves it.
+# Changed files are parsed in a process pool with libyaml's CSafeLoader if available,
+# load_vendors() hands out each vendor as soon as its files are parsed.
+# The materials and packages built from them are kept in DB_LRU caches keyed by vendor and material slug.
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+
+import yaml
+
+try:
+    YAML_LOADER = yaml.CSafeLoader
+except AttributeError:
+    # PyYAML built without libyaml
+    YAML_LOADER = yaml.SafeLoader
+
+DB_CACHE_VERSION = 1
+DB_CACHE_FILENAME = "database.pickle"
+
+script_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DATABASE_PATH = os.path.join(script_path, "Library", "openprinttag-database", "data")
+OPENPRINTTAG_DATA_PATH = os.path.join(script_path, "Library", "OpenPrintTag", "data")
+LOCAL_DATABASE_PATH = os.path.join(script_path, "database")
+DB_CACHE_PATHS = (DATABASE_PATH, OPENPRINTTAG_DATA_PATH, LOCAL_DATABASE_PATH)
+
+# Below this many changed files the pool start up costs more than it saves
+DB_POOL_MIN_FILES = 64
+# Entries of the material (per vendor) and package (per vendor and material) caches
+DB_LRU_VENDORS = 32
+DB_LRU_MATERIALS = 512
+
+
+def user_cache_dir() -> str:
+    if os.environ.get("OPENPRINTTAG_CACHE_DIR"):
+        return os.environ["OPENPRINTTAG_CACHE_DIR"]
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "openprinttaggui")
+
+
+def scan_yaml_files(path: str, files: dict):
+    """
+    Adds filename -> (mtime_ns, size) of all .yaml files below path
+    """
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir():
+            scan_yaml_files(entry.path, files)
+        elif entry.name.endswith(".yaml"):
+            st = entry.stat()
+            files[entry.path] = (st.st_mtime_ns, st.st_size)
+
+
+def parse_yaml_files(filenames: list) -> list:
+    """
+    Runs in the pool workers, returns (filename, data, error) per file
+    """
+    result = []
+    for filename in filenames:
+        try:
+            with open(filename, "r", encoding="utf8") as rf:
+                result.append((filename, yaml.load(rf, Loader=YAML_LOADER), None))
+        except Exception as e:
+            result.append((filename, None, str(e)))
+    return result
+
+
+def pool_workers(workers: int = None) -> int:
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(workers, 1)
+
+
+class DB_Cache:
+    def __init__(self, filename: str = None, persistent: bool = None, logger=None):
+        if persistent is None:
+            persistent = os.environ.get("OPENPRINTTAG_DB_CACHE", "1") != "0"
+        if filename is None:
+            filename = os.path.join(user_cache_dir(), DB_CACHE_FILENAME)
+        self.filename = filename
+        self.persistent = persistent
+        self.logger = logger
+        self.files = {}  # filename -> (mtime_ns, size, parsed content or None if it didn't parse)
+        self.errors = {}  # filename -> yaml error of the last parse
+        self.dirty = False
+        self.generation = 0  # Counts parsed files, tells DB_LRU its entries may be outdated
+        self.lock = threading.Lock()
+        self.stats = dict(loaded=0, parsed=0, removed=0, load_ms=0.0, update_ms=0.0, workers=1)
+        if persistent:
+            self.load()
+
+    def load(self):
+        start = time.perf_counter()
+        try:
+            with open(self.filename, "rb") as rf:
+                content = pickle.load(rf)
+            if content.get("version") == DB_CACHE_VERSION and content.get("yaml") == yaml.__version__:
+                self.files = content["files"]
+                self.errors = content.get("errors", {})
+                self.stats["loaded"] = len(self.files)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # Broken or foreign cache, it gets rebuilt
+            if self.logger is not None:
+                self.logger(f"Ignoring database cache {self.filename}: {str(e)}")
+        self.stats["load_ms"] = (time.perf_counter() - start) * 1000
+
+    def save(self, logger=None):
+        """
+        logger: replaces the cache's logger, for callers on another thread than the one it reports to
+        """
+        if logger is None:
+            logger = self.logger
+        if not self.persistent or not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            tmpname = self.filename + f".{os.getpid()}.tmp"
+            with self.lock:
+                content = dict(version=DB_CACHE_VERSION, yaml=yaml.__version__, files=dict(self.files),
+                               errors=dict(self.errors))
+            with open(tmpname, "wb") as wf:
+                pickle.dump(content, wf, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self.filename)
+            self.dirty = False
+        except OSError as e:
+            if logger is not None:
+                logger(f"Couldn't save database cache {self.filename}: {str(e)}")
+
+    def clear(self):
+        self.files = {}
+        self.errors = {}
+        self.dirty = True
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def store(self, filename: str, stamp: tuple, data, error: str = None):
+        with self.lock:
+            self.files[filename] = stamp + (data,)
+            if error is None:
+                self.errors.pop(filename, None)
+            else:
+                self.errors[filename] = error
+            self.stats["parsed"] += 1
+            self.generation += 1
+            self.dirty = True
+
+    def parse(self, filename: str, stamp: tuple):
+        _, data, error = parse_yaml_files([filename])[0]
+        self.store(filename, stamp, data, error)
+        return data
+
+    def scan(self, paths=DB_CACHE_PATHS) -> dict:
+        """
+        Returns filename -> (mtime_ns, size) of the new and changed files below paths, drops removed ones
+        """
+        current = {}
+        for path in paths:
+            scan_yaml_files(path, current)
+        with self.lock:
+            for filename in list(self.files):
+                if filename not in current and any(filename.startswith(path + os.sep) for path in paths):
+                    del self.files[filename]
+                    self.errors.pop(filename, None)
+                    self.stats["removed"] += 1
+                    self.dirty = True
+        stale = {}
+        for filename, stamp in current.items():
+            entry = self.files.get(filename)
+            if entry is None or entry[:2] != stamp:
+                stale[filename] = stamp
+        return stale
+
+    def parse_batches(self, batches: list, stamps: dict, workers: int = None, logger=None):
+        """
+        Parses lists of files, in a process pool if there are enough of them. Yields each batch once
+        its files are in the cache. logger replaces the cache's logger like in save().
+        """
+        if logger is None:
+            logger = self.logger
+        workers = pool_workers(workers)
+        done = set()
+        if workers > 1 and sum(len(batch) for batch in batches) >= DB_POOL_MIN_FILES:
+            pool = None
+            try:
+                # Forking a process that runs Qt and loader threads can deadlock the child
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                futures = {pool.submit(parse_yaml_files, batch): idx for idx, batch in enumerate(batches)}
+                self.stats["workers"] = workers
+                for future in as_completed(futures):
+                    for filename, data, error in future.result():
+                        self.store(filename, stamps[filename], data, error)
+                    done.add(futures[future])
+                    yield futures[future]
+            except Exception as e:
+                # No processes allowed or a broken worker, whatever is left gets parsed right here
+                if logger is not None:
+                    logger(f"Parsing the database in one process: {str(e)}")
+            finally:
+                # Also reached if the caller stops early, queued batches are dropped then
+                if pool is not None:
+                    pool.shutdown(wait=True, cancel_futures=True)
+        for idx, batch in enumerate(batches):
+            if idx in done:
+                continue
+            for filename in batch:
+                self.parse(filename, stamps[filename])
+            yield idx
+
+    def update(self, paths=DB_CACHE_PATHS, workers: int = None):
+        """
+        Brings the cache in line with the YAML files below paths: new and changed files are parsed,
+        removed ones dropped. Saves the cache if anything changed.
+        """
+        start = time.perf_counter()
+        stale = self.scan(paths)
+        filenames = sorted(stale)
+        chunk = max(len(filenames) // (pool_workers(workers) * 4), 1)
+        for _ in self.parse_batches([filenames[idx:idx + chunk] for idx in range(0, len(filenames), chunk)],
+                                    stale, workers):
+            pass
+        self.stats["update_ms"] = (time.perf_counter() - start) * 1000
+        self.save()
+
+    def cached_yaml(self, filename: str):
+        """
+        Like load_yaml(), without checking the file again, for files update() or scan() just went through
+        """
+        entry = self.files.get(filename)
+        if entry is None:
+            return self.load_yaml(filename)
+        error = self.errors.get(filename)
+        if error is not None:
+            raise Exception(error)
+        return entry[2]
+
+    def load_yaml(self, filename: str):
+        """
+        Parsed content of filename, like yaml.safe_load(open(filename)). Raises the YAML error of a broken file.
+        """
+        st = os.stat(filename)
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self.files.get(filename)
+        if entry is None or entry[:2] != stamp:
+            # Outside of the scanned paths or changed since the last update
+            data = self.parse(filename, stamp)
+        else:
+            data = entry[2]
+        error = self.errors.get(filename)
+        if error is not None:
+            raise Exception(error)
+        return data
+
+
+class DB_LRU:
+    """
+    Bounded cache of objects built from the parsed files, the least recently used entry goes first.
+    All entries are dropped once the DB_Cache parsed a new or changed file.
+    """
+
+    def __init__(self, cache: DB_Cache, maxsize: int):
+        self.cache = cache
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.generation = cache.generation
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def check_generation(self):
+        if self.generation != self.cache.generation:
+            self.entries.clear()
+            self.generation = self.cache.generation
+
+    def __contains__(self, key) -> bool:
+        with self.lock:
+            self.check_generation()
+            return key in self.entries
+
+    def get(self, key, loader, logger=None):
+        """
+        loader(logger) builds the value on a miss. Its messages are kept with the entry until a call
+        with a logger reports them, so errors of a prefetch without logger still show up on the first read.
+        """
+        with self.lock:
+            self.check_generation()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                value, messages = self.entries[key]
+                if logger is not None and messages:
+                    self.entries[key] = (value, [])
+                else:
+                    messages = []
+                miss = False
+            else:
+                self.misses += 1
+                generation = self.generation
+                miss = True
+        if not miss:
+            for message in messages:
+                logger(message)
+            return value
+        # Built outside of the lock, a prefetch must not block the GUI
+        messages = []
+        value = loader(messages.append)
+        if logger is not None:
+            for message in messages:
+                logger(message)
+            messages = []
+        with self.lock:
+            self.check_generation()
+            if generation == self.generation:
+                self.entries[key] = (value, messages)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def vendor_materials(cache: DB_Cache, index: dict, logger=None) -> dict:
+    """
+    material slug -> material of one vendor, index is the vendor's entry of database_index()
+    """
+    filaments = {}
+    for material in index:
+        fn = index[material]["file"]
+        try:
+            fd = SimpleNamespace(**cache.load_yaml(fn))
+            if hasattr(fd, "slug"):
+                filaments[fd.slug] = fd
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            if logger is not None:
+                logger(f"YAML Error in {fn}: {str(e)}")
+    return filaments
+
+
+def material_packages(cache: DB_Cache, package_files: list, materialname: str, logger=None) -> list:
+    packages = []
+    for fn in package_files:
+        try:
+            fd = SimpleNamespace(**cache.load_yaml(fn))
+            if hasattr(fd, "material") and "slug" in fd.material:
+                if fd.material["slug"] == materialname:
+                    packages.append(fd)
+        except Exception as e:
+            if logger is not None:
+                logger(f"YAML Error in {fn}: {str(e)}")
+    return packages
+
+
+def database_files(filenames, root: str = DATABASE_PATH):
+    """
+    Sorts the files below root into brand file, material files and package files per vendor slug
+    """
+    prefix = root + os.sep
+    brands = {}
+    materials = {}
+    packages = {}
+    for filename in sorted(filenames):
+        if not filename.startswith(prefix):
+            continue
+        parts = filename[len(prefix):].split(os.sep)
+        if len(parts) == 2 and parts[0] == "brands":
+            brands[parts[1][:-len(".yaml")]] = filename
+        elif len(parts) >= 3 and parts[0] == "materials":
+            materials.setdefault(parts[1], []).append(filename)
+        elif len(parts) >= 3 and parts[0] == "material-packages":
+            packages.setdefault(parts[1], []).append(filename)
+    return brands, materials, packages
+
+
+def vendor_index(cache: DB_Cache, material_files: list, package_files: list, logger=None) -> dict:
+    """
+    material slug -> {"file": material file, "packages": [package files], "gtins": {gtin: package file}},
+    packages are assigned by the material.slug inside them
+    """
+    index = {}
+    for filename in material_files:
+        slug = os.path.basename(filename)[:-len(".yaml")]
+        try:
+            content = cache.cached_yaml(filename)
+            if isinstance(content, dict) and "slug" in content:
+                slug = content["slug"]
+        except Exception:
+            pass  # Reported when the material is read
+        index[slug] = dict(file=filename, packages=[], gtins={})
+    for filename in package_files:
+        try:
+            content = cache.cached_yaml(filename)
+        except Exception as e:
+            if logger is not None:
+                logger(f"YAML Error in {filename}: {str(e)}")
+            continue
+        material = content.get("material") if isinstance(content, dict) else None
+        if isinstance(material, dict) and material.get("slug") in index:
+            index[material["slug"]]["packages"].append(filename)
+            gtin = gtin_key(content.get("gtin"))
+            if gtin is not None:
+                index[material["slug"]]["gtins"][gtin] = filename
+    return index
+
+
+def gtin_key(value):
+    """
+    GTINs as int, leading zeros of GTIN-12/13/14 don't matter then. None if value isn't one.
+    """
+    try:
+        gtin = int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    return gtin if gtin > 0 else None
+
+
+def gtin_index(index: dict) -> dict:
+    """
+    gtin -> (vendor slug, material slug, package file) of a database_index() or a part of it
+    """
+    gtins = {}
+    for vendor, materials in index.items():
+        for material, entry in materials.items():
+            for gtin, filename in entry.get("gtins", {}).items():
+                gtins[gtin] = (vendor, material, filename)
+    return gtins
+
+
+def database_index(cache: DB_Cache, root: str = DATABASE_PATH, logger=None) -> dict:
+    """
+    vendor slug -> material slug -> {"file": material file, "packages": [package files]} in one pass over
+    the files the last update() found. Vendors without materials are left out.
+    """
+    brands, materials, packages = database_files(cache.files, root)
+    index = {}
+    for vendor in brands:
+        if vendor in materials:
+            index[vendor] = vendor_index(cache, materials[vendor], packages.get(vendor, []), logger)
+    return index
+
+
+def load_vendors(cache: DB_Cache, root: str = DATABASE_PATH, workers: int = None, logger=None):
+    """
+    Yields (vendor slug, brand file content, vendor index) per vendor with materials. Cached vendors come
+    right away, the others as soon as the pool has parsed all of their files. Saves the cache at the end.
+    All messages go to logger, also those of the cache, so a loader thread can pass a Qt signal.
+    """
+    stale = cache.scan([root])
+    brands, materials, packages = database_files(set(cache.files) | set(stale), root)
+
+    def vendor_entry(vendor):
+        try:
+            content = cache.cached_yaml(brands[vendor])
+        except Exception as e:
+            if logger is not None:
+                logger(f"YAML Error in {brands[vendor]}: {str(e)}")
+            return None
+        return vendor, content, vendor_index(cache, materials[vendor], packages.get(vendor, []), logger)
+
+    batches = []
+    pending = []
+    for vendor in brands:
+        if vendor not in materials:
+            continue
+        batch = [filename for filename in [brands[vendor]] + materials[vendor] + packages.get(vendor, [])
+                 if filename in stale]
+        if batch:
+            batches.append(batch)
+            pending.append(vendor)
+        else:
+            entry = vendor_entry(vendor)
+            if entry is not None:
+                yield entry
+    # Files of no listed vendor go last so the cache is complete
+    assigned = {filename for batch in batches for filename in batch}
+    leftover = sorted(filename for filename in stale if filename not in assigned)
+    if leftover:
+        batches.append(leftover)
+    for idx in cache.parse_batches(batches, stale, workers, logger=logger):
+        if idx < len(pending):
+            entry = vendor_entry(pending[idx])
+            if entry is not None:
+                yield entry
+    cache.save(logger=logger)
+
+
+if __name__ == "__main__":
+    cache = DB_Cache(logger=print)
+    cache.update()
+    print(f"{cache.filename}: {len(cache.files)} files, {cache.stats['loaded']} from cache, "
+          f"{cache.stats['parsed']} parsed, {cache.stats['removed']} removed, "
+          f"load {cache.stats['load_ms']:.1f} ms, update {cache.stats['update_ms']:.1f} ms")
+    for filename, error in cache.errors.items():
+        print(f"YAML Error in {filename}: {error}")
+    index = database_index(cache)
+    print(f"{len(index)} vendors, {sum(len(materials) for materials in index.values())} materials, "
+          f"{sum(len(material['packages']) for materials in index.values() for material in materials.values())} "
+          f"packages, {len(gtin_index(index))} GTINs")
@@ -0,0 +1,52 @@
+from PySide6.QtCore import QObject, QRunnable, Signal, Slot
+
+from openprinttaggui.Library.database_cache import DB_Cache, DATABASE_PATH, load_vendors
+
+
+class DatabaseLoaderWorker(QObject):
+    """
+    Loads the openprinttag-database in its own thread, every vendor is sent to the GUI as soon as it is parsed
+    """
+    vendor_loaded = Signal(str, object, object)  # vendor slug, brand file content, material index
+    status = Signal(str)
+    finished = Signal()
+
+    def __init__(self, cache: DB_Cache, root: str = DATABASE_PATH, workers: int = None):
+        super().__init__()
+        self.cache = cache
+        self.root = root
+        self.workers = workers
+        self.is_running = True
+
+    def stop(self):
+        self.is_running = False
+
+    @Slot()
+    def run(self):
+        try:
+            for vendor, content, index in load_vendors(self.cache, root=self.root, workers=self.workers,
+                                                       logger=self.status.emit):
+                if not self.is_running:
+                    break
+                self.vendor_loaded.emit(vendor, content, index)
+        except Exception as e:
+            self.status.emit(f"Error loading the database: {str(e)}")
+        self.finished.emit()
+
+
+class DatabasePrefetchWorker(QRunnable):
+    """
+    Fills the material and package caches for vendors the user is likely to pick next
+    """
+
+    def __init__(self, prefetch, vendors: list):
+        super().__init__()
+        self.prefetch = prefetch
+        self.vendors = vendors
+
+    @Slot()
+    def run(self):
+        try:
+            self.prefetch(self.vendors)
+        except Exception:
+            pass  # Only a prefetch, the real read reports the error
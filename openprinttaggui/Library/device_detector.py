@@ -1,72 +1,117 @@
-import hid
-import serial.tools.list_ports
+import select
+import socket
+import sys
+import time
+
 from PySide6.QtCore import QThread, Signal, QObject, Slot
 
-device_list = [
-    {"vid": 0x9ac4, "pid": 0x4b8f, "reader": 1, "name": "proxmark3"},
-    {"vid": 0x0471, "pid": 0xa112, "reader": 2, "name": "s9"},
-    {"vid": 0x072F, "pid": 0x2303, "reader": 3, "name": "acr1552u-m1"},
-    {"vid": 0x072F, "pid": 0x2308, "reader": 3, "name": "acr1552u-m2"},
-    {"vid": 0x0e0f, "pid": 0x0003, "reader": 3, "name": "VMWARE-ccid"},
+from openprinttaggui.Library.nfc_drivers import driver_devices, scan_devices
+
+# NFC readers come from the driver registry
+device_list = driver_devices() + [
     {"vid": 0xe4b2, "pid": 0x0045, "reader": -1, "name": "td1s"},
 ]
 
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+# Subsystems whose add/remove events can change the list of serial or hid devices
+UEVENT_SUBSYSTEMS = {b"usb", b"tty", b"hidraw", b"usbmisc"}
+# One plug produces a burst of events, wait for it to settle before scanning
+UEVENT_SETTLE_MS = 100
+
+
+def open_uevent_socket():
+    """
+    Netlink socket receiving kernel uevents, None if not available (non Linux or not permitted)
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, UEVENT_KERNEL_GROUP))
+    except (OSError, AttributeError):
+        return None
+    return sock
+
+
+def parse_uevent(msg: bytes) -> dict:
+    # "add@/devices/..." followed by zero separated KEY=VALUE pairs
+    fields = msg.split(b"\0")
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            event[key] = value
+    return event
+
 
 class DeviceDetectorWorker(QObject):
     device_detected = Signal(dict)
     device_removed = Signal(dict)
     finished = Signal()   # optional
 
-    def __init__(self, device_list, poll_interval_ms=1500):
+    def __init__(self, device_list, poll_interval_ms=1500, use_uevents=True):
         super().__init__()
         self.device_list = device_list
+        self.device_map = {(dev["vid"], dev["pid"]): dev for dev in device_list}
         self.poll_interval = poll_interval_ms
+        self.use_uevents = use_uevents
         self.is_running = True
         self.previous_state = set()
 
     def stop(self):
         self.is_running = False
 
+    def update_state(self, current_state: set):
+        # Detect added / removed
+        for dev_tuple in current_state - self.previous_state:
+            self.device_detected.emit(dict(dev_tuple))
+
+        for dev_tuple in self.previous_state - current_state:
+            d = dict(dev_tuple)
+            d["port"] = None
+            self.device_removed.emit(d)
+
+        self.previous_state = current_state.copy()
+
     @Slot()
     def start_detection(self):
-        while self.is_running:
-            current_state = set()
-
-            for dev_tpl in self.device_list:
-                # --- Serial check ---
-                try:
-                    for port in serial.tools.list_ports.comports():
-                        if port.vid == dev_tpl["vid"] and port.pid == dev_tpl["pid"]:
-                            d = dev_tpl.copy()
-                            d["port"] = port.device
-                            d["type"] = "serial"
-                            current_state.add(tuple(sorted(d.items())))
-                except Exception:
-                    pass  # very important - never let exception kill thread
-
-                # --- HID check ---
-                try:
-                    for info in hid.enumerate(0, 0):
-                        if info["vendor_id"] == dev_tpl["vid"] and info["product_id"] == dev_tpl["pid"]:
-                            d = dev_tpl.copy()
-                            d["port"] = info["path"].decode(errors='replace')
-                            d["type"] = "hid"
-                            current_state.add(tuple(sorted(d.items())))
-                except Exception:
-                    pass
-
-            # Detect added / removed
-            for dev_tuple in current_state - self.previous_state:
-                self.device_detected.emit(dict(dev_tuple))
-
-            for dev_tuple in self.previous_state - current_state:
-                d = dict(dev_tuple)
-                d["port"] = None
-                self.device_removed.emit(d)
-
-            self.previous_state = current_state.copy()
+        sock = open_uevent_socket() if self.use_uevents else None
+        if sock is None:
+            self.poll_devices()
+        else:
+            try:
+                self.watch_uevents(sock)
+            finally:
+                sock.close()
+        self.finished.emit()
 
+    def poll_devices(self):
+        while self.is_running:
+            self.update_state(scan_devices(self.device_map))
             # Sleep – do NOT use QTimer here
             QThread.msleep(self.poll_interval)
 
-        self.finished.emit()
+    def watch_uevents(self, sock):
+        """
+        Rescans only when the kernel reports a usb, tty or hid device coming or going
+        """
+        self.update_state(scan_devices(self.device_map))
+        deadline = None
+        while self.is_running:
+            timeout = 0.5 if deadline is None else max(deadline - time.monotonic(), 0)
+            ready, _, _ = select.select([sock], [], [], timeout)
+            if ready:
+                try:
+                    msg = sock.recv(0x4000)
+                    event = parse_uevent(msg)
+                    changed = event.get(b"ACTION") in (b"add", b"remove") and \
+                        event.get(b"SUBSYSTEM") in UEVENT_SUBSYSTEMS
+                except OSError:
+                    # ENOBUFS: the kernel dropped events, one of them may have been ours
+                    changed = True
+                if changed and deadline is None:
+                    deadline = time.monotonic() + UEVENT_SETTLE_MS / 1000
+            if deadline is not None and time.monotonic() >= deadline:
+                deadline = None
+                self.update_state(scan_devices(self.device_map))
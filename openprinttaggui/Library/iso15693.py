@@ -83,3 +83,125 @@ class ISO15_TAG_T:
             self.state = f.read(1)[0]
             self.expectFast = True if f.read(1)[0] == 1 else False
             self.expectFsk = True if f.read(1)[0] == 1 else False
+
+
+class ISO15_DUMP_CACHE_T:
+    """
+    Last known contents of the tag on one reader, refreshed by every dump and restore.
+    Each driver instance owns one, it is cleared when the reader is closed and when the tag is
+    gone or replaced, so a cached dump is only used while the same tag stayed on the reader.
+    """
+
+    def __init__(self):
+        self.uid = None
+        self.data = None
+
+    def store(self, uid, data):
+        self.uid = bytes(uid)
+        self.data = bytes(data)
+
+    def update(self, uid, data, blocknums, bytesPerPage: int):
+        """
+        Overlays the written blocks of data on the cached tag contents. Without a cached dump
+        only the written blocks from block 0 up to the first gap are known.
+        """
+        cached = bytearray(self.get(uid) or b"")
+        for blocknum in sorted(blocknums):
+            start = blocknum * bytesPerPage
+            if start > len(cached):
+                break
+            cached[start:start + bytesPerPage] = data[start:start + bytesPerPage]
+        if cached:
+            self.store(uid, cached)
+
+    def get(self, uid):
+        if uid is None or self.uid != bytes(uid):
+            return None
+        return self.data
+
+    def check_uid(self, uid):
+        """
+        Called with every detected uid, no tag or another tag invalidates the cached dump
+        """
+        if uid is None or self.uid != bytes(uid):
+            self.clear()
+
+    def clear(self):
+        self.uid = None
+        self.data = None
+
+
+def get_dirty_blocks(current: bytes, new: bytes, bytesPerPage: int, blocks: int) -> list:
+    """
+    Returns the block numbers within the first blocks that differ between current and new
+    """
+    dirty = []
+    for blocknum in range(blocks):
+        start = blocknum * bytesPerPage
+        if current[start:start + bytesPerPage] != new[start:start + bytesPerPage]:
+            dirty.append(blocknum)
+    return dirty
+
+
+# NFC Forum Type 5 tag layout: capability container followed by TLV blocks
+NDEF_CC_MAGIC = (0xE1, 0xE2)
+NDEF_TLV_NULL = 0x00
+NDEF_TLV_NDEF = 0x03
+NDEF_TLV_TERMINATOR = 0xFE
+# 8 byte capability container + 4 byte NDEF TLV header
+NDEF_HEADER_SIZE = 12
+
+
+def get_ndef_size(data: bytes):
+    """
+    Parses capability container and TLVs, returns the number of bytes up to the end of the NDEF TLV.
+    If data ends before the NDEF TLV header, a size beyond len(data) is returned: read that much and retry.
+    Returns None if the tag isn't NDEF formatted.
+    """
+    if len(data) < 4:
+        return 4
+    if data[0] not in NDEF_CC_MAGIC:
+        return None
+    # MLEN of 0 means an 8 byte capability container
+    pos = 8 if data[2] == 0 else 4
+    while True:
+        if pos + 1 > len(data):
+            return pos + 4
+        tlv = data[pos]
+        if tlv == NDEF_TLV_NULL:
+            pos += 1
+            continue
+        if tlv == NDEF_TLV_TERMINATOR:
+            return None
+        if pos + 2 > len(data):
+            return pos + 4
+        length = data[pos + 1]
+        header = 2
+        if length == 0xFF:
+            if pos + 4 > len(data):
+                return pos + 4
+            length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+            header = 4
+        if tlv == NDEF_TLV_NDEF:
+            return pos + header + length
+        pos += header + length
+
+
+def read_ndef_blocks(read_blocks, tag: ISO15_TAG_T) -> int:
+    """
+    Reads only the blocks holding capability container and NDEF TLV into tag.data, using
+    read_blocks(start, end) which returns the block number it stopped at. Tags without NDEF
+    layout are read completely. Returns the number of blocks read.
+    """
+    blocks = 0
+    needed = NDEF_HEADER_SIZE
+    while True:
+        end = min(-(-needed // tag.bytesPerPage), tag.pagesCount)
+        if end <= blocks:
+            return blocks
+        blocks = read_blocks(blocks, end)
+        if blocks < end:
+            return blocks
+        needed = get_ndef_size(tag.data[:blocks * tag.bytesPerPage])
+        if needed is None:
+            needed = tag.pagesCount * tag.bytesPerPage
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# CRC16 of ISO15693 frames, crcmod.mkCrcFun(0x11021, initCrc=0, xorOut=0xFFFF, rev=True)
+import timeit
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ISO15693_CRC16_POLY = 0x8408
+
+
+def make_crc16_table(poly: int = ISO15693_CRC16_POLY) -> tuple:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC16_TABLE = make_crc16_table()
+
+
+def crc16_bitwise(data: bytes) -> int:
+    """
+    Reference implementation, one bit per iteration
+    """
+    poly = ISO15693_CRC16_POLY
+    crc = 0xFFFF
+
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+
+    return crc ^ 0xFFFF
+
+
+def crc16(data: bytes) -> int:
+    table = CRC16_TABLE
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc ^ 0xFFFF
+
+
+def crc16_check(frame: bytes) -> bool:
+    """
+    Returns True if the last two bytes of frame hold the little endian crc16 of the rest
+    """
+    if len(frame) < 2:
+        return False
+    return crc16(frame[:-2]) == frame[-2] | (frame[-1] << 8)
+
+
+def crc16_check_batch(frames: list) -> list:
+    """
+    Verifies the trailing crc16 of many frames at once. Frames of the same length are
+    checked together as numpy columns, falls back to crc16_check without numpy.
+    """
+    if np is None:
+        return [crc16_check(frame) for frame in frames]
+    results = [False] * len(frames)
+    bylength = {}
+    for idx, frame in enumerate(frames):
+        if len(frame) >= 2:
+            bylength.setdefault(len(frame), []).append(idx)
+    table = np.array(CRC16_TABLE, dtype=np.uint16)
+    for length, indices in bylength.items():
+        arr = np.frombuffer(b"".join(bytes(frames[idx]) for idx in indices), dtype=np.uint8).reshape(len(indices), length)
+        crc = np.full(len(indices), 0xFFFF, dtype=np.uint16)
+        for col in range(length - 2):
+            crc = (crc >> 8) ^ table[(crc ^ arr[:, col]) & 0xFF]
+        crc ^= 0xFFFF
+        expected = arr[:, length - 2].astype(np.uint16) | (arr[:, length - 1].astype(np.uint16) << 8)
+        for idx, ok in zip(indices, (crc == expected).tolist()):
+            results[idx] = ok
+    return results
+
+
+def bench(count: int = 2000):
+    # Typical frames: read single block response and a 32 block read multiple response
+    frames = []
+    for size in (5, 161):
+        raw = bytes(range(size))
+        frames.append(raw + int.to_bytes(crc16_bitwise(raw), 2, 'little'))
+    for frame in frames:
+        raw = frame[:-2]
+        t_bitwise = timeit.timeit(lambda: crc16_bitwise(raw), number=count)
+        t_table = timeit.timeit(lambda: crc16(raw), number=count)
+        print(f"{len(raw):4d} bytes: bitwise {t_bitwise / count * 1e6:8.2f} us, table {t_table / count * 1e6:8.2f} us, "
+              f"speedup {t_bitwise / t_table:.1f}x")
+    archive = frames * 5000
+    t_single = timeit.timeit(lambda: [crc16_check(frame) for frame in archive], number=1)
+    t_batch = timeit.timeit(lambda: crc16_check_batch(archive), number=1)
+    print(f"{len(archive)} frames: crc16_check {t_single * 1000:.1f} ms, crc16_check_batch {t_batch * 1000:.1f} ms"
+          f"{'' if np is not None else ' (numpy not available)'}")
+
+
+if __name__ == "__main__":
+    bench()
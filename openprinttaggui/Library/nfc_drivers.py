@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Registry of the NFC reader drivers and the fast paths each of them supports, no Qt in here.
+# Third party readers register through the "openprinttaggui.readers" entry point group:
+#   [project.entry-points."openprinttaggui.readers"]
+#   myreader = "mypackage.driver:MyReaderDriver"
+from abc import ABC, abstractmethod
+from importlib.metadata import entry_points
+
+NFC_DRIVER_ENTRY_POINT_GROUP = "openprinttaggui.readers"
+
+# Reader ids as reported by the device detector
+NFC_READER_PM3 = 1
+NFC_READER_S9 = 2
+NFC_READER_ACS = 3
+
+
+class NFC_Driver(ABC):
+    """
+    Describes one reader driver. open() returns a device with getUID(), dump(), restore() and close().
+    """
+    reader = 0
+    name = ""
+    label = ""  # Shown as "Connecting to <label>..."
+    aliases = []  # Other names for --reader, the trace channel name among them
+    devices = []  # USB ids for the device detector: {"vid": ..., "pid": ..., "name": ...}
+    # Capabilities
+    multi_block_read = False  # dump(multiblock=True)
+    multi_block_write = False  # restore(multiblock=True)
+    high_speed = False  # dump/restore(fast=True) selects the high data rate
+    presence_events = False  # Reader reports tag insert and remove itself (PC/SC)
+    max_frame_size = 0  # Max payload of one exchange in bytes
+    select_before_dump = True  # getUID() has to find the tag before dump/restore, else they select it themselves
+
+    @abstractmethod
+    def open(self, port: str = None, logger=print, reader_name: str = None, connect: bool = True):
+        pass
+
+    def capabilities(self) -> dict:
+        return dict(multi_block_read=self.multi_block_read, multi_block_write=self.multi_block_write,
+                    high_speed=self.high_speed, presence_events=self.presence_events,
+                    max_frame_size=self.max_frame_size)
+
+    def dump_args(self) -> dict:
+        """
+        Fastest dump strategy this driver supports
+        """
+        return dict(fast=self.high_speed, multiblock=self.multi_block_read)
+
+    def restore_args(self) -> dict:
+        """
+        Fastest restore strategy this driver supports
+        """
+        args = dict(fast=self.high_speed, diff=True)
+        if self.multi_block_write:
+            args["multiblock"] = True
+        return args
+
+
+class PM3_Driver(NFC_Driver):
+    reader = NFC_READER_PM3
+    name = "proxmark3"
+    label = "Proxmark3"
+    aliases = ["pm3"]
+    devices = [{"vid": 0x9ac4, "pid": 0x4b8f, "name": "proxmark3"}]
+    multi_block_read = True
+    high_speed = True
+    max_frame_size = 0x200  # PM3_CMD_DATA_SIZE
+    select_before_dump = False
+
+    def open(self, port: str = None, logger=print, reader_name: str = None, connect: bool = True):
+        from openprinttaggui.Library.pm3_nfc.pm3_hf15 import PM3_HF15
+        return PM3_HF15(port=port, baudrate=115200, logger=logger)
+
+    def dump_args(self) -> dict:
+        # Commands are pipelined over the serial link
+        args = super().dump_args()
+        args["pipeline"] = True
+        return args
+
+    def restore_args(self) -> dict:
+        args = super().restore_args()
+        args["pipeline"] = True
+        return args
+
+
+class S9_Driver(NFC_Driver):
+    reader = NFC_READER_S9
+    name = "s9"
+    label = "S9"
+    devices = [{"vid": 0x0471, "pid": 0xa112, "name": "s9"}]
+    multi_block_read = True
+    multi_block_write = True
+    max_frame_size = 0xff  # rlen/wlen of fw_readblock/fw_writeblock are single bytes
+
+    def open(self, port: str = None, logger=print, reader_name: str = None, connect: bool = True):
+        from openprinttaggui.Library.s9_nfc.s9_hf15 import S9_HF15
+        return S9_HF15(port=port, logger=logger)
+
+
+class ACS_Driver(NFC_Driver):
+    reader = NFC_READER_ACS
+    name = "acs"
+    label = "ACS"
+    devices = [
+        {"vid": 0x072F, "pid": 0x2303, "name": "acr1552u-m1"},
+        {"vid": 0x072F, "pid": 0x2308, "name": "acr1552u-m2"},
+        {"vid": 0x0e0f, "pid": 0x0003, "name": "VMWARE-ccid"},
+    ]
+    multi_block_read = True
+    high_speed = True
+    presence_events = True
+    max_frame_size = 0xf1  # ACS_READ_MULTI_MAX_BYTES
+
+    def open(self, port: str = None, logger=print, reader_name: str = None, connect: bool = True):
+        from openprinttaggui.Library.acs_nfc.acs_hf15 import ACS_HF15
+        return ACS_HF15(port=port, logger=logger, connect=connect, reader_name=reader_name)
+
+
+NFC_DRIVERS = {}
+NFC_DRIVERS_LOADED = False
+
+
+def register_driver(driver) -> NFC_Driver:
+    """
+    Registers a driver class or instance, replaces a registered driver with the same reader id
+    """
+    if isinstance(driver, type):
+        if not issubclass(driver, NFC_Driver):
+            raise Exception(f"{driver.__name__} is not an NFC_Driver")
+        if driver.__abstractmethods__:
+            raise Exception(f"{driver.__name__} doesn't implement {', '.join(sorted(driver.__abstractmethods__))}")
+        driver = driver()
+    if not isinstance(driver, NFC_Driver):
+        raise Exception(f"{driver} is not an NFC_Driver")
+    NFC_DRIVERS[driver.reader] = driver
+    return driver
+
+
+def load_drivers(logger=None) -> dict:
+    """
+    Registers the builtin drivers and the ones installed through entry points, only once
+    """
+    global NFC_DRIVERS_LOADED
+    if NFC_DRIVERS_LOADED:
+        return NFC_DRIVERS
+    NFC_DRIVERS_LOADED = True
+    for driver in (PM3_Driver, S9_Driver, ACS_Driver):
+        NFC_DRIVERS.setdefault(driver.reader, driver())
+    try:
+        eps = entry_points(group=NFC_DRIVER_ENTRY_POINT_GROUP)
+    except Exception:
+        eps = []
+    for ep in eps:
+        try:
+            register_driver(ep.load())
+        except Exception as e:
+            # A broken plugin must not take the builtin readers down
+            if logger is not None:
+                logger(f"Couldn't load reader driver {ep.name}: {str(e)}")
+    return NFC_DRIVERS
+
+
+def get_driver(reader: int) -> NFC_Driver:
+    driver = load_drivers().get(reader)
+    if driver is None:
+        raise Exception(f"Unknown nfc reader: {str(reader)}")
+    return driver
+
+
+def driver_devices() -> list:
+    """
+    USB ids of all registered drivers in the device detector's device_list format
+    """
+    devices = []
+    for driver in load_drivers().values():
+        for dev in driver.devices:
+            devices.append(dict(dev, reader=driver.reader))
+    return devices
+
+
+def scan_devices(device_map: dict) -> set:
+    """
+    Enumerates serial and hid devices once and returns the ones found in device_map, keyed by (vid, pid)
+    """
+    current_state = set()
+    # --- Serial check ---
+    try:
+        import serial.tools.list_ports
+        for port in serial.tools.list_ports.comports():
+            dev_tpl = device_map.get((port.vid, port.pid))
+            if dev_tpl is not None:
+                d = dev_tpl.copy()
+                d["port"] = port.device
+                d["type"] = "serial"
+                current_state.add(tuple(sorted(d.items())))
+    except Exception:
+        pass  # very important - never let exception kill thread
+
+    # --- HID check ---
+    try:
+        import hid
+        for info in hid.enumerate(0, 0):
+            dev_tpl = device_map.get((info["vendor_id"], info["product_id"]))
+            if dev_tpl is not None:
+                d = dev_tpl.copy()
+                d["port"] = info["path"].decode(errors='replace')
+                d["type"] = "hid"
+                current_state.add(tuple(sorted(d.items())))
+    except Exception:
+        pass
+    return current_state
+
+
+def find_driver(name) -> NFC_Driver:
+    """
+    Looks a driver up by reader id ("1") or name ("pm3", "proxmark3", "s9", "acs")
+    """
+    drivers = load_drivers()
+    if isinstance(name, int) or str(name).isdigit():
+        return get_driver(int(name))
+    name = str(name).lower()
+    for driver in drivers.values():
+        if name in (driver.name, driver.label.lower()) or name in driver.aliases:
+            return driver
+    raise Exception(f"Unknown nfc reader: {name}, known readers: " +
+                    ", ".join(driver.name for driver in drivers.values()))
+
+
+def find_reader(reader=None, port: str = None):
+    """
+    Returns (driver, port) of the first connected reader, optionally only of the given reader.
+    A port without reader has to be one of the detected devices, its reader is taken from there.
+    PC/SC readers don't show up as serial or hid devices, ACS is the fallback if nothing else is found.
+    """
+    driver = find_driver(reader) if reader is not None else None
+    if driver is not None and (port is not None or not driver.devices or driver.presence_events):
+        return driver, port
+    device_map = {}
+    for dev in driver_devices():
+        if driver is None or dev["reader"] == driver.reader:
+            device_map[(dev["vid"], dev["pid"])] = dev
+    for dev_tuple in sorted(scan_devices(device_map)):
+        dev = dict(dev_tuple)
+        if port is None or dev["port"] == port:
+            return get_driver(dev["reader"]), dev["port"]
+    if port is not None:
+        raise Exception(f"No known reader found on {port}, the reader type has to be given")
+    if driver is not None:
+        raise Exception(f"No {driver.label} reader found")
+    if NFC_READER_ACS in load_drivers():
+        return get_driver(NFC_READER_ACS), None
+    raise Exception("No nfc reader found")
+
+
+if __name__ == "__main__":
+    for reader, driver in sorted(load_drivers().items()):
+        print(f"{reader}: {driver.name} {driver.capabilities()}")
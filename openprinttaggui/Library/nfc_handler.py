@@ -1,8 +1,8 @@
-from PySide6.QtCore import QObject, Signal, QRunnable, Slot
+from PySide6.QtCore import QObject, Signal, Slot, QThread, Qt
+from smartcard.CardMonitoring import CardMonitor, CardObserver
+from smartcard.System import readers as pcsc_readers
 
-from openprinttaggui.Library.acs_nfc.acs_hf15 import ACS_HF15
-from openprinttaggui.Library.pm3_nfc.pm3_hf15 import PM3_HF15
-from openprinttaggui.Library.s9_nfc.s9_hf15 import S9_HF15
+from openprinttaggui.Library.nfc_drivers import get_driver, NFC_READER_ACS
 
 
 class NFC_WorkerSignals(QObject):
@@ -12,127 +12,307 @@ class NFC_WorkerSignals(QObject):
     error = Signal(str)  # Emits error message on failure
 
 
-class NFC_WriteTagWorker(QRunnable):
-    def __init__(self, parent, reader: int, port: str = None):
+class NFC_CardObserver(CardObserver):
+    def __init__(self, monitor):
         super().__init__()
-        self.signals = NFC_WorkerSignals()
-        self.parent = parent
-        self.reader = reader
-        self.port = port
+        self.monitor = monitor
 
-    @Slot()
-    def run(self):
-        self.signals.status.emit("Generating tag data...")
-        try:
-            tagdata = self.parent.generate_tag_data()
-        except Exception as e:
-            self.signals.error.emit(f"Failed to generate tag data: {str(e.__notes__)}")
-            return
+    def update(self, observable, actions):
+        # Called from pyscard's monitoring thread, the signals queue the events to the receivers
+        addedcards, removedcards = actions
+        for card in removedcards:
+            if self.monitor.accepts(card):
+                self.monitor.removed.emit(card)
+        for card in addedcards:
+            if self.monitor.accepts(card):
+                self.monitor.inserted.emit(card)
 
-        try:
-            if self.reader == 1:
-                self.signals.status.emit("Connecting to Proxmark3...")
-                dev = PM3_HF15(port=self.port, baudrate=115200, logger=self.signals.status.emit)
-            elif self.reader == 2:
-                self.signals.status.emit("Connecting to S9...")
-                dev = S9_HF15(port=self.port, logger=self.signals.status.emit)
-                if dev.getUID() == b"":
-                    self.signals.error.emit(f"Couldn't detect nfc tag.")
-                    return
-            elif self.reader == 3:
-                self.signals.status.emit("Connecting to ACS...")
-                dev = ACS_HF15(port=self.port, logger=self.signals.status.emit)
-                if dev.getUID() == b"":
-                    self.signals.error.emit(f"Couldn't detect nfc tag.")
-                    return
-            else:
-                self.signals.error.emit(f"Unknown nfc reader: {str(self.reader)}")
-                return
-        except Exception as e:
-            self.signals.error.emit(f"Failed to connect to reader: {str(e)}")
-            return
 
-        self.signals.status.emit("Writing to NFC tag ...")
-        try:
-            if dev.restore(data_or_filename=tagdata, fast=True, progress=self.signals.progress.emit):
-                self.signals.status.emit("Succeeded writing nfc tag")
-            else:
-                self.signals.error.emit("Error on writing nfc tag")
-        except Exception as e:
-            self.signals.error.emit(f"Error on reading nfc tag: {str(e)}")
+class NFC_CardPresenceMonitor(QObject):
+    """
+    Pushes PC/SC card insert and remove events, pyscard's CardMonitor waits in SCardGetStatusChange
+    instead of polling with CardRequest.
+    """
+    inserted = Signal(object)  # smartcard.Card.Card
+    removed = Signal(object)
+
+    def __init__(self, reader_name: str = None):
+        super().__init__()
+        self.reader_name = reader_name
+        self.monitor = None
+        self.observer = None
+
+    def accepts(self, card) -> bool:
+        return self.reader_name is None or str(card.reader) == self.reader_name
+
+    def start(self):
+        if self.monitor is not None:
             return
-        pass
+        self.observer = NFC_CardObserver(self)
+        self.monitor = CardMonitor()
+        # Cards already on a reader are reported right away
+        self.monitor.addObserver(self.observer)
 
+    def stop(self):
+        if self.monitor is not None:
+            self.monitor.deleteObserver(self.observer)
+            self.monitor = None
+            self.observer = None
 
-class NFC_ReadTagWorker(QRunnable):
-    def __init__(self, reader: int, port: str):
+
+# Closed sessions stay referenced until their I/O thread has finished
+NFC_CLOSING_SESSIONS = set()
+
+
+def release_session(session):
+    session.io_thread.wait()
+    NFC_CLOSING_SESSIONS.discard(session)
+
+
+class NFC_ReaderSession(QObject):
+    """
+    Keeps one reader open across detect, read and write requests. All device access
+    happens on the session's own I/O thread, the device is only closed by close().
+    """
+    detected = Signal(object)  # uid or b"" if no tag is present
+    written = Signal()
+    request_detect = Signal()
+    request_read = Signal()
+    request_write = Signal(object, object, object)  # tagdata, blocklist, uid
+    request_close = Signal()
+
+    def __init__(self, reader: int, port: str, reader_name: str = None):
         super().__init__()
         self.reader = reader
-        self.signals = NFC_WorkerSignals()
+        self.driver = get_driver(reader)
         self.port = port
+        # PC/SC reader this session is bound to, None takes the first card on any reader
+        self.reader_name = reader_name
+        self.dev = None
+        self.quiet = True
+        self.detect_pending = False
+        self.signals = NFC_WorkerSignals()
+        self.io_thread = QThread()
+        self.moveToThread(self.io_thread)
+        self.request_detect.connect(self.detect)
+        self.request_read.connect(self.read)
+        self.request_write.connect(self.write)
+        self.request_close.connect(self.close_device)
+        # PC/SC readers report card changes themselves, no need to poll them
+        self.presence = None
+        if self.driver.presence_events:
+            self.presence = NFC_CardPresenceMonitor(reader_name=reader_name)
+            self.presence.moveToThread(self.io_thread)
+            self.presence.inserted.connect(self.card_inserted)
+            self.presence.removed.connect(self.card_removed)
+        self.io_thread.start()
+        if self.presence is not None:
+            try:
+                self.presence.start()
+            except Exception:
+                # pcscd not reachable, fall back to polling
+                self.presence = None
 
-    @Slot()
-    def run(self):
+    @property
+    def presence_events(self) -> bool:
+        return self.presence is not None
+
+    def log(self, *args):
+        # Polling would flood the status bar, only report while reading or writing
+        if not self.quiet:
+            self.signals.status.emit(" ".join(str(arg) for arg in args))
+
+    def poll(self):
+        # Skip the poll if the previous one is still running
+        if not self.detect_pending:
+            self.detect_pending = True
+            self.request_detect.emit()
+
+    def close(self):
+        NFC_CLOSING_SESSIONS.add(self)
+        # Delivered to the thread the QThread object lives in, not to the finishing I/O thread
+        self.io_thread.finished.connect(lambda: release_session(self), Qt.QueuedConnection)
+        self.request_close.emit()
+
+    def open_device(self):
+        if self.dev is not None:
+            return self.dev
+        # With presence events the card gets connected on insert, don't wait for one here
+        self.dev = self.driver.open(port=self.port, logger=self.log, reader_name=self.reader_name,
+                                    connect=self.presence is None)
+        return self.dev
+
+    @Slot(object)
+    def card_inserted(self, card):
         try:
-            if self.reader == 1:
-                self.signals.status.emit("Connecting to Proxmark3...")
-                dev = PM3_HF15(port=self.port, baudrate=115200, logger=self.signals.status.emit)
-            elif self.reader == 2:
-                self.signals.status.emit("Connecting to S9...")
-                dev = S9_HF15(port=self.port, logger=self.signals.status.emit)
-                if dev.getUID() == b"":
-                    self.signals.error.emit(f"Couldn't detect nfc tag.")
-                    return
-            elif self.reader == 3:
-                self.signals.status.emit("Connecting to ACS...")
-                dev = ACS_HF15(port=self.port, logger=self.signals.status.emit)
-                if dev.getUID() == b"":
-                    self.signals.error.emit(f"Couldn't detect nfc tag.")
-                    return
-            else:
-                self.signals.error.emit(f"Unknown nfc reader: {str(self.reader)}")
+            if not self.open_device().connect_card(card=card):
                 return
-        except Exception as e:
-            self.signals.error.emit(f"Failed to connect to reader: {str(e)}")
+        except Exception:
             return
+        self.detect()
 
-        self.signals.status.emit("Reading NFC tag ...")
-        try:
-            # Assuming the progress callback expects a percentage (0-100)
-            tag = dev.dump(filename=None, progress=self.signals.progress.emit)
-        except Exception as e:
-            self.signals.error.emit(f"Error reading NFC tag: {str(e)}")
-            return
+    @Slot(object)
+    def card_removed(self, card):
+        if self.dev is not None:
+            self.dev.disconnect_card()
+        self.detected.emit(b"")
+
+    @Slot()
+    def close_device(self):
+        if self.presence is not None:
+            self.presence.stop()
+            self.presence = None
+        if self.dev is not None:
+            try:
+                self.dev.close()
+            except Exception:
+                pass
+            self.dev = None
+        self.io_thread.quit()
 
-        self.signals.status.emit("Parsing tag data...")
+    def get_uid(self):
         try:
-            # If load_data is a method on your main window/class, you'll need to pass the data back
-            # and handle parsing in the main thread if it touches UI elements.
-            self.signals.finished.emit(tag)  # tag should have .data attribute
-        except Exception as e:
-            self.signals.error.emit(f"Error parsing NFC tag: {str(e)}")
-
-class NFC_ReadTagDetect(QRunnable):
-    def __init__(self, reader: int, port: str):
-        super().__init__()
-        self.reader = reader
-        self.signals = NFC_WorkerSignals()
-        self.port = port
+            uid = self.open_device().getUID()
+        except OSError:
+            # Reader went away or port is broken, reopen it on the next request
+            if self.dev is not None:
+                try:
+                    self.dev.close()
+                except Exception:
+                    pass
+            self.dev = None
+            return b""
+        except Exception:
+            return b""
+        if uid is None:
+            return b""
+        return uid
+
+    @Slot()
+    def detect(self):
+        uid = self.get_uid()
+        self.detect_pending = False
+        self.detected.emit(uid)
 
     @Slot()
-    def run(self):
+    def read(self):
+        self.quiet = False
+        try:
+            if self.driver.select_before_dump and self.get_uid() == b"":
+                self.signals.error.emit(f"Couldn't detect nfc tag.")
+                return
+            self.signals.status.emit("Reading NFC tag ...")
+            try:
+                tag = self.open_device().dump(filename=None, progress=self.signals.progress.emit, lazy=True,
+                                              **self.driver.dump_args())
+            except Exception as e:
+                self.signals.error.emit(f"Error reading NFC tag: {str(e)}")
+                return
+            self.signals.status.emit("Parsing tag data...")
+            self.signals.finished.emit(tag)
+        finally:
+            self.quiet = True
+
+    @Slot(object, object, object)
+    def write(self, tagdata, blocklist, uid):
+        self.quiet = False
         try:
-            uid = b""
-            if self.reader == 1:
-                dev = PM3_HF15(port=self.port, baudrate=115200, logger=self.signals.status.emit)
-            elif self.reader == 2:
-                dev = S9_HF15(port=self.port, logger=self.signals.status.emit)
-            elif self.reader == 3:
-                dev = ACS_HF15(port=self.port, logger=self.signals.status.emit)
-                uid = dev.getUID()
-                self.signals.finished.emit(uid)
+            curuid = self.get_uid()
+            if self.driver.select_before_dump and curuid == b"":
+                self.signals.error.emit(f"Couldn't detect nfc tag.")
                 return
-            self.signals.finished.emit(uid)
-        except Exception as e:
-            self.signals.finished.emit(b"")
+            if uid is not None and bytes(curuid) != bytes(uid):
+                self.signals.error.emit("Tag differs from the last read tag, please read it first.")
+                return
+            self.signals.status.emit("Writing to NFC tag ...")
+            try:
+                if self.open_device().restore(data_or_filename=tagdata, progress=self.signals.progress.emit,
+                                              blocklist=blocklist, **self.driver.restore_args()):
+                    self.signals.status.emit("Succeeded writing nfc tag")
+                    self.written.emit()
+                else:
+                    self.signals.error.emit("Error on writing nfc tag")
+            except Exception as e:
+                self.signals.error.emit(f"Error on writing nfc tag: {str(e)}")
+        finally:
+            self.quiet = True
+
+
+class NFC_ReaderPool(QObject):
+    """
+    One NFC_ReaderSession, and with it one I/O thread, per PC/SC reader. Reads and writes on
+    different readers run in parallel, all signals carry the name of the reader.
+    """
+    detected = Signal(str, object)  # reader name, uid or b""
+    written = Signal(str)
+    progress = Signal(str, int)
+    status = Signal(str, str)
+    error = Signal(str, str)
+    finished = Signal(str, object)
+
+    def __init__(self):
+        super().__init__()
+        self.sessions = {}
+        self.uids = {}
+
+    def refresh(self) -> list:
+        """
+        Opens sessions for new PC/SC readers and closes the ones of unplugged readers
+        """
+        try:
+            names = [str(reader) for reader in pcsc_readers()]
+        except Exception:
+            names = []
+        for name in list(self.sessions):
+            if name not in names:
+                self.sessions.pop(name).close()
+                self.uids.pop(name, None)
+        for name in names:
+            if name not in self.sessions:
+                self.sessions[name] = self.open_session(name)
+        return names
+
+    def open_session(self, name: str) -> NFC_ReaderSession:
+        session = NFC_ReaderSession(reader=NFC_READER_ACS, port=None, reader_name=name)
+        # Emitted from the session thread, receivers of the pool signals get them queued
+        session.detected.connect(lambda uid, name=name: self.on_detected(name, uid))
+        session.written.connect(lambda name=name: self.written.emit(name))
+        session.signals.progress.connect(lambda value, name=name: self.progress.emit(name, value))
+        session.signals.status.connect(lambda text, name=name: self.status.emit(name, text))
+        session.signals.error.connect(lambda text, name=name: self.error.emit(name, text))
+        session.signals.finished.connect(lambda tag, name=name: self.finished.emit(name, tag))
+        return session
+
+    def on_detected(self, name: str, uid):
+        self.uids[name] = uid
+        self.detected.emit(name, uid)
+
+    def readers_with_tag(self) -> list:
+        return [name for name, uid in self.uids.items() if uid not in (None, b"") and name in self.sessions]
+
+    def find_reader(self, uid):
+        for name in self.readers_with_tag():
+            if bytes(self.uids[name]) == bytes(uid):
+                return name
+        return None
+
+    def read(self, name: str):
+        self.sessions[name].request_read.emit()
+
+    def write(self, name: str, tagdata, blocklist=None, uid=None):
+        self.sessions[name].request_write.emit(tagdata, blocklist, uid)
+
+    def write_all(self, tagdata) -> list:
+        """
+        Writes tagdata to the tags on all readers at once, returns the reader names
+        """
+        names = self.readers_with_tag()
+        for name in names:
+            self.write(name, tagdata)
+        return names
 
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+        self.uids = {}
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Latency histograms and counters of the reader drivers, exported as JSON or Prometheus text format.
+# Stages per command:
+#   usb_tx    host -> reader transfer (PM3 serial write)
+#   rf        command sent until the first byte of the answer (reader + tag time)
+#   usb_rx    first to last byte of the answer
+#   apdu      PC/SC round trip, pcsc doesn't let us split it further (ACS)
+#   call      vendor library call (S9)
+#   total     whole command
+# Counters: retries, wtx (PM3 wait time extensions, the extended ms go to the wtx histogram too).
+# OPENPRINTTAG_METRICS=0 switches the recording off.
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets in ms, the last bucket is +Inf
+NFC_METRICS_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2500, 5000)
+
+ISO15693_COMMAND_NAMES = {
+    0x01: "inventory",
+    0x02: "stay_quiet",
+    0x20: "read_single_block",
+    0x21: "write_single_block",
+    0x22: "lock_block",
+    0x23: "read_multiple_blocks",
+    0x24: "write_multiple_blocks",
+    0x25: "select",
+    0x26: "reset_to_ready",
+    0x2B: "get_system_info",
+    0x2C: "get_multiple_block_security_status",
+    0x30: "extended_read_single_block",
+    0x33: "extended_read_multiple_blocks",
+    0x3B: "extended_get_system_info",
+}
+
+
+def iso15_command_name(cmd: int) -> str:
+    return ISO15693_COMMAND_NAMES.get(cmd, f"iso15_{cmd:02x}")
+
+
+class NFC_Histogram:
+    __slots__ = ("counts", "sum", "count", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(NFC_METRICS_BUCKETS_MS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        idx = 0
+        for bound in NFC_METRICS_BUCKETS_MS:
+            if value <= bound:
+                break
+            idx += 1
+        self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimated from the buckets, the upper bound of the bucket holding the q-th value
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if idx >= len(NFC_METRICS_BUCKETS_MS):
+                    return self.max
+                return min(NFC_METRICS_BUCKETS_MS[idx], self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(count=self.count, sum_ms=round(self.sum, 3), min_ms=round(self.min or 0, 3),
+                    max_ms=round(self.max or 0, 3), mean_ms=round(self.sum / self.count, 3) if self.count else 0,
+                    p50_ms=round(self.quantile(0.5), 3), p95_ms=round(self.quantile(0.95), 3),
+                    buckets={str(bound): count for bound, count in
+                             zip(list(NFC_METRICS_BUCKETS_MS) + ["+Inf"], self.counts)})
+
+
+class NFC_Metrics:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.histograms = {}  # (driver, command, stage) -> NFC_Histogram
+        self.counters = {}  # (driver, command, name) -> int
+
+    def observe(self, driver: str, command: str, stage: str, ms: float):
+        if not self.enabled:
+            return
+        key = (driver, command, stage)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = NFC_Histogram()
+            histogram.observe(ms)
+
+    def inc(self, driver: str, command: str, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        key = (driver, command, name)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            result = dict(started=self.started, drivers={})
+            for (driver, command, stage), histogram in sorted(self.histograms.items()):
+                commands = result["drivers"].setdefault(driver, {})
+                commands.setdefault(command, {}).setdefault("stages", {})[stage] = histogram.to_dict()
+            for (driver, command, name), value in sorted(self.counters.items()):
+                commands = result["drivers"].setdefault(driver, {})
+                commands.setdefault(command, {}).setdefault("counters", {})[name] = value
+        return result
+
+    def to_json(self, indent: int = 1) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self, prefix: str = "openprinttag_nfc") -> str:
+        lines = [f"# HELP {prefix}_latency_ms Reader command latency per stage in milliseconds",
+                 f"# TYPE {prefix}_latency_ms histogram"]
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        for (driver, command, stage), histogram in histograms:
+            labels = f'driver="{driver}",command="{command}",stage="{stage}"'
+            cumulative = 0
+            for bound, count in zip(list(NFC_METRICS_BUCKETS_MS) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_latency_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{prefix}_latency_ms_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"{prefix}_latency_ms_count{{{labels}}} {histogram.count}")
+        names = sorted({name for (_, _, name), _ in counters})
+        for name in names:
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (driver, command, counter), value in counters:
+                if counter == name:
+                    lines.append(f'{prefix}_{name}_total{{driver="{driver}",command="{command}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list:
+        """
+        One line per driver, command and stage for the diagnostics view
+        """
+        result = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = dict(self.counters)
+        for (driver, command, stage), histogram in histograms:
+            result.append(f"{driver:6s} {command:36s} {stage:7s} n={histogram.count:<6d} "
+                          f"mean {histogram.sum / histogram.count:8.2f} ms  p95 {histogram.quantile(0.95):8.2f} ms  "
+                          f"max {histogram.max:8.2f} ms")
+        for (driver, command, name), value in sorted(counters.items()):
+            result.append(f"{driver:6s} {command:36s} {name:7s} {value}")
+        return result
+
+
+NFC_METRICS = NFC_Metrics(enabled=os.environ.get("OPENPRINTTAG_METRICS", "1") != "0")
+
+
+def save_metrics(filename: str, metrics: NFC_Metrics = NFC_METRICS):
+    """
+    .prom files get the Prometheus text format (e.g. for the node exporter textfile collector), others JSON
+    """
+    with open(filename, "w") as wf:
+        if filename.endswith(".prom"):
+            wf.write(metrics.to_prometheus())
+        else:
+            wf.write(metrics.to_json())
+
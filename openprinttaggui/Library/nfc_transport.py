@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Record/replay of the reader I/O: PM3 serial bytes, ACS APDUs and S9 library calls.
+# Traces are gzipped JSON lines, one event per line:
+#   {"t": 0.012345, "ch": "pm3", "ev": "tx", "data": "504d3361..."}
+#   {"t": 0.013012, "ch": "pm3", "ev": "rx", "data": "504d3362..."}
+#   {"t": 0.020000, "ch": "acs", "ev": "call", "fn": "transmit", "args": [[255, 202, 0, 0, 0]],
+#    "res": [[1, 2, 3], 144, 0], "dt": 0.004}
+# Set OPENPRINTTAG_RECORD=<file> or OPENPRINTTAG_REPLAY=<file> (and OPENPRINTTAG_REPLAY_SCALE) before the
+# readers are opened, or call start_recording()/start_replay().
+import ctypes
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+NFC_TRACE_MAGIC = "openprinttag-trace"
+NFC_TRACE_VERSION = 1
+
+# None talks to the hardware directly, else an NFC_TraceRecorder or NFC_TraceReplayer
+NFC_TRANSPORT = None
+NFC_TRANSPORT_FROM_ENV = False
+
+
+def encode_arg(arg):
+    """
+    JSON form of a library call argument, buffers are stored without their trailing zeros
+    """
+    if arg is None or isinstance(arg, (int, float, str)):
+        return arg
+    if isinstance(arg, (bytes, bytearray)):
+        return {"b": bytes(arg).hex()}
+    obj = getattr(arg, "_obj", arg)  # byref()
+    if isinstance(obj, (ctypes.Array, ctypes._SimpleCData, ctypes.Structure)):
+        return {"buf": ctypes.string_at(ctypes.addressof(obj), ctypes.sizeof(obj)).rstrip(b"\x00").hex()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_arg(item) for item in obj]
+    return repr(arg)
+
+
+def buffer_of(arg):
+    obj = getattr(arg, "_obj", arg)
+    if isinstance(obj, (ctypes.Array, ctypes._SimpleCData, ctypes.Structure)):
+        return obj
+    return None
+
+
+def fill_buffer(obj, data: bytes):
+    size = ctypes.sizeof(obj)
+    data = data[:size]
+    ctypes.memmove(ctypes.addressof(obj), data + bytes(size - len(data)), size)
+
+
+class NFC_TraceRecorder:
+    replaying = False
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.fh = gzip.open(filename, "wt", encoding="utf-8")
+        self.start = time.perf_counter()
+        self.events = 0
+        self.write_event({"trace": NFC_TRACE_MAGIC, "version": NFC_TRACE_VERSION,
+                          "created": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def write_event(self, event: dict):
+        self.fh.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    def record(self, channel: str, ev: str, start: float = None, **fields):
+        with self.lock:
+            if self.fh is None:
+                return
+            # Timestamp taken under the lock keeps the file in time order across threads
+            now = time.perf_counter() if start is None else start
+            event = {"t": round(now - self.start, 6), "ch": channel, "ev": ev}
+            event.update(fields)
+            self.write_event(event)
+            self.events += 1
+
+    def close(self):
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+    def stream(self, channel: str):
+        return NFC_RecordStream(self, channel)
+
+    def connection(self, channel: str, connection):
+        return NFC_RecordConnection(self, channel, connection)
+
+    def library(self, channel: str, lib):
+        return NFC_RecordLibrary(self, channel, lib)
+
+
+class NFC_RecordStream:
+    replaying = False
+
+    def __init__(self, recorder: NFC_TraceRecorder, channel: str):
+        self.recorder = recorder
+        self.channel = channel
+
+    def tx(self, data):
+        self.recorder.record(self.channel, "tx", data=bytes(data).hex())
+
+    def rx(self, data):
+        self.recorder.record(self.channel, "rx", data=bytes(data).hex())
+
+
+class NFC_RecordConnection:
+    """
+    Wraps a pyscard CardConnection and records connect, getATR, transmit and disconnect
+    """
+
+    def __init__(self, recorder: NFC_TraceRecorder, channel: str, connection):
+        self.recorder = recorder
+        self.channel = channel
+        self.connection = connection
+
+    def call(self, fn: str, args: list, func):
+        start = time.perf_counter()
+        res = func()
+        self.recorder.record(self.channel, "call", start=start, fn=fn, args=args, res=res,
+                             dt=round(time.perf_counter() - start, 6))
+        return res
+
+    def connect(self, *args, **kwargs):
+        return self.call("connect", [], lambda: self.connection.connect(*args, **kwargs))
+
+    def disconnect(self):
+        return self.call("disconnect", [], self.connection.disconnect)
+
+    def getATR(self):
+        return list(self.call("getATR", [], self.connection.getATR))
+
+    def transmit(self, apdu, *args, **kwargs):
+        response, sw1, sw2 = self.call("transmit", [list(apdu)],
+                                       lambda: list(self.connection.transmit(apdu, *args, **kwargs)))
+        return response, sw1, sw2
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class NFC_RecordLibrary:
+    """
+    Wraps a ctypes library, every call is recorded with its arguments and the buffers it changed
+    """
+
+    def __init__(self, recorder: NFC_TraceRecorder, channel: str, lib):
+        self.recorder = recorder
+        self.channel = channel
+        self.lib = lib
+
+    def __getattr__(self, name):
+        func = getattr(self.lib, name)
+
+        def call(*args):
+            before = [encode_arg(arg) for arg in args]
+            start = time.perf_counter()
+            res = func(*args)
+            dt = time.perf_counter() - start
+            out = {}
+            for idx, arg in enumerate(args):
+                if buffer_of(arg) is not None:
+                    after = encode_arg(arg)
+                    if after != before[idx]:
+                        out[str(idx)] = after["buf"]
+            self.recorder.record(self.channel, "call", start=start, fn=name, args=before, res=res, out=out,
+                                 dt=round(dt, 6))
+            return res
+
+        return call
+
+
+class NFC_TraceReplayer:
+    replaying = True
+
+    def __init__(self, filename: str, scale: float = 1.0, strict: bool = True):
+        """
+        scale: multiplier for the recorded device timing, 0 replays as fast as possible
+        strict: fail if the driver sends something else than what was recorded
+        """
+        self.filename = filename
+        self.scale = scale
+        self.strict = strict
+        self.events = {}
+        self.channels = {}
+        self.lock = threading.Lock()
+        with gzip.open(filename, "rt", encoding="utf-8") as fh:
+            header = json.loads(fh.readline())
+            if header.get("trace") != NFC_TRACE_MAGIC:
+                raise Exception(f"{filename} is not a trace file")
+            if header.get("version", 0) > NFC_TRACE_VERSION:
+                raise Exception(f"Unsupported trace version {header.get('version')}")
+            for line in fh:
+                if line.strip():
+                    event = json.loads(line)
+                    self.events.setdefault(event["ch"], []).append(event)
+
+    def close(self):
+        with self.lock:
+            for channel in self.channels.values():
+                if hasattr(channel, "cancel_read"):
+                    channel.cancel_read()
+
+    def resolve(self, channel: str) -> str:
+        """
+        Recorded channel for channel, "acs:<reader>" falls back to the only recorded acs channel
+        """
+        if channel in self.events:
+            return channel
+        base = channel.split(":")[0]
+        candidates = [name for name in self.events if name.split(":")[0] == base]
+        if len(candidates) == 1:
+            return candidates[0]
+        raise Exception(f"No {channel} channel in trace {self.filename}")
+
+    def get_channel(self, channel: str, cls):
+        name = self.resolve(channel)
+        with self.lock:
+            # Reopening a reader continues where the previous instance stopped
+            if name not in self.channels:
+                self.channels[name] = cls(self, name, self.events[name])
+            return self.channels[name]
+
+    def stream(self, channel: str):
+        return self.get_channel(channel, NFC_ReplayStream)
+
+    def connection(self, channel: str, connection=None):
+        return NFC_ReplayConnection(self.get_channel(channel, NFC_ReplayCalls))
+
+    def library(self, channel: str, lib=None):
+        return NFC_ReplayLibrary(self.get_channel(channel, NFC_ReplayCalls))
+
+
+class NFC_ReplayStream:
+    """
+    Serves the recorded rx bytes of a serial channel. Each rx chunk becomes available the recorded delay
+    (times scale) after the write it followed, writes are checked against the recorded tx data.
+    """
+    replaying = True
+
+    def __init__(self, replayer: NFC_TraceReplayer, channel: str, events: list):
+        self.replayer = replayer
+        self.channel = channel
+        self.txs = []
+        self.rxs = []
+        last_tx = None
+        for event in events:
+            if event["ev"] == "tx":
+                self.txs.append(bytes.fromhex(event["data"]))
+                last_tx = event
+            elif event["ev"] == "rx":
+                anchor = len(self.txs) - 1
+                delay = event["t"] - last_tx["t"] if last_tx is not None else 0
+                self.rxs.append((anchor, delay, bytes.fromhex(event["data"])))
+        self.txcount = 0
+        self.txtimes = []
+        self.rxpos = 0
+        self.rx = bytearray()
+        self.cancelled = False
+        self.cond = threading.Condition()
+
+    def due(self):
+        """
+        Moves rx chunks that are due into the receive buffer, returns seconds until the next one or None
+        """
+        while self.rxpos < len(self.rxs):
+            anchor, delay, data = self.rxs[self.rxpos]
+            if anchor >= self.txcount:
+                return None
+            ready = (self.txtimes[anchor] if anchor >= 0 else 0) + delay * self.replayer.scale
+            now = time.perf_counter()
+            if ready > now:
+                return ready - now
+            self.rx += data
+            self.rxpos += 1
+        return None
+
+    def write(self, data) -> int:
+        with self.cond:
+            if self.txcount >= len(self.txs):
+                raise Exception(f"Replay of {self.channel}: trace ended, unexpected write {bytes(data).hex()}")
+            expected = self.txs[self.txcount]
+            if self.replayer.strict and bytes(data) != expected:
+                raise Exception(f"Replay of {self.channel} diverged at write {self.txcount}: "
+                                f"expected {expected.hex()}, got {bytes(data).hex()}")
+            self.txtimes.append(time.perf_counter())
+            self.txcount += 1
+            self.cond.notify_all()
+        return len(data)
+
+    def readinto(self, buffer, timeout: float = None) -> int:
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.cond:
+            while True:
+                wait = self.due()
+                if self.rx:
+                    size = min(len(buffer), len(self.rx))
+                    buffer[:size] = self.rx[:size]
+                    del self.rx[:size]
+                    return size
+                if self.cancelled:
+                    self.cancelled = False
+                    return 0
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return 0
+                if wait is None and remaining is None and self.rxpos >= len(self.rxs):
+                    # Nothing will ever arrive
+                    return 0
+                waits = [value for value in (wait, remaining) if value is not None]
+                self.cond.wait(min(waits) if waits else None)
+
+    @property
+    def in_waiting(self) -> int:
+        with self.cond:
+            self.due()
+            return len(self.rx)
+
+    def cancel_read(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+
+class NFC_ReplayCalls:
+    """
+    Returns the recorded results of a call channel in order, after the recorded call duration times scale
+    """
+
+    def __init__(self, replayer: NFC_TraceReplayer, channel: str, events: list):
+        self.replayer = replayer
+        self.channel = channel
+        self.calls = deque(event for event in events if event["ev"] == "call")
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def call(self, fn: str, args: list = None, inputs: list = None) -> dict:
+        """
+        inputs: indices of args to compare in strict mode, all if None
+        """
+        with self.lock:
+            if not self.calls:
+                raise Exception(f"Replay of {self.channel}: trace ended, unexpected call {fn}")
+            event = self.calls.popleft()
+            index = self.index
+            self.index += 1
+        if event["fn"] != fn:
+            raise Exception(f"Replay of {self.channel} diverged at call {index}: expected {event['fn']}, got {fn}")
+        if self.replayer.strict and args is not None:
+            recorded = event.get("args", [])
+            for idx in (range(len(args)) if inputs is None else inputs):
+                if idx >= len(recorded) or recorded[idx] != args[idx]:
+                    raise Exception(f"Replay of {self.channel} diverged at call {index} ({fn}): argument {idx} "
+                                    f"expected {recorded[idx] if idx < len(recorded) else None}, got {args[idx]}")
+        if self.replayer.scale > 0 and event.get("dt", 0) > 0:
+            time.sleep(event["dt"] * self.replayer.scale)
+        return event
+
+
+class NFC_ReplayConnection:
+    def __init__(self, calls: NFC_ReplayCalls):
+        self.calls = calls
+
+    def connect(self, *args, **kwargs):
+        return self.calls.call("connect", [])["res"]
+
+    def disconnect(self):
+        return self.calls.call("disconnect", [])["res"]
+
+    def getATR(self):
+        return self.calls.call("getATR", [])["res"]
+
+    def transmit(self, apdu, *args, **kwargs):
+        response, sw1, sw2 = self.calls.call("transmit", [list(apdu)])["res"]
+        return response, sw1, sw2
+
+
+class NFC_ReplayLibrary:
+    def __init__(self, calls: NFC_ReplayCalls):
+        self.calls = calls
+
+    def __getattr__(self, name):
+        def call(*args):
+            encoded = [encode_arg(arg) for arg in args]
+            # Buffers the call filled in are outputs, only compare the inputs
+            event = self.calls.call(name)
+            outputs = {int(idx) for idx in event.get("out", {})}
+            if self.calls.replayer.strict:
+                recorded = event.get("args", [])
+                for idx, value in enumerate(encoded):
+                    if idx in outputs:
+                        continue
+                    if idx >= len(recorded) or recorded[idx] != value:
+                        raise Exception(f"Replay of {self.calls.channel} diverged at call {name}: argument {idx} "
+                                        f"expected {recorded[idx] if idx < len(recorded) else None}, got {value}")
+            for idx, data in event.get("out", {}).items():
+                obj = buffer_of(args[int(idx)])
+                if obj is not None:
+                    fill_buffer(obj, bytes.fromhex(data))
+            return event["res"]
+
+        return call
+
+
+def start_recording(filename: str) -> NFC_TraceRecorder:
+    global NFC_TRANSPORT
+    stop_transport()
+    NFC_TRANSPORT = NFC_TraceRecorder(filename)
+    return NFC_TRANSPORT
+
+
+def start_replay(filename: str, scale: float = 1.0, strict: bool = True) -> NFC_TraceReplayer:
+    global NFC_TRANSPORT
+    stop_transport()
+    NFC_TRANSPORT = NFC_TraceReplayer(filename, scale=scale, strict=strict)
+    return NFC_TRANSPORT
+
+
+def stop_transport():
+    global NFC_TRANSPORT
+    if NFC_TRANSPORT is not None:
+        NFC_TRANSPORT.close()
+        NFC_TRANSPORT = None
+
+
+def get_transport():
+    global NFC_TRANSPORT_FROM_ENV
+    if not NFC_TRANSPORT_FROM_ENV:
+        NFC_TRANSPORT_FROM_ENV = True
+        if NFC_TRANSPORT is None:
+            if os.environ.get("OPENPRINTTAG_REPLAY"):
+                start_replay(os.environ["OPENPRINTTAG_REPLAY"],
+                             scale=float(os.environ.get("OPENPRINTTAG_REPLAY_SCALE", "1.0")))
+            elif os.environ.get("OPENPRINTTAG_RECORD"):
+                start_recording(os.environ["OPENPRINTTAG_RECORD"])
+    return NFC_TRANSPORT
+
+
+def replaying() -> bool:
+    transport = get_transport()
+    return transport is not None and transport.replaying
+
+
+def transport_stream(channel: str):
+    """
+    NFC_RecordStream or NFC_ReplayStream for a serial channel, None without a trace
+    """
+    transport = get_transport()
+    if transport is None:
+        return None
+    return transport.stream(channel)
+
+
+def transport_connection(channel: str, connection):
+    transport = get_transport()
+    if transport is None:
+        return connection
+    return transport.connection(channel, connection)
+
+
+def transport_library(channel: str, loader):
+    """
+    loader is only called if the real library is needed, a replay doesn't need it installed
+    """
+    transport = get_transport()
+    if transport is not None and transport.replaying:
+        return transport.library(channel)
+    lib = loader()
+    if lib is None or transport is None:
+        return lib
+    return transport.library(channel, lib)
+
+
+def summary(filename: str) -> dict:
+    channels = {}
+    with gzip.open(filename, "rt", encoding="utf-8") as fh:
+        fh.readline()
+        for line in fh:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            info = channels.setdefault(event["ch"], dict(events=0, tx=0, rx=0, calls={}, first=event["t"], last=0))
+            info["events"] += 1
+            info["last"] = event["t"]
+            if event["ev"] in ("tx", "rx"):
+                info[event["ev"]] += len(event["data"]) // 2
+            else:
+                info["calls"][event["fn"]] = info["calls"].get(event["fn"], 0) + 1
+    return channels
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} trace.jsonl.gz")
+        sys.exit(1)
+    for name, info in summary(sys.argv[1]).items():
+        print(f"{name}: {info['events']} events in {(info['last'] - info['first']) * 1000:.1f} ms, "
+              f"tx {info['tx']} bytes, rx {info['rx']} bytes")
+        for fn, count in sorted(info["calls"].items()):
+            print(f"  {fn}: {count}")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Throughput of PM3_HF15 dump/restore against the pty emulator, no hardware needed:
+# python -m openprinttaggui.Library.pm3_nfc.pm3_bench [--repeat 3] [--rf-scale 1.0] [--usb 1.0]
+import argparse
+import os
+import time
+
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS
+from openprinttaggui.Library.pm3_nfc.pm3_emulator import PM3Emulator, PM3_EMU_DEFAULT_LATENCY
+from openprinttaggui.Library.pm3_nfc.pm3_hf15 import PM3_HF15
+
+DUMP_MODES = {
+    "single": dict(multiblock=False, pipeline=False),
+    "single+pipeline": dict(multiblock=False, pipeline=True),
+    "multi": dict(multiblock=True, pipeline=False),
+    "multi+pipeline": dict(multiblock=True, pipeline=True),
+}
+
+RESTORE_MODES = {
+    "full": dict(diff=False, pipeline=False),
+    "full+pipeline": dict(diff=False, pipeline=True),
+    "full+multi": dict(diff=False, pipeline=True, multiblock=True),
+    "diff": dict(diff=True, pipeline=False),
+    "diff+pipeline": dict(diff=True, pipeline=True),
+    "diff+multi": dict(diff=True, pipeline=True, multiblock=True),
+}
+
+
+def timed(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench(repeat: int = 3, rf_scale: float = 1.0, usb: float = 1.0):
+    latency = {key: value * rf_scale for key, value in PM3_EMU_DEFAULT_LATENCY.items()}
+    latency["usb"] = usb
+    with PM3Emulator(data=os.urandom(80 * 4), latency=latency) as emulator:
+        pm3 = PM3_HF15(port=emulator.port, baudrate=115200, logger=lambda *args: None)
+        blocks = emulator.blocks
+        print(f"Emulated SLIX2 on {emulator.port}: {blocks} blocks of {emulator.blocksize} bytes, "
+              f"usb {usb:.2f} ms, rf latency x{rf_scale:.2f}")
+        print("\ndump")
+        for name, mode in DUMP_MODES.items():
+            elapsed = timed(lambda: pm3.dump(fast=True, **mode), repeat)
+            print(f"  {name:16s} {elapsed * 1000:8.1f} ms  {blocks / elapsed:8.1f} blocks/s")
+
+        print("\nrestore (4 changed blocks)")
+        image = bytearray(emulator.memory)
+        for name, mode in RESTORE_MODES.items():
+            def restore():
+                # Same small change every round, diff mode starts from a cached dump
+                for blockno in (8, 9, 10, 11):
+                    image[blockno * 4] ^= 0xFF
+                pm3.dump(fast=True)
+                start = time.perf_counter()
+                if not pm3.restore(bytearray(image), fast=True, **mode):
+                    raise Exception("Restore failed")
+                return time.perf_counter() - start
+
+            elapsed = min(restore() for _ in range(repeat))
+            if emulator.memory != image:
+                raise Exception("Emulated tag content doesn't match the restored image")
+            written = blocks if not mode["diff"] else 4
+            print(f"  {name:16s} {elapsed * 1000:8.1f} ms  {written / elapsed:8.1f} blocks/s")
+        pm3.close()
+        print(f"\nEmulator stats: {emulator.stats}")
+        print("\nPer command latencies:")
+        print("\n".join(NFC_METRICS.summary()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PM3_HF15 against an emulated Proxmark3")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, best one is reported")
+    parser.add_argument("--rf-scale", type=float, default=1.0, help="multiplier for the emulated rf latencies")
+    parser.add_argument("--usb", type=float, default=1.0, help="emulated usb latency per frame in ms")
+    args = parser.parse_args()
+    bench(repeat=args.repeat, rf_scale=args.rf_scale, usb=args.usb)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Proxmark3 stand-in on a pseudo terminal, emulates an ISO15693 SLIX2 tag for offline tests and benchmarks
+import os
+import queue
+import select
+import threading
+import time
+import tty
+
+from openprinttaggui.Library.iso15693_crc import crc16
+from openprinttaggui.Library.pm3_nfc.pm3_generic import PM3CMD, PM3_CMD_PREAMBLE, PM3_RESP_PREAMBLE, PM3_RESP_MAGIC, \
+    PM3_U16
+
+PM3_CMD_MAGIC = b"PM3a"
+PM3_CMD_POSTAMBLE_SIZE = 2
+PM3_RESP_POSTAMBLE = b"b3"
+PM3_SUCCESS = 0
+PM3_ETIMEOUT = -4
+
+# ISO15693 request flags / commands, same values as in pm3_hf15
+ISO15_REQ_INVENTORY = 0x04
+ISO15_REQ_ADDRESS = 0x20
+ISO15_REQ_OPTION = 0x40
+ISO15_RES_ERROR = 0x01
+ISO15_ERROR_CMD_NOT_SUP = 0x01
+ISO15_ERROR_BLOCK_UNAVAILABLE = 0x10
+ISO15693_INVENTORY = 0x01
+ISO15693_READBLOCK = 0x20
+ISO15693_WRITEBLOCK = 0x21
+ISO15693_READ_MULTI_BLOCK = 0x23
+ISO15693_WRITE_MULTI_BLOCK = 0x24
+ISO15693_GET_SYSTEM_INFO = 0x2B
+
+# SLIX2: 80 blocks of 4 bytes, NXP IC reference
+SLIX2_UID = bytes.fromhex("bd4aec18090104e0")
+SLIX2_BLOCKS = 80
+SLIX2_BLOCKSIZE = 4
+SLIX2_IC = 0x01
+SLIX2_READ_MULTI_MAX_BLOCKS = 32
+# The real SLIX2 refuses WRITE_MULTI_BLOCK, the emulator takes up to 4 blocks unless told otherwise
+SLIX2_WRITE_MULTI_MAX_BLOCKS = 4
+
+# Emulated timing in ms: usb is paid per command frame but overlaps with the previous command,
+# the per command rf latency is paid one after another like on the real device.
+PM3_EMU_DEFAULT_LATENCY = {
+    "usb": 1.0,
+    ISO15693_INVENTORY: 4.0,
+    ISO15693_GET_SYSTEM_INFO: 3.0,
+    ISO15693_READBLOCK: 2.5,
+    ISO15693_READ_MULTI_BLOCK: 1.5,  # + per block
+    "multi_block": 0.35,
+    ISO15693_WRITEBLOCK: 6.0,
+    ISO15693_WRITE_MULTI_BLOCK: 3.0,  # + per block
+    "multi_block_write": 4.5,
+}
+
+
+class PM3Emulator:
+    """
+    Opens a pty and answers PM3a NG frames like a Proxmark3 with an ISO15693 SLIX2 on the antenna.
+    Use emulator.port as serial port for Proxmark3Handler / PM3_HF15.
+    """
+
+    def __init__(self, uid: bytes = SLIX2_UID, blocks: int = SLIX2_BLOCKS, blocksize: int = SLIX2_BLOCKSIZE,
+                 data: bytes = None, latency: dict = None, wtx_threshold: float = 100.0,
+                 write_multi_blocks: int = SLIX2_WRITE_MULTI_MAX_BLOCKS, logger=None):
+        self.uid = bytes(uid)
+        self.blocks = blocks
+        self.blocksize = blocksize
+        self.memory = bytearray(blocks * blocksize)
+        if data is not None:
+            self.memory[:len(data[:len(self.memory)])] = data[:len(self.memory)]
+        self.locks = bytearray(blocks)
+        self.latency = dict(PM3_EMU_DEFAULT_LATENCY)
+        if latency is not None:
+            self.latency.update(latency)
+        # Commands taking longer than this (in ms) announce themselves with a WTX frame
+        self.wtx_threshold = wtx_threshold
+        # Blocks per WRITE_MULTI_BLOCK, 0 answers it with "command not supported" like a SLIX2
+        self.write_multi_blocks = write_multi_blocks
+        self.logger = logger
+        self.tag_present = True
+        self.stats = dict(frames=0, iso15=0, reads=0, writes=0, wtx=0)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.running = False
+        self.commands = queue.Queue()
+        self.threads = []
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.threads = [threading.Thread(target=self.rx_loop, daemon=True),
+                        threading.Thread(target=self.cmd_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self.port
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.commands.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        os.close(self.master)
+        os.close(self.slave)
+        self.master = None
+        self.slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def log(self, msg: str):
+        if self.logger is not None:
+            self.logger(msg)
+
+    def rx_loop(self):
+        buffer = bytearray()
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                buffer += os.read(self.master, 0x1000)
+            except OSError:
+                break
+            now = time.time()
+            while True:
+                idx = buffer.find(PM3_CMD_MAGIC)
+                if idx == -1:
+                    del buffer[:max(len(buffer) - (len(PM3_CMD_MAGIC) - 1), 0)]
+                    break
+                del buffer[:idx]
+                if len(buffer) < PM3_CMD_PREAMBLE.size:
+                    break
+                _, length, cmd = PM3_CMD_PREAMBLE.unpack_from(buffer)
+                total = PM3_CMD_PREAMBLE.size + (length & 0x7fff) + PM3_CMD_POSTAMBLE_SIZE
+                if len(buffer) < total:
+                    break
+                data = bytes(buffer[PM3_CMD_PREAMBLE.size:total - PM3_CMD_POSTAMBLE_SIZE])
+                del buffer[:total]
+                self.stats["frames"] += 1
+                self.commands.put((now, cmd, data, (length & 0x8000) > 0))
+
+    def cmd_loop(self):
+        while self.running:
+            item = self.commands.get()
+            if item is None:
+                break
+            arrival, cmd, data, ng = item
+            # USB transfer of this frame overlapped with whatever ran before
+            delay = arrival + self.latency["usb"] / 1000 - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.dispatch(cmd, data)
+
+    def reply(self, cmd: int, status: int = PM3_SUCCESS, data: bytes = b"", reason: int = 0):
+        frame = bytearray(PM3_RESP_PREAMBLE.size + len(data) + len(PM3_RESP_POSTAMBLE))
+        PM3_RESP_PREAMBLE.pack_into(frame, 0, PM3_RESP_MAGIC, len(data) | 0x8000, status, reason, cmd)
+        frame[PM3_RESP_PREAMBLE.size:PM3_RESP_PREAMBLE.size + len(data)] = data
+        frame[-len(PM3_RESP_POSTAMBLE):] = PM3_RESP_POSTAMBLE
+        try:
+            os.write(self.master, frame)
+        except OSError:
+            pass
+
+    def busy(self, ms: float):
+        if ms >= self.wtx_threshold:
+            self.stats["wtx"] += 1
+            self.reply(PM3CMD.WTX.value, data=PM3_U16.pack(min(int(ms) + 50, 0xfffe)))
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def dispatch(self, cmd: int, data: bytes):
+        if cmd == PM3CMD.PING.value:
+            self.reply(cmd, data=data)
+        elif cmd == PM3CMD.VERSION.value:
+            versionstr = b"Proxmark3 emulator (ISO15693 SLIX2)\x00"
+            self.reply(cmd, data=int.to_bytes(0, 4, 'little') + int.to_bytes(0x40000, 4, 'little') +
+                                 int.to_bytes(len(versionstr), 4, 'little') + versionstr)
+        elif cmd == PM3CMD.HF_DROPFIELD.value:
+            pass
+        elif cmd == PM3CMD.HF_ISO15693_COMMAND.value:
+            self.iso15_command(data)
+        else:
+            self.log(f"Unsupported pm3 cmd {hex(cmd)}")
+
+    def iso15_command(self, data: bytes):
+        # iso15_raw_cmd_t: flags, rawlen, raw (including crc)
+        self.stats["iso15"] += 1
+        rawlen = int.from_bytes(data[1:3], 'little')
+        raw = data[3:3 + rawlen]
+        if not self.tag_present or len(raw) < 4 or crc16(raw[:-2]) != int.from_bytes(raw[-2:], 'little'):
+            self.busy(self.latency[ISO15693_INVENTORY])
+            self.reply(PM3CMD.HF_ISO15693_COMMAND.value, status=PM3_ETIMEOUT)
+            return
+        answer = self.tag_answer(raw[:-2])
+        if answer is None:
+            self.reply(PM3CMD.HF_ISO15693_COMMAND.value, status=PM3_ETIMEOUT)
+            return
+        self.reply(PM3CMD.HF_ISO15693_COMMAND.value, data=answer + int.to_bytes(crc16(answer), 2, 'little'))
+
+    def error(self, code: int) -> bytes:
+        return bytes([ISO15_RES_ERROR, code])
+
+    def tag_answer(self, raw: bytes) -> bytes:
+        flags = raw[0]
+        cmd = raw[1]
+        if flags & ISO15_REQ_INVENTORY:
+            self.busy(self.latency[ISO15693_INVENTORY])
+            if cmd != ISO15693_INVENTORY:
+                return self.error(ISO15_ERROR_CMD_NOT_SUP)
+            return b"\x00\x00" + self.uid
+        args = raw[2:]
+        if flags & ISO15_REQ_ADDRESS:
+            if args[:8] != self.uid:
+                # Another tag was addressed, nobody answers
+                self.busy(self.latency[ISO15693_INVENTORY])
+                return None
+            args = args[8:]
+        option = flags & ISO15_REQ_OPTION
+        if cmd == ISO15693_GET_SYSTEM_INFO:
+            self.busy(self.latency[ISO15693_GET_SYSTEM_INFO])
+            return b"\x00\x0f" + self.uid + bytes([0x00, 0x00, self.blocks - 1, self.blocksize - 1, SLIX2_IC])
+        if cmd == ISO15693_READBLOCK:
+            self.busy(self.latency[ISO15693_READBLOCK])
+            blockno = args[0]
+            if blockno >= self.blocks:
+                return self.error(ISO15_ERROR_BLOCK_UNAVAILABLE)
+            self.stats["reads"] += 1
+            return b"\x00" + self.block(blockno, option)
+        if cmd == ISO15693_READ_MULTI_BLOCK:
+            blockno = args[0]
+            count = args[1] + 1
+            self.busy(self.latency[ISO15693_READ_MULTI_BLOCK] + count * self.latency["multi_block"])
+            if count > SLIX2_READ_MULTI_MAX_BLOCKS or blockno + count > self.blocks:
+                return self.error(ISO15_ERROR_BLOCK_UNAVAILABLE)
+            self.stats["reads"] += count
+            return b"\x00" + b"".join(self.block(idx, option) for idx in range(blockno, blockno + count))
+        if cmd == ISO15693_WRITEBLOCK:
+            self.busy(self.latency[ISO15693_WRITEBLOCK])
+            blockno = args[0]
+            if blockno >= self.blocks or len(args) < 1 + self.blocksize:
+                return self.error(ISO15_ERROR_BLOCK_UNAVAILABLE)
+            self.stats["writes"] += 1
+            self.memory[blockno * self.blocksize:(blockno + 1) * self.blocksize] = args[1:1 + self.blocksize]
+            return b"\x00"
+        if cmd == ISO15693_WRITE_MULTI_BLOCK:
+            if not self.write_multi_blocks:
+                self.busy(self.latency[ISO15693_READBLOCK])
+                return self.error(ISO15_ERROR_CMD_NOT_SUP)
+            blockno = args[0]
+            count = args[1] + 1
+            self.busy(self.latency[ISO15693_WRITE_MULTI_BLOCK] + count * self.latency["multi_block_write"])
+            if count > self.write_multi_blocks or blockno + count > self.blocks or \
+                    len(args) < 2 + count * self.blocksize:
+                return self.error(ISO15_ERROR_BLOCK_UNAVAILABLE)
+            self.stats["writes"] += count
+            self.memory[blockno * self.blocksize:(blockno + count) * self.blocksize] = \
+                args[2:2 + count * self.blocksize]
+            return b"\x00"
+        self.busy(self.latency[ISO15693_READBLOCK])
+        return self.error(ISO15_ERROR_CMD_NOT_SUP)
+
+    def block(self, blockno: int, option: int) -> bytes:
+        pgdata = bytes(self.memory[blockno * self.blocksize:(blockno + 1) * self.blocksize])
+        if option:
+            return bytes([self.locks[blockno]]) + pgdata
+        return pgdata
+
+
+if __name__ == "__main__":
+    emulator = PM3Emulator(logger=print)
+    print(f"Emulated Proxmark3 on {emulator.start()}, Ctrl+C to quit")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
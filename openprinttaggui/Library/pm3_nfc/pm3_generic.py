@@ -1,10 +1,31 @@
 #!/usr/bin/env python3
 # (c) B.Kerler 2025
+import struct
+import threading
 import time
+from collections import deque
 from typing import Literal
 from serial import Serial
 from enum import Enum
 
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS, iso15_command_name
+from openprinttaggui.Library.nfc_transport import transport_stream
+
+PM3_CMD_DATA_SIZE = 0x200  # max payload of a single NG frame
+
+# magic, length (bit 15 = ng), cmd
+PM3_CMD_PREAMBLE = struct.Struct("<4sHH")
+# magic, length (bit 15 = ng), status, reason, cmd
+PM3_RESP_PREAMBLE = struct.Struct("<4sHbbH")
+PM3_RESP_MAGIC = b"PM3b"
+PM3_RESP_POSTAMBLE_SIZE = 2
+PM3_MIX_ARGS_SIZE = 0x18
+PM3_U16 = struct.Struct("<H")
+PM3_U64 = struct.Struct("<Q")
+# After a timeout the reader thread discards late responses until the link stayed quiet that long (s)
+PM3_DRAIN_QUIET = 0.2
+PM3_DRAIN_MAX = 2.0
+
 
 class PM3CMD(Enum):
     # For the bootloader
@@ -535,6 +556,300 @@ class PacketResponseNG:
         return self.packet.u64(offset=10 + (index << 3))
 
 
+class PacketResponseNGView:
+    """
+    NG response decoded in place by PM3FrameDecoder. frame and payload are memoryviews into the
+    decoder buffer and are only valid until the next read, data makes a copy for callers which keep it.
+    """
+    __slots__ = ("frame", "payload", "status", "reason", "cmd", "ng")
+
+    def __init__(self, frame: memoryview, status: int, reason: int, cmd: int, ng: bool):
+        self.frame = frame
+        self.status = status
+        self.reason = reason
+        self.cmd = cmd
+        self.ng = ng
+        start = PM3_RESP_PREAMBLE.size if ng else PM3_RESP_PREAMBLE.size + PM3_MIX_ARGS_SIZE
+        self.payload = frame[start:len(frame) - PM3_RESP_POSTAMBLE_SIZE]
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def data(self):
+        return Packet(self.payload)
+
+    @property
+    def crc(self):
+        return PM3_U16.unpack_from(self.frame, len(self.frame) - PM3_RESP_POSTAMBLE_SIZE)[0]
+
+    def getArg(self, index):
+        return PM3_U64.unpack_from(self.frame, PM3_RESP_PREAMBLE.size + (index << 3))[0]
+
+
+class PM3FrameDecoder:
+    """
+    Streaming decoder for PM3b frames. Received bytes go into one preallocated buffer,
+    frames are handed out as views into it. Consumed space is reclaimed on the next read by
+    moving the (usually empty) undecoded remainder back to the start of the buffer.
+    """
+
+    def __init__(self, size: int = 0x1000):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # perf_counter() of the first and last read of the last returned frame, for the metrics
+        self.rx_first = None
+        self.rx_last = None
+        self.frame_start = None
+
+    def reset(self):
+        self.start = 0
+        self.end = 0
+        self.rx_first = None
+
+    def compact(self):
+        if self.start == 0:
+            return
+        remaining = self.end - self.start
+        if remaining:
+            self.buffer[:remaining] = bytes(self.view[self.start:self.end])
+        self.start = 0
+        self.end = remaining
+
+    def next_frame(self):
+        """
+        Returns the next complete frame in the buffer or None together with the number of bytes still missing
+        """
+        while True:
+            avail = self.end - self.start
+            if avail < PM3_RESP_PREAMBLE.size:
+                return None, PM3_RESP_PREAMBLE.size - avail
+            if self.view[self.start:self.start + 4] != PM3_RESP_MAGIC:
+                # Out of sync, skip to the next magic
+                idx = self.buffer.find(PM3_RESP_MAGIC, self.start, self.end)
+                if idx == -1:
+                    self.start = max(self.start, self.end - (len(PM3_RESP_MAGIC) - 1))
+                    return None, PM3_RESP_PREAMBLE.size
+                self.start = idx
+                continue
+            _, length, status, reason, cmd = PM3_RESP_PREAMBLE.unpack_from(self.buffer, self.start)
+            if length & 0x7fff > PM3_CMD_DATA_SIZE + PM3_MIX_ARGS_SIZE:
+                # Corrupt header or a "PM3b" inside payload data, resync behind this magic
+                self.start += 1
+                continue
+            total = PM3_RESP_PREAMBLE.size + (length & 0x7fff) + PM3_RESP_POSTAMBLE_SIZE
+            if avail < total:
+                return None, total - avail
+            frame = self.view[self.start:self.start + total]
+            self.start += total
+            return PacketResponseNGView(frame, status, reason, cmd, (length & 0x8000) > 0), 0
+
+    def read_frame(self, port):
+        """
+        Reads from port until a complete frame is available, honours the port timeout
+        """
+        self.compact()
+        while True:
+            resp, missing = self.next_frame()
+            if resp is not None:
+                self.frame_start = self.rx_first if self.rx_first is not None else self.rx_last
+                # Bytes left over belong to the next frame and arrived with the last read
+                self.rx_first = self.rx_last if self.end > self.start else None
+                return resp
+            if self.start > 0:
+                self.compact()
+            free = len(self.buffer) - self.end
+            size = min(max(missing, port.in_waiting), free)
+            n = port.readinto(self.view[self.end:self.end + size])
+            if not n:
+                raise TimeoutError("Timeout waiting for pm3 response")
+            self.rx_last = time.perf_counter()
+            if self.rx_first is None:
+                self.rx_first = self.rx_last
+            self.end += n
+
+
+class PM3PendingCommand:
+    def __init__(self, cmd: int, timeout: int):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.deadline = time.time() + timeout / 1000
+        self.event = threading.Event()
+        self.resp = None
+        self.error = None  # Set if the reader thread gave up before the response came
+        self.sent = None  # (label, tx start, tx end) for the metrics
+
+
+class PM3CommandEngine:
+    """
+    Keeps several commands in flight on one Proxmark3Handler. A dedicated reader thread
+    decodes all incoming frames and hands each response to the oldest pending command
+    with the same cmd, WTX frames extend the deadlines of the pending commands.
+    Responses carry no sequence number, so a timeout ends the pipeline: a late response would be
+    taken for the answer of the next queued command.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.timeout_backup = None
+        self.last_response = 0
+        self.error = None
+        self.failed_at = 0
+
+    def start(self):
+        if self.running:
+            return
+        if self.thread is not None:
+            # Reader thread ended after an error, restore the port first
+            self.stop()
+        self.error = None
+        self.port.reset_input_buffer()
+        self.timeout_backup = self.port.timeout
+        # Short read timeout so the reader thread notices stop()
+        self.port.timeout = 0.05
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # The reader thread may have ended on its own after an error
+        if self.thread is None:
+            return
+        if self.error is not None and self.thread.is_alive():
+            self.drain()
+        self.running = False
+        if self.thread.is_alive() and hasattr(self.port, "cancel_read"):
+            # Don't wait for the read timeout of the reader thread
+            self.port.cancel_read()
+        self.thread.join()
+        self.thread = None
+        self.port.timeout = self.timeout_backup
+        with self.lock:
+            for pending in self.pending:
+                pending.event.set()
+            self.pending.clear()
+
+    def run(self):
+        decoder = self.port.decoder
+        while True:
+            try:
+                resp = decoder.read_frame(self.port)
+            except TimeoutError:
+                # stop() cancels the read, so this also consumes the pending cancel
+                if not self.running:
+                    break
+                continue
+            except Exception as e:
+                # Broken frame or port, nothing will be answered anymore
+                self.fail(f"Proxmark3 reader thread stopped: {str(e)}")
+                break
+            if resp.cmd == PM3CMD.WTX.value and len(resp.payload) == 2:
+                wtx = PM3_U16.unpack_from(resp.payload)[0]
+                with self.lock:
+                    for pending in self.pending:
+                        pending.deadline += wtx / 1000
+                    if self.pending:
+                        self.port.observe_wtx(self.pending[0].sent, wtx)
+                continue
+            with self.lock:
+                match = None
+                for pending in self.pending:
+                    if pending.cmd == resp.cmd:
+                        match = pending
+                        break
+                if match is None:
+                    continue
+                self.pending.remove(match)
+                # The next queued command only starts on the wire now
+                now = time.time()
+                for pending in self.pending:
+                    pending.deadline = max(pending.deadline, now + pending.timeout / 1000)
+            if match.sent is not None:
+                # A queued command only reaches the tag once the previous answer is out
+                label, tx_start, tx_end = match.sent
+                started = max(tx_start, self.last_response)
+                self.port.observe_response((label, started, max(tx_end, started)))
+            self.last_response = decoder.rx_last
+            # Detach from the decoder buffer, it gets reused by the next read
+            match.resp = PacketResponseNGView(memoryview(bytes(resp.frame)), resp.status, resp.reason, resp.cmd, resp.ng)
+            match.event.set()
+        self.running = False
+
+    def drain(self):
+        """
+        Lets the reader thread discard responses of failed commands until the link is quiet
+        """
+        start = time.perf_counter()
+        while time.perf_counter() - start < PM3_DRAIN_MAX and not self.port.replaying:
+            last = max(self.port.decoder.rx_last or 0, self.failed_at)
+            if time.perf_counter() - last >= PM3_DRAIN_QUIET:
+                break
+            time.sleep(PM3_DRAIN_QUIET / 4)
+
+    def fail(self, message: str):
+        """
+        Reports the error and releases all pending commands, their wait() raises it.
+        No further commands are accepted until the engine is restarted.
+        """
+        self.port.logger(message)
+        with self.lock:
+            self.failed_at = time.perf_counter()
+            self.error = message
+            for pending in self.pending:
+                pending.error = message
+                pending.event.set()
+            self.pending.clear()
+
+    def submit(self, cmd: int, data=None, timeout: int = 2500) -> PM3PendingCommand:
+        pending = PM3PendingCommand(cmd=cmd, timeout=timeout)
+        with self.lock:
+            if self.error is not None:
+                raise Exception(self.error)
+            self.pending.append(pending)
+        self.port.write(self.port.buildCommandNG(cmd=cmd, data=data))
+        pending.sent = self.port.sent
+        return pending
+
+    def wait(self, pending: PM3PendingCommand):
+        while True:
+            if pending.event.wait(max(pending.deadline - time.time(), 0)):
+                if pending.error is not None:
+                    raise Exception(pending.error)
+                return pending.resp
+            with self.lock:
+                if time.time() < pending.deadline:
+                    # Extended by a WTX meanwhile
+                    continue
+                if pending not in self.pending:
+                    # Answered or failed meanwhile, the event is set
+                    continue
+            if pending.sent is not None:
+                NFC_METRICS.inc("pm3", pending.sent[0], "timeouts")
+            label = pending.sent[0] if pending.sent is not None else f"cmd {pending.cmd:04x}"
+            self.fail(f"Timeout waiting for pm3 response to {label}")
+            raise Exception(self.error)
+
+
+def pm3_command_label(packet) -> str:
+    """
+    Metrics label of an outgoing PM3a frame, ISO15693 commands by their ISO15693 command byte
+    """
+    _, _, cmd = PM3_CMD_PREAMBLE.unpack_from(packet)
+    if cmd == PM3CMD.HF_ISO15693_COMMAND.value and len(packet) > PM3_CMD_PREAMBLE.size + 4:
+        # iso15_raw_cmd_t: flags, rawlen, raw = request flags, command, ...
+        return iso15_command_name(packet[PM3_CMD_PREAMBLE.size + 4])
+    try:
+        return PM3CMD(cmd).name.lower()
+    except ValueError:
+        return f"cmd_{cmd:04x}"
+
+
 class ISODEP_STATE_T(Enum):
     ISODEP_INACTIVE = 0
     ISODEP_NFCA = 1
@@ -558,30 +873,136 @@ class Proxmark3Handler(Serial):
             inter_byte_timeout: float | None = None,
             exclusive: bool | None = None,
     ):
+        # Serial.open() already flushes the input, so the decoder has to exist first
+        self.decoder = PM3FrameDecoder()
+        # Replaced by the logger of PM3_HF15
+        self.logger = print
+        # Recorded or replayed serial traffic, see nfc_transport
+        self.trace = transport_stream("pm3")
         super().__init__(port, baudrate, bytesize, parity, stopbits, timeout, xonxoff, rtscts, write_timeout, dsrdtr,
                          inter_byte_timeout, exclusive)
         self.isodep_state = None
+        self.engine = None
+        self.sent = None  # (label, tx start, tx end) of the last written command
+
+    @property
+    def replaying(self) -> bool:
+        return self.trace is not None and self.trace.replaying
+
+    def open(self):
+        if self.replaying:
+            self.is_open = True
+            return
+        super().open()
+
+    def close(self):
+        if self.replaying:
+            self.is_open = False
+            return
+        super().close()
+
+    def _reconfigure_port(self, *args, **kwargs):
+        if self.replaying:
+            return
+        super()._reconfigure_port(*args, **kwargs)
+
+    def write(self, data):
+        start = time.perf_counter()
+        if self.replaying:
+            n = self.trace.write(data)
+        else:
+            n = super().write(data)
+            if self.trace is not None:
+                self.trace.tx(data)
+        if NFC_METRICS.enabled:
+            end = time.perf_counter()
+            label = pm3_command_label(data)
+            NFC_METRICS.observe("pm3", label, "usb_tx", (end - start) * 1000)
+            self.sent = (label, start, end)
+        return n
+
+    def observe_response(self, sent):
+        """
+        Splits the time since the command went out into rf (until the first byte came back) and usb_rx
+        """
+        if sent is None or not NFC_METRICS.enabled:
+            return
+        label, tx_start, tx_end = sent
+        rx_end = self.decoder.rx_last
+        rx_start = min(max(self.decoder.frame_start, tx_end), rx_end)
+        NFC_METRICS.observe("pm3", label, "rf", (rx_start - tx_end) * 1000)
+        NFC_METRICS.observe("pm3", label, "usb_rx", (rx_end - rx_start) * 1000)
+        NFC_METRICS.observe("pm3", label, "total", (rx_end - tx_start) * 1000)
+
+    def observe_wtx(self, sent, wtx: int):
+        if sent is None:
+            return
+        NFC_METRICS.inc("pm3", sent[0], "wtx")
+        NFC_METRICS.observe("pm3", sent[0], "wtx", wtx)
+
+    def readinto(self, buffer):
+        if self.replaying:
+            return self.trace.readinto(buffer, self.timeout)
+        n = super().readinto(buffer)
+        if n and self.trace is not None:
+            self.trace.rx(buffer[:n])
+        return n
+
+    @property
+    def in_waiting(self):
+        if self.replaying:
+            return self.trace.in_waiting
+        return super().in_waiting
+
+    def cancel_read(self):
+        if self.replaying:
+            self.trace.cancel_read()
+            return
+        super().cancel_read()
+
+    def reset_input_buffer(self):
+        if not self.replaying:
+            super().reset_input_buffer()
+        self.decoder.reset()
+
+    def start_pipeline(self):
+        """
+        Switches to a dedicated reader thread, see PM3CommandEngine. Only submit()/wait() of
+        self.engine may be used for commands until stop_pipeline() is called.
+        """
+        if not self.is_open:
+            self.open()
+        if self.engine is None:
+            self.engine = PM3CommandEngine(self)
+        self.engine.start()
+
+    def stop_pipeline(self):
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
 
     def SendCommandNG(self, cmd: int, data: Packet = None, ng=True):
         self.reset_input_buffer()
+        packet = self.buildCommandNG(cmd=cmd, data=data, ng=ng)
+        if not self.is_open:
+            self.open()
+        self.write(packet)
+
+    def buildCommandNG(self, cmd: int, data: Packet = None, ng=True) -> bytearray:
         if data and not isinstance(data, Packet):
             raise ValueError("data must be a Packet object")
         if data is not None:
             length = len(data)
-            if length > 0x200:
+            if length > PM3_CMD_DATA_SIZE:
                 raise ValueError("data must be less than 0x200 bytes")
         else:
             length = 0
-        packet = Packet(length + 0xA)
-        packet[:4] = b'PM3a'
-        packet.u16(offset=4, value=length + (0x8000 if ng else 0))
-        packet.u16(offset=6, value=cmd)
+        packet = bytearray(length + 0xA)
+        PM3_CMD_PREAMBLE.pack_into(packet, 0, b'PM3a', length + (0x8000 if ng else 0), cmd)
         if data is not None:
             packet[8: length + 8] = data
         packet[-2:] = b"a3"
-        if not self.is_open:
-            self.open()
-        self.write(packet)
+        return packet
 
     def ping(self):
         pkt = Packet(0x1C)
@@ -638,11 +1059,7 @@ class Proxmark3Handler(Serial):
     def readResp(self):
         if not self.is_open:
             self.open()
-        pre = Packet(self.read(0xA))
-        if pre[0:4] == b'PM3b':
-            return PacketResponseNG(Packet(pre + self.read((pre.u16(offset=4) & 0x7fff) + 2)))
-        else:
-            return PacketResponse(Packet(pre + self.read(0x200 + 0x16)))
+        return self.decoder.read_frame(self)
 
     def waitRespTimeout(self, cmd, timeout=2500):
         ts = {
@@ -656,13 +1073,17 @@ class Proxmark3Handler(Serial):
                 self.timeout = ts['end'] - time.time()
                 resp = self.readResp()
                 if cmd == PM3CMD.UNKNOWN.value or resp.cmd == cmd:
+                    self.observe_response(self.sent)
                     return resp
-                if resp.cmd == PM3CMD.WTX.value and len(resp.data) == 2:
-                    wtx = resp.data.u16(offset=0)
+                if resp.cmd == PM3CMD.WTX.value and len(resp.payload) == 2:
+                    wtx = PM3_U16.unpack_from(resp.payload)[0]
                     if wtx >= 0xffff:
                         continue
+                    self.observe_wtx(self.sent, wtx)
                     ts['end'] += wtx / 1000
         except Exception as e:
+            if isinstance(e, TimeoutError) and self.sent is not None:
+                NFC_METRICS.inc("pm3", self.sent[0], "timeouts")
             print(str(e))
         finally:
             self.timeout = ts['backup']
@@ -2,6 +2,7 @@
 # (c) B.Kerler 2025
 import os
 import sys
+from collections import deque
 from io import BytesIO
 from enum import Enum
 
@@ -10,8 +11,11 @@ sys.path.insert(0, os.path.dirname(script_path))
 sys.path.insert(1, script_path)
 sys.path.insert(2, os.path.join(script_path, "Library", "OpenPrintTag", "utils"))
 
-from openprinttaggui.Library.pm3_nfc.pm3_generic import Proxmark3Handler, PM3CMD, Packet
-from openprinttaggui.Library.iso15693 import ISO15_TAG_T, ISO15693_UID_LENGTH, ISO15693_TAG_MAX_PAGES, ISO15693_TAG_MAX_SIZE, ISO15693_ATQB_LENGTH
+from openprinttaggui.Library.iso15693_crc import crc16
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS
+from openprinttaggui.Library.pm3_nfc.pm3_generic import Proxmark3Handler, PM3CMD, Packet, PM3_CMD_DATA_SIZE
+from openprinttaggui.Library.iso15693 import ISO15_TAG_T, ISO15693_UID_LENGTH, ISO15693_TAG_MAX_PAGES, ISO15693_TAG_MAX_SIZE, ISO15693_ATQB_LENGTH, \
+    ISO15_DUMP_CACHE_T, get_dirty_blocks, read_ndef_blocks
 
 class ISO15_COMMAND(Enum):
     ISO15_CONNECT = (1 << 0)
@@ -103,22 +107,13 @@ ISO15693_READ_SIGNATURE = 0xBD
 #
 ISO15693_MAGIC_WRITE = 0xE0
 
-def crc16(data: bytes) -> int:
-    """
-    crcmod.mkCrcFun(0x11021, initCrc=0, xorOut=0xFFFF, rev=True)
-    """
-    poly = 0x8408
-    crc = 0xFFFF  # Use 0x0000 if strictly following your specified initCrc=0
-
-    for byte in data:
-        crc ^= byte
-        for _ in range(8):
-            if crc & 0x0001:
-                crc = (crc >> 1) ^ poly
-            else:
-                crc >>= 1
-
-    return crc ^ 0xFFFF
+# Upper bound of blocks per READ_MULTI_BLOCK request, most SLIX/SLIX2 tags accept 32 at once
+ISO15693_READ_MULTI_MAX_BLOCKS = 32
+# Upper bound of blocks per WRITE_MULTI_BLOCK request, tags that support it at all take 4 at once
+ISO15693_WRITE_MULTI_MAX_BLOCKS = 4
+# Commands kept in flight while pipelining, a failed write may be followed by one already queued write
+PM3_PIPELINE_READ_DEPTH = 4
+PM3_PIPELINE_WRITE_DEPTH = 2
 
 class ISO15_RAW_CMD_T:
     def __init__(self, flags: int, raw: bytes):
@@ -133,9 +128,15 @@ class ISO15_RAW_CMD_T:
 class PM3_HF15(Proxmark3Handler):
 
     def __init__(self, port: str, baudrate: int = 115200, logger=print):
+        # Set before opening the port, Serial closes it again on errors
+        self.dump_cache = ISO15_DUMP_CACHE_T()
         super().__init__(port=port, baudrate=baudrate)
         self.logger = logger
 
+    def close(self):
+        self.dump_cache.clear()
+        super().close()
+
     def iso15_card_select_t(self, data):
         rf = BytesIO(bytearray(data))
         uid = rf.read(ISO15693_UID_LENGTH)
@@ -174,15 +175,20 @@ class PM3_HF15(Proxmark3Handler):
         self.SendCommandNG(cmd=PM3CMD.HF_ISO15693_COMMAND.value, data=pkt)
         resp = self.waitRespTimeout(PM3CMD.HF_ISO15693_COMMAND.value)
         if resp.status:
+            # No tag, the cached dump may belong to whatever tag comes next
+            self.dump_cache.clear()
             raise Exception('Failed to detect tag')
         data = resp.data
         if len(data) != 12:
+            self.dump_cache.clear()
             raise Exception('Got invalid uid length')
         # 0000bd4aec18090104e0c8af
         gen_crc = self.crc_x25(data[:10])
         if int.to_bytes(gen_crc, 2, 'little') != data[-2:]:
+            self.dump_cache.clear()
             raise Exception('Got invalid uid crc16')
         uid = resp.data[2:10]
+        self.dump_cache.check_uid(uid)
         return uid
 
     def iso15_error_handling_card_response(self, data):
@@ -229,13 +235,138 @@ class PM3_HF15(Proxmark3Handler):
             tag.parse(resp.data)
         return tag
 
-    def dump(self, filename: str = None, fast: bool = True, blocksize: int = 4, progress=None):
+    def exchange_iso15(self, requests: list, on_response, timeout: int = 2500, depth: int = 1):
+        """
+        Sends the (pm3flags, raw) requests in order and passes every response (None on timeout) to
+        on_response(index, resp). While a pipeline is running, up to depth requests are kept in flight.
+        Once on_response returns False no further requests are sent, responses still on the wire are dropped.
+        """
+        if self.engine is None:
+            for idx, (pm3flags, raw) in enumerate(requests):
+                pkt = ISO15_RAW_CMD_T(flags=pm3flags, raw=raw).pkt
+                self.SendCommandNG(cmd=PM3CMD.HF_ISO15693_COMMAND.value, data=pkt)
+                resp = self.waitRespTimeout(PM3CMD.HF_ISO15693_COMMAND.value, timeout=timeout)
+                if not on_response(idx, resp):
+                    break
+            return
+        inflight = deque()
+        nextidx = 0
+        stopped = False
+        while inflight or (not stopped and nextidx < len(requests)):
+            while not stopped and nextidx < len(requests) and len(inflight) < max(depth, 1):
+                pm3flags, raw = requests[nextidx]
+                pkt = ISO15_RAW_CMD_T(flags=pm3flags, raw=raw).pkt
+                inflight.append((nextidx, self.engine.submit(cmd=PM3CMD.HF_ISO15693_COMMAND.value, data=pkt,
+                                                             timeout=timeout)))
+                nextidx += 1
+            idx, pending = inflight.popleft()
+            resp = self.engine.wait(pending)
+            if not stopped and not on_response(idx, resp):
+                stopped = True
+
+    def read_blk_raw(self, raw: bytearray, blockno: int) -> bytearray:
+        return raw[:1] + bytearray([ISO15693_READBLOCK]) + raw[1:] + bytearray([blockno & 0xFF])
+
+    def read_multi_blk_raw(self, raw: bytearray, blockno: int, count: int) -> bytearray:
+        return raw[:1] + bytearray([ISO15693_READ_MULTI_BLOCK]) + raw[1:] + bytearray([blockno & 0xFF, (count - 1) & 0xFF])
+
+    def parse_multi_blk(self, resp, count: int, blocksize: int):
+        """
+        Returns a list of (lock, data) tuples or None if the tag rejected READ_MULTI_BLOCK
+        """
+        if resp is None or resp.status:
+            return None
+        d = resp.payload
+        # flags + count * (lock + block) + crc
+        if len(d) != 1 + count * (blocksize + 1) + 2 or d[0] & ISO15_RES_ERROR == ISO15_RES_ERROR:
+            return None
+        blocks = []
+        for i in range(count):
+            pos = 1 + i * (blocksize + 1)
+            blocks.append((d[pos], d[pos + 1:pos + 1 + blocksize]))
+        return blocks
+
+    def multi_blk_count(self, tag: ISO15_TAG_T, blockno: int, max_blocks: int = ISO15693_READ_MULTI_MAX_BLOCKS):
+        # flags + crc around count * (lock + block), must fit into one PM3 frame
+        frame_blocks = (PM3_CMD_DATA_SIZE - 3) // (tag.bytesPerPage + 1)
+        return max(1, min(tag.pagesCount - blockno, frame_blocks, max_blocks, 256))
+
+    def dump_multi_blks(self, tag: ISO15_TAG_T, raw: bytearray, pm3flags: int, start: int = 0, end: int = None,
+                        progress=None) -> int:
+        """
+        Reads blocks start to end using READ_MULTI_BLOCK, returns the first block that couldn't be read that way
+        """
+        if end is None:
+            end = tag.pagesCount
+        chunks = []
+        blocknum = start
+        while blocknum < end:
+            count = min(self.multi_blk_count(tag, blocknum), end - blocknum)
+            chunks.append((blocknum, count))
+            blocknum += count
+        requests = [(pm3flags, self.read_multi_blk_raw(raw, chunkstart, count)) for chunkstart, count in chunks]
+        nextblock = start
+
+        def on_response(idx, resp):
+            nonlocal nextblock
+            chunkstart, count = chunks[idx]
+            blocks = self.parse_multi_blk(resp, count, tag.bytesPerPage)
+            if blocks is None:
+                return False
+            for blocknum, (lock, pgdata) in enumerate(blocks, chunkstart):
+                tag.locks[blocknum] = lock
+                tag.data[blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage] = bytearray(
+                    pgdata[:tag.bytesPerPage])
+            nextblock = chunkstart + count
+            if progress:
+                progress(nextblock / tag.pagesCount * 100)
+            return True
+
+        self.exchange_iso15(requests, on_response, timeout=2000, depth=PM3_PIPELINE_READ_DEPTH)
+        return nextblock
+
+    def dump_single_blks(self, tag: ISO15_TAG_T, raw: bytearray, pm3flags: int, start: int = 0, end: int = None,
+                         progress=None) -> int:
+        """
+        Reads blocks start to end one by one, returns the block number it stopped at
+        """
+        if end is None:
+            end = tag.pagesCount
+        requests = [(pm3flags, self.read_blk_raw(raw, blocknum)) for blocknum in range(start, end)]
+        nextblock = start
+
+        def on_response(idx, resp):
+            nonlocal nextblock
+            blocknum = start + idx
+            if progress:
+                progress(blocknum / tag.pagesCount * 100)
+            if resp is None or resp.status:
+                raise Exception('Failed to read block data')
+            d = resp.payload
+            if d[0] & ISO15_RES_ERROR == ISO15_RES_ERROR:
+                if d[1] == 0x0F or d[1] == 0x10:
+                    return False
+                raise Exception('Failed to read block data')
+            tag.locks[blocknum] = d[1]
+            pgdata = d[2:]
+            tag.data[blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage] = bytearray(
+                pgdata[:tag.bytesPerPage])
+            nextblock = blocknum + 1
+            return True
+
+        self.exchange_iso15(requests, on_response, timeout=2000, depth=PM3_PIPELINE_READ_DEPTH)
+        return nextblock
+
+    def dump(self, filename: str = None, fast: bool = True, blocksize: int = 4, progress=None, multiblock: bool = True,
+             pipeline: bool = True, lazy: bool = False):
+        """
+        lazy: only read the blocks up to the end of the NDEF message, ignored when saving to filename
+        """
         tag = self.iso15_get_system_info(fast=fast, blocksize=blocksize)
 
         raw = bytearray(int.to_bytes(self.arg_get_raw_flag(uidlen=0, unaddressed=False, scan=True, add_option=False), 1,
                                      byteorder='little'))
         raw[0] |= ISO15_REQ_OPTION
-        raw.append(ISO15693_READBLOCK)
         flags = (ISO15_COMMAND.ISO15_READ_RESPONSE.value |
                  ISO15_COMMAND.ISO15_NO_DISCONNECT.value)
         if fast:
@@ -244,24 +375,32 @@ class PM3_HF15(Proxmark3Handler):
             raw.extend(tag.uid)
         if progress:
             progress(0)
-        for blocknum in range(tag.pagesCount):
-            if progress:
-                progress(blocknum / tag.pagesCount * 100)
-            draw = raw + int.to_bytes(blocknum & 0xFF, 1)
-            pkt = ISO15_RAW_CMD_T(flags=flags, raw=draw).pkt
-            self.SendCommandNG(cmd=PM3CMD.HF_ISO15693_COMMAND.value, data=pkt)
-            resp = self.waitRespTimeout(PM3CMD.HF_ISO15693_COMMAND.value, timeout=2000)
-            if resp.status:
-                raise Exception('Failed to read block data')
-            d = resp.data
-            if d[0] & ISO15_RES_ERROR == ISO15_RES_ERROR:
-                if d[1] == 0x0F or d[1] == 0x10:
-                    break
-                raise Exception('Failed to read block data')
-            tag.locks[blocknum] = resp.data[1]
-            pgdata = resp.data[2:]
-            tag.data[blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage] = bytearray(
-                pgdata[:tag.bytesPerPage])
+
+        def read_blocks(start, end):
+            nonlocal multiblock
+            blocknum = start
+            if multiblock:
+                blocknum = self.dump_multi_blks(tag, raw, flags, blocknum, end, progress)
+            if blocknum < end:
+                # Tag doesn't support READ_MULTI_BLOCK (or ran past its end), continue block by block
+                if multiblock:
+                    NFC_METRICS.inc("pm3", "read_multiple_blocks", "retries")
+                multiblock = False
+                blocknum = self.dump_single_blks(tag, raw, flags, blocknum, end, progress)
+            return blocknum
+
+        if pipeline:
+            self.start_pipeline()
+        try:
+            if lazy and filename is None:
+                blocks = read_ndef_blocks(read_blocks, tag)
+                tag.data[blocks * tag.bytesPerPage:] = bytes(len(tag.data) - blocks * tag.bytesPerPage)
+            else:
+                blocks = read_blocks(0, tag.pagesCount)
+        finally:
+            if pipeline:
+                self.stop_pipeline()
+        self.dump_cache.store(tag.uid, tag.data[:blocks * tag.bytesPerPage])
         if progress:
             progress(100)
         if filename is None:
@@ -270,7 +409,7 @@ class PM3_HF15(Proxmark3Handler):
         self.DropField()
         return tag
 
-    def write_blk(self, pm3flags: int, flags: int, uid: bytes, fast: bool, blockno, data: bytes):
+    def write_blk_raw(self, flags: int, uid: bytes, blockno, data: bytes) -> bytearray:
         # 504D3361 1480 1303 73 1100 2221 BD4AEC18090104E0 00 E1402701 C919 6133
         raw = bytearray()
         raw.append(flags)
@@ -280,6 +419,21 @@ class PM3_HF15(Proxmark3Handler):
         raw.append(blockno)
         if data is not None:
             raw.extend(data)
+        return raw
+
+    def write_multi_blk_raw(self, flags: int, uid: bytes, blockno: int, count: int, data: bytes) -> bytearray:
+        raw = bytearray()
+        raw.append(flags)
+        raw.append(ISO15693_WRITE_MULTI_BLOCK)
+        if uid is not None:
+            raw.extend(uid)
+        raw.append(blockno & 0xFF)
+        raw.append((count - 1) & 0xFF)
+        raw.extend(data)
+        return raw
+
+    def write_blk(self, pm3flags: int, flags: int, uid: bytes, fast: bool, blockno, data: bytes):
+        raw = self.write_blk_raw(flags=flags, uid=uid, blockno=blockno, data=data)
         if pm3flags is not None:
             flags = pm3flags
         else:
@@ -297,7 +451,14 @@ class PM3_HF15(Proxmark3Handler):
             return True
         return False
 
-    def restore(self, data_or_filename, fast: bool = False, blocksize: int = 4, progress=None):
+    def restore(self, data_or_filename, fast: bool = False, blocksize: int = 4, progress=None, diff: bool = False,
+                blocklist: list = None, pipeline: bool = True, multiblock: bool = False):
+        """
+        diff: only write the blocks that differ from the cached dump, or from a fresh read without one.
+        A diff against the cached dump is read back afterwards and blocks it missed are written.
+        multiblock: write runs of up to ISO15693_WRITE_MULTI_MAX_BLOCKS consecutive blocks with WRITE_MULTI_BLOCK,
+        runs the tag refuses are written block by block. Off by default, SLIX/SLIX2 don't support it.
+        """
         tag = self.iso15_get_system_info(fast=fast, blocksize=blocksize)
         add_option = False
         if isinstance(data_or_filename, str):
@@ -310,6 +471,9 @@ class PM3_HF15(Proxmark3Handler):
                     ISO15_COMMAND.ISO15_NO_DISCONNECT.value)
         if fast:
             pm3flags |= ISO15_COMMAND.ISO15_HIGH_SPEED.value
+        nextflags = (ISO15_COMMAND.ISO15_LONG_WAIT.value |
+                     ISO15_COMMAND.ISO15_READ_RESPONSE.value |
+                     ISO15_COMMAND.ISO15_NO_DISCONNECT.value)
 
         if tag.uid[7] == b"\xE0" and tag.uid[6] == 0x07:
             # Overriding option param, writing to TI tag
@@ -324,20 +488,90 @@ class PM3_HF15(Proxmark3Handler):
         blocks = len(filldata) // tag.bytesPerPage
         if progress:
             progress(0)
-        blockstowrite = min(blocks, tag.pagesCount)
-        for blocknum in range(blockstowrite):
-            if progress:
-                progress(blocknum / blockstowrite * 100)
-            if not self.write_blk(pm3flags=pm3flags, flags=flags,
-                                  uid=tag.uid, fast=fast, blockno=blocknum,
-                                  data=tag.data[
-                                       blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage]):
-                return False
-            if blocknum == 0:
-                pm3flags = (ISO15_COMMAND.ISO15_LONG_WAIT.value |
-                            ISO15_COMMAND.ISO15_READ_RESPONSE.value |
-                            ISO15_COMMAND.ISO15_NO_DISCONNECT.value)
+        blockstowrite = list(range(min(blocks, tag.pagesCount)))
+        if blocklist is not None:
+            blockstowrite = [blocknum for blocknum in blockstowrite if blocknum in blocklist]
+        candidates = blockstowrite
+        from_cache = False
+        if diff:
+            current = self.dump_cache.get(tag.uid)
+            from_cache = current is not None and \
+                len(current) >= (max(blockstowrite, default=-1) + 1) * tag.bytesPerPage
+            if not from_cache:
+                self.logger("Reading tag to find changed blocks ...")
+                current = self.dump(fast=fast, blocksize=blocksize).data
+            dirty = get_dirty_blocks(current, filldata, tag.bytesPerPage, min(blocks, tag.pagesCount))
+            blockstowrite = [blocknum for blocknum in blockstowrite if blocknum in dirty]
+            self.logger(f"Writing {len(blockstowrite)} changed blocks ...")
+        written = True
+        done = 0
+
+        def write_runs(runs, refused):
+            requests = []
+            for idx, (blocknum, count) in enumerate(runs):
+                data = tag.data[blocknum * tag.bytesPerPage:(blocknum + count) * tag.bytesPerPage]
+                if count > 1:
+                    raw = self.write_multi_blk_raw(flags=flags, uid=tag.uid, blockno=blocknum, count=count, data=data)
+                else:
+                    raw = self.write_blk_raw(flags=flags, uid=tag.uid, blockno=blocknum, data=data)
+                requests.append((pm3flags if idx == 0 else nextflags, raw))
+
+            def on_response(idx, resp):
+                nonlocal written, done
+                if resp is None or resp.status:
+                    raise Exception('Failed to write tag')
+                if runs[idx][1] > 1 and resp.payload[0] & ISO15_RES_ERROR == ISO15_RES_ERROR:
+                    # Tag doesn't support WRITE_MULTI_BLOCK, these blocks get written one by one
+                    refused.append(runs[idx])
+                    return True
+                if not self.iso15_error_handling_card_response(resp.payload):
+                    written = False
+                done += runs[idx][1]
+                if progress:
+                    progress(min(done / max(len(blockstowrite), 1), 1) * 100)
+                return written
+
+            self.exchange_iso15(requests, on_response, depth=PM3_PIPELINE_WRITE_DEPTH)
+
+        def write_blocks(blocknums):
+            runs = []
+            for blocknum in blocknums:
+                if multiblock and runs and runs[-1][0] + runs[-1][1] == blocknum and \
+                        runs[-1][1] < ISO15693_WRITE_MULTI_MAX_BLOCKS:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([blocknum, 1])
+            refused = []
+            if pipeline:
+                self.start_pipeline()
+            try:
+                write_runs(runs, refused)
+                if refused and written:
+                    NFC_METRICS.inc("pm3", "write_multiple_blocks", "retries")
+                    write_runs([[blocknum + idx, 1] for blocknum, count in refused for idx in range(count)], [])
+            except Exception:
+                self.dump_cache.clear()
+                raise
+            finally:
+                if pipeline:
+                    self.stop_pipeline()
+
+        write_blocks(blockstowrite)
+        if written and from_cache:
+            # The tag may have been changed elsewhere and put back between two polls, then the cached
+            # dump is outdated. Read it back and write what the diff missed.
+            current = self.dump(fast=fast, blocksize=blocksize).data
+            dirty = get_dirty_blocks(current, filldata, tag.bytesPerPage, min(blocks, tag.pagesCount))
+            missed = [blocknum for blocknum in candidates if blocknum in dirty]
+            if missed:
+                self.logger(f"Tag differed from the cached dump, writing {len(missed)} more blocks ...")
+                write_blocks(missed)
+                blockstowrite = blockstowrite + missed
+        if not written:
+            self.dump_cache.clear()
+            return False
         self.DropField()
+        self.dump_cache.update(tag.uid, filldata, blockstowrite, tag.bytesPerPage)
         if progress:
             progress(100)
         return True
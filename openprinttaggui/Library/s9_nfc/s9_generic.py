@@ -4,9 +4,19 @@ import time
 from binascii import hexlify, unhexlify
 import os, sys
 import platform
+import threading
+
+from openprinttaggui.Library.nfc_transport import transport_library
 
 script_path = os.path.dirname(os.path.realpath(__file__))
 
+# Vendor library, (icdev, version, lib) of the open reader and the hiddev node it was found on, shared process-wide.
+# lib is the vendor library as seen through nfc_transport, recorded or replayed.
+S9_LIB = None
+S9_DEVICE = None
+S9_NODE = None
+S9_LOCK = threading.Lock()
+
 
 class S9_GENERIC:
     def __init__(self, port: str = None, logger=print):
@@ -26,9 +36,15 @@ class S9_GENERIC:
         bits, linkage = platform.architecture()
         return os_name, bits, arch, linkage
 
-    def init_dll(self, beep: bool = False):
-        # Load the DLL and the function
+    def load_dll(self):
+        """
+        Loads the vendor library once per process
+        """
+        global S9_LIB
+        if S9_LIB is not None:
+            return S9_LIB
         os_name, bits, arch, linkage = self.detect_os()
+        lib = None
         if os_name == "Linux":
             if arch == "x86_64":
                 if bits == "64bit":
@@ -41,33 +57,72 @@ class S9_GENERIC:
                 lib = cdll.LoadLibrary(os.path.join(script_path, "Linux", "arm-lib", "arm-linux-gcc_4.6.3", "libS8.so"))
         elif os_name == "Windows":
             lib = ctypes.WinDLL(os.path.join(script_path, "Windows", "umf.dll"))
-        else:
+        if lib is None:
             self.logger(f"{os_name} is currently not supported.")
-            return False
-        st = -1
-        for m_port in range(16):
-            if os_name == "Linux":
-                szNode = bytes(f"/dev/usb/hiddev{m_port}", 'utf-8')
-                icdev = lib.fw_init_ex(2, szNode, 115200)
-            else:
-                icdev = lib.fw_init(100, 115200)
+            return None
+        # Prototypes from libS8.h, saves converting every argument on each call
+        lib.fw_readblock.argtypes = [c_int, c_ubyte, c_ubyte, c_ubyte, POINTER(c_ubyte), POINTER(c_ubyte), c_char_p]
+        lib.fw_writeblock.argtypes = [c_int, c_ubyte, c_ubyte, c_ubyte, POINTER(c_ubyte), c_ubyte, POINTER(c_ubyte)]
+        S9_LIB = lib
+        return lib
+
+    def probe_node(self, lib, os_name: str, m_port: int):
+        if os_name == "Linux":
+            szNode = bytes(f"/dev/usb/hiddev{m_port}", 'utf-8')
+            icdev = lib.fw_init_ex(2, szNode, 115200)
+        else:
+            icdev = lib.fw_init(100, 115200)
+        if icdev == -1:
+            return None, None
+        szVer = create_string_buffer(128)
+        if lib.fw_getver(icdev, szVer) != 0:
+            lib.fw_exit(icdev)
+            return None, None
+        return icdev, szVer.value
 
-            if icdev != -1:
-                szVer = create_string_buffer(128)
-                st = lib.fw_getver(icdev, szVer)
-                if st == 0:
-                    break
-        if st == -1:
-            return False
-        if beep:
-            lib.fw_beep(icdev, 1)
-        # set card type
-        lib.fw_config_card(icdev, 0x31)
-        self.icdev = icdev
-        self.lib = lib
-        self.szVer = szVer.value
+    def init_dll(self, beep: bool = False):
+        """
+        Opens the reader once per process, library and handle are shared until close().
+        The hiddev node that answered is tried first next time.
+        """
+        global S9_DEVICE, S9_NODE
+        with S9_LOCK:
+            if S9_DEVICE is None:
+                lib = transport_library("s9", self.load_dll)
+                if lib is None:
+                    return False
+                os_name = self.detect_os()[0]
+                nodes = list(range(16)) if os_name == "Linux" else [0]
+                if S9_NODE in nodes:
+                    nodes.remove(S9_NODE)
+                    nodes.insert(0, S9_NODE)
+                for m_port in nodes:
+                    icdev, szVer = self.probe_node(lib, os_name, m_port)
+                    if icdev is not None:
+                        break
+                else:
+                    return False
+                if beep:
+                    lib.fw_beep(icdev, 1)
+                # set card type
+                lib.fw_config_card(icdev, 0x31)
+                S9_NODE = m_port
+                S9_DEVICE = (icdev, szVer, lib)
+            self.icdev, self.szVer, self.lib = S9_DEVICE
         return True
 
+    def close(self):
+        """
+        Releases the shared handle, e.g. when the reader was unplugged
+        """
+        global S9_DEVICE
+        with S9_LOCK:
+            if S9_DEVICE is not None:
+                S9_DEVICE[2].fw_exit(S9_DEVICE[0])
+            S9_DEVICE = None
+        self.icdev = None
+        self.lib = None
+
     def init_nfc(self, uid: bytes = None) -> bytes:
         if uid is None:
             uid = create_string_buffer(256)
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 # (c) B.Kerler 2025
 import ctypes
+import time
 from ctypes import create_string_buffer
 from openprinttaggui.Library.iso15693 import ISO15_TAG_T, ISO15693_UID_LENGTH, ISO15693_TAG_MAX_PAGES, ISO15693_TAG_MAX_SIZE, \
-    ISO15693_ATQB_LENGTH
+    ISO15693_ATQB_LENGTH, ISO15_DUMP_CACHE_T, get_dirty_blocks, read_ndef_blocks
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS
 from openprinttaggui.Library.s9_nfc.s9_generic import S9_GENERIC
 
+# Blocks per fw_readblock/fw_writeblock call, rlen and wlen are single bytes
+S9_MULTI_BLOCKS = 16
+S9_BUFFER_SIZE = 256
+
+
+def s9_multi_blocks(blocksize: int) -> int:
+    # count * blocksize has to fit into the single byte rlen/wlen
+    return max(1, min(S9_MULTI_BLOCKS, 255 // blocksize))
+
 
 class S9_HF15(S9_GENERIC):
 
@@ -14,64 +25,141 @@ class S9_HF15(S9_GENERIC):
         self.logger = logger
         self.uid = None
         self.port = port
+        # Reused by every block transfer
+        self.rlen = ctypes.c_ubyte(0)
+        self.rbuffer = create_string_buffer(S9_BUFFER_SIZE)
+        self.wbuffer = (ctypes.c_ubyte * S9_BUFFER_SIZE)()
+        self.uid_buf = None
+        self.multi_write = True
+        self.dump_cache = ISO15_DUMP_CACHE_T()
+
+    def close(self):
+        self.dump_cache.clear()
+        super().close()
 
     def getUID(self, uid: bytes = None):
-        if self.init_dll():
+        if self.icdev is None and self.init_dll():
             self.logger(self.szVer.decode('utf-8'))
         self.uid = self.init_nfc(uid=uid)
+        self.dump_cache.check_uid(self.uid)
         if self.uid != b"":
             self.logger(f'UID detected: {bytearray(self.uid).hex()}')
         return self.uid
 
-    def read_block(self, blocknum, blocksize: int = 4):
-        dataLen = create_string_buffer(blocksize)
-        databuffer = create_string_buffer(4)
-        bnum = ctypes.c_ubyte(blocknum)
-        flags = ctypes.c_ubyte(0x22)
-        uid_ptr = ctypes.cast(self.uid, ctypes.POINTER(ctypes.c_ubyte))
-        res = self.lib.fw_readblock(self.icdev, flags, bnum, 1, uid_ptr, dataLen, databuffer)
+    def uid_ptr(self):
+        if self.uid_buf is None or bytes(self.uid_buf) != bytes(self.uid):
+            self.uid_buf = (ctypes.c_ubyte * len(self.uid)).from_buffer_copy(self.uid)
+        return self.uid_buf
+
+    def read_multi_block(self, blocknum: int, count: int, blocksize: int = 4):
+        """
+        Reads count blocks with one fw_readblock call into the preallocated buffer
+        """
+        self.rlen.value = 0
+        start = time.perf_counter()
+        res = self.lib.fw_readblock(self.icdev, 0x22, blocknum, count, self.uid_ptr(), ctypes.byref(self.rlen),
+                                    self.rbuffer)
+        if NFC_METRICS.enabled:
+            NFC_METRICS.observe("s9", "read_multiple_blocks" if count > 1 else "read_single_block", "call",
+                                (time.perf_counter() - start) * 1000)
         if res != 0:
             return b"", res
-        return bytearray(databuffer.raw), res
+        size = count * blocksize
+        if 0 < self.rlen.value < size:
+            return b"", -1
+        return self.rbuffer.raw[:size], res
 
-    def write_block(self, blocknum: int, blocksize: int = 4, data: bytes = None):
-        uid_ptr = ctypes.cast(self.uid, ctypes.POINTER(ctypes.c_ubyte))
-        flags = ctypes.c_ubyte(0x22)
-        wlen = ctypes.c_ubyte(blocksize)
-        wbuffer = (ctypes.c_ubyte * len(data))(*data)
-        bnum = ctypes.c_ubyte(blocknum)
-        res = self.lib.fw_writeblock(self.icdev, flags, bnum, 1, uid_ptr, wlen, wbuffer)
+    def read_block(self, blocknum, blocksize: int = 4):
+        pgdata, res = self.read_multi_block(blocknum=blocknum, count=1, blocksize=blocksize)
+        return bytearray(pgdata), res
+
+    def write_multi_block(self, blocknum: int, count: int, blocksize: int = 4, data: bytes = None):
+        size = count * blocksize
+        ctypes.memmove(self.wbuffer, bytes(data[:size]), size)
+        start = time.perf_counter()
+        res = self.lib.fw_writeblock(self.icdev, 0x22, blocknum, count, self.uid_ptr(), size, self.wbuffer)
+        if NFC_METRICS.enabled:
+            NFC_METRICS.observe("s9", "write_multiple_blocks" if count > 1 else "write_single_block", "call",
+                                (time.perf_counter() - start) * 1000)
         if res not in [0, 0x7d]:
             return res, False
         return res, True
 
-    def dump(self, filename: str = None, fast: bool = True, blocksize: int = 4, progress=None):
+    def write_block(self, blocknum: int, blocksize: int = 4, data: bytes = None):
+        return self.write_multi_block(blocknum=blocknum, count=1, blocksize=blocksize, data=data)
+
+    def dump(self, filename: str = None, fast: bool = True, blocksize: int = 4, progress=None, lazy: bool = False,
+             multiblock: bool = True):
+        """
+        lazy: only read the blocks up to the end of the NDEF message, ignored when saving to filename
+        multiblock: read up to S9_MULTI_BLOCKS blocks per call, falls back to single blocks if refused
+        """
         _ = fast
         if progress:
             progress(0)
         tag = ISO15_TAG_T(blocksize)
         tag.uid = self.uid
         maxblocks = ISO15693_TAG_MAX_SIZE // blocksize
-        for blocknum in range(tag.pagesCount):
-            if progress:
-                progress(blocknum / tag.pagesCount * 100)
-            pgdata, res = self.read_block(blocknum=blocknum, blocksize=blocksize)
-            if res == 0 and pgdata == b"":
-                pgdata, res = self.read_block(blocknum=blocknum, blocksize=blocksize)
-            if pgdata is None and self.logger:
+        multiblocks = s9_multi_blocks(blocksize)
+
+        def store(blocknum, count, pgdata, res):
+            for idx in range(count):
+                tag.locks[blocknum + idx] = res
+                if res == 0:
+                    tag.data[(blocknum + idx) * tag.bytesPerPage:((blocknum + idx) * tag.bytesPerPage) +
+                             tag.bytesPerPage] = pgdata[idx * blocksize:idx * blocksize + tag.bytesPerPage]
+
+        def read_single(blocknum):
+            pgdata, res = self.read_multi_block(blocknum=blocknum, count=1, blocksize=blocksize)
+            if res != 0:
+                # Failed or short transfer, try once more
+                NFC_METRICS.inc("s9", "read_single_block", "retries")
+                pgdata, res = self.read_multi_block(blocknum=blocknum, count=1, blocksize=blocksize)
+            if res != 0 and self.logger:
                 self.logger(f"Error on reading block {blocknum}")
-            if progress:
-                progress(blocknum / maxblocks * 100)
-            tag.locks[blocknum] = res
-            tag.data[blocknum * tag.bytesPerPage:(blocknum * tag.bytesPerPage) + tag.bytesPerPage] = bytearray(
-                pgdata[:tag.bytesPerPage])
+            store(blocknum, 1, pgdata, res)
+            return res == 0
+
+        def read_blocks(start, end):
+            nonlocal multiblock
+            blocknum = start
+            while blocknum < end:
+                count = min(multiblocks, end - blocknum) if multiblock else 1
+                if progress:
+                    progress(blocknum / maxblocks * 100)
+                if count == 1:
+                    read_single(blocknum)
+                    blocknum += 1
+                    continue
+                pgdata, res = self.read_multi_block(blocknum=blocknum, count=count, blocksize=blocksize)
+                if res != 0:
+                    # Refused or short READ_MULTIPLE_BLOCKS, this chunk is read block by block
+                    NFC_METRICS.inc("s9", "read_multiple_blocks", "retries")
+                    if all([read_single(blocknum + idx) for idx in range(count)]):
+                        # Single blocks work where the multi block read didn't, stay with them
+                        multiblock = False
+                else:
+                    store(blocknum, count, pgdata, res)
+                blocknum += count
+            return end
+
+        if lazy and filename is None:
+            blocks = read_ndef_blocks(read_blocks, tag)
+            tag.data[blocks * tag.bytesPerPage:] = bytes(len(tag.data) - blocks * tag.bytesPerPage)
+        else:
+            blocks = read_blocks(0, tag.pagesCount)
+        self.dump_cache.store(tag.uid, tag.data[:blocks * tag.bytesPerPage])
         if progress:
             progress(100)
         if filename is not None:
             tag.save(filename=filename)
         return tag
 
-    def restore(self, data_or_filename, fast: bool = False, blocksize: int = 4, progress=None):
+    def restore(self, data_or_filename, fast: bool = False, blocksize: int = 4, progress=None, diff: bool = False,
+                blocklist: list = None, multiblock: bool = True):
+        """
+        multiblock: write runs of up to S9_MULTI_BLOCKS consecutive blocks per call, falls back to single blocks
+        """
         _ = fast
         tag = ISO15_TAG_T(blocksize)
         tag.uid = self.uid
@@ -85,18 +173,73 @@ class S9_HF15(S9_GENERIC):
         blocks = len(filldata) // tag.bytesPerPage
         if progress:
             progress(0)
-        blockstowrite = min(blocks, tag.pagesCount)
-        for blocknum in range(blockstowrite):
-            if progress:
-                progress(blocknum / blockstowrite * 100)
-            result, value = self.write_block(blocknum=blocknum, blocksize=blocksize,
-                                             data=tag.data[
-                                                  blocknum * tag.bytesPerPage:(
-                                                                                          blocknum * tag.bytesPerPage) + tag.bytesPerPage])
-            if not value:
-                return False
-            if value and result == 0x7D:
-                break
+        blockstowrite = list(range(min(blocks, tag.pagesCount)))
+        if blocklist is not None:
+            blockstowrite = [blocknum for blocknum in blockstowrite if blocknum in blocklist]
+        candidates = blockstowrite
+        from_cache = False
+        if diff:
+            current = self.dump_cache.get(tag.uid)
+            from_cache = current is not None and \
+                len(current) >= (max(blockstowrite, default=-1) + 1) * tag.bytesPerPage
+            if not from_cache:
+                self.logger("Reading tag to find changed blocks ...")
+                current = self.dump(blocksize=blocksize).data
+            dirty = get_dirty_blocks(current, filldata, tag.bytesPerPage, min(blocks, tag.pagesCount))
+            blockstowrite = [blocknum for blocknum in blockstowrite if blocknum in dirty]
+            self.logger(f"Writing {len(blockstowrite)} changed blocks ...")
+        multiblocks = s9_multi_blocks(blocksize)
+        written = []
+
+        def write_blocks(blocknums):
+            """
+            Returns False on a failed write, None if the tag stopped the restore with 0x7D, else True
+            """
+            # Consecutive blocks go out in one fw_writeblock call
+            runs = []
+            for blocknum in blocknums:
+                if runs and runs[-1][0] + runs[-1][1] == blocknum and runs[-1][1] < multiblocks:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([blocknum, 1])
+            while runs:
+                blocknum, count = runs.pop(0)
+                if progress:
+                    progress(min(len(written) / max(len(blockstowrite), 1), 1) * 100)
+                if count > 1 and not (multiblock and self.multi_write):
+                    runs = [[blocknum + idx, 1] for idx in range(count)] + runs
+                    continue
+                result, value = self.write_multi_block(blocknum=blocknum, count=count, blocksize=blocksize,
+                                                       data=tag.data[blocknum * tag.bytesPerPage:(blocknum + count) *
+                                                                                                 tag.bytesPerPage])
+                if not value and count > 1:
+                    # Reader or tag refused WRITE_MULTIPLE_BLOCKS, go on block by block
+                    NFC_METRICS.inc("s9", "write_multiple_blocks", "retries")
+                    self.multi_write = False
+                    runs = [[blocknum + idx, 1] for idx in range(count)] + runs
+                    continue
+                if not value:
+                    return False
+                written.extend(range(blocknum, blocknum + count))
+                if value and result == 0x7D:
+                    return None
+            return True
+
+        result = write_blocks(blockstowrite)
+        if result and from_cache:
+            # The tag may have been changed elsewhere and put back between two polls, then the cached
+            # dump is outdated. Read it back and write what the diff missed.
+            current = self.dump(blocksize=blocksize).data
+            dirty = get_dirty_blocks(current, filldata, tag.bytesPerPage, min(blocks, tag.pagesCount))
+            missed = [blocknum for blocknum in candidates if blocknum in dirty]
+            if missed:
+                self.logger(f"Tag differed from the cached dump, writing {len(missed)} more blocks ...")
+                result = write_blocks(missed)
+        if result is False:
+            self.dump_cache.clear()
+            return False
+        # Only the blocks written so far, 0x7D stops before the remaining runs
+        self.dump_cache.update(tag.uid, filldata, written, tag.bytesPerPage)
         if progress:
             progress(100)
         return True
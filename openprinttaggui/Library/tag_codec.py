@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Encoding and decoding of OpenPrintTag data with the OpenPrintTag Record, shared by the GUI and the CLI (no Qt)
+import os
+import sys
+
+script_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.dirname(script_path))
+sys.path.insert(1, script_path)
+sys.path.insert(2, os.path.join(script_path, "Library", "OpenPrintTag", "utils"))
+
+# Defaults of the SLIX2 tags we write, 136 / 16 for the smaller chip
+TAG_SIZE = 304
+TAG_AUX_REGION = 32
+
+
+def encode_tag(update_data: dict, uri: str = None, size: int = TAG_SIZE, aux_region: int = TAG_AUX_REGION) -> bytes:
+    """
+    Creates an empty tag and fills the regions ("main", "aux") from update_data
+    """
+    from Library.OpenPrintTag.utils.record import Record
+    from Library.OpenPrintTag.utils.common import default_config_file
+    from Library.OpenPrintTag.utils.nfc_initialize import nfc_initialize, Args
+
+    args = Args(size=size, aux_region=aux_region, config_file=default_config_file)
+    if uri:
+        args.ndef_uri = uri
+    emptytag_data = nfc_initialize(args)
+    record = Record(args.config_file, memoryview(bytearray(emptytag_data)))
+    for region_name, region in record.regions.items():
+        region.update(update_fields=update_data.get(region_name, dict()))
+    return record.data.tobytes()
+
+
+def update_aux_region(data: bytes, aux_fields: dict) -> bytes:
+    """
+    Re-encodes only the aux region of existing tag data
+    """
+    from Library.OpenPrintTag.utils.record import Record
+    from Library.OpenPrintTag.utils.common import default_config_file
+
+    data = bytearray(data)
+    record = Record(default_config_file, memoryview(data))
+    if "aux" not in record.regions:
+        raise Exception("Tag has no aux region")
+    record.regions["aux"].update(update_fields=aux_fields)
+    return bytes(data)
+
+
+def decode_tag(data: bytes, logger=None):
+    """
+    Returns the fields of all regions and the uri, regions that fail to decode are reported to logger
+    """
+    from Library.OpenPrintTag.utils.record import Record
+    from Library.OpenPrintTag.utils.common import default_config_file
+
+    uri = ""
+    record = Record(config_file=default_config_file, data=memoryview(data))
+    fields = {}
+    for name, region in record.regions.items():
+        unknown_fields = dict()
+        try:
+            fields[name] = region.read(out_unknown_fields=unknown_fields)
+        except Exception as err:
+            if logger is not None:
+                logger(str(err))
+    if hasattr(record, "uri"):
+        uri = record.uri
+    return fields, uri
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
-from openprinttaggui.openprinttag_gui import main
+import sys
+
+from openprinttaggui.cli import CLI_COMMANDS
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and (sys.argv[1] in CLI_COMMANDS or sys.argv[1].startswith("-")):
+        from openprinttaggui.cli import main as cli_main
+        sys.exit(cli_main())
+    from openprinttaggui.openprinttag_gui import main
     main()
-
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# (c) B.Kerler 2025
+# Headless front end, uses the reader drivers and the OpenPrintTag Record directly, no Qt:
+#   python -m openprinttaggui read [--json]
+#   python -m openprinttaggui dump -o tag.bin [--pm3]
+#   python -m openprinttaggui write tag.bin
+#   python -m openprinttaggui decode tag.bin
+#   python -m openprinttaggui encode spools.yaml -o out/ [--write]
+#   python -m openprinttaggui bench [--emulator]
+#   python -m openprinttaggui db [--rebuild] [--gtin 8594173675049]
+# --reader pm3|s9|acs and --port select the reader, without them the first connected one is used.
+import argparse
+import json
+import os
+import sys
+import time
+
+from openprinttaggui.Library.nfc_drivers import find_driver, find_reader
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS, save_metrics
+from openprinttaggui.Library.nfc_transport import start_recording, start_replay, stop_transport, summary
+from openprinttaggui.Library.tag_codec import encode_tag, decode_tag
+
+CLI_COMMANDS = ("read", "write", "dump", "decode", "encode", "bench", "db")
+
+# Seconds to wait for the next tag when writing a batch
+CLI_TAG_TIMEOUT = 60
+CLI_TAG_POLL_INTERVAL = 0.2
+
+
+def log(*args):
+    print(*args, file=sys.stderr)
+
+
+def quiet(*args):
+    pass
+
+
+def output(data, filename: str = None, as_json: bool = False):
+    if as_json:
+        text = json.dumps(data, indent=1, default=str) + "\n"
+    else:
+        import yaml
+        text = yaml.safe_dump(data, sort_keys=False, allow_unicode=True)
+    if filename is None or filename == "-":
+        sys.stdout.write(text)
+    else:
+        with open(filename, "w", encoding="utf-8") as wf:
+            wf.write(text)
+
+
+def open_reader(args, logger):
+    """
+    Returns (driver, device), with a selected tag if the driver needs one
+    """
+    reader = args.reader
+    if reader is None and args.replay is not None:
+        # The trace knows which reader it was recorded with
+        channels = [name.split(":")[0] for name in summary(args.replay)]
+        if channels:
+            reader = channels[0]
+    if args.replay is not None:
+        # Nothing to detect, the trace answers for the reader
+        driver, port = find_driver(reader), args.port
+    else:
+        driver, port = find_reader(reader, args.port)
+    logger(f"Connecting to {driver.label}{' on ' + port if port else ''} ...")
+    dev = driver.open(port=port, logger=logger)
+    if driver.select_before_dump and dev.getUID() == b"":
+        dev.close()
+        raise Exception("Couldn't detect nfc tag.")
+    return driver, dev
+
+
+def read_tag(driver, dev, lazy: bool = True):
+    tag = dev.dump(filename=None, lazy=lazy, **driver.dump_args())
+    if tag is None:
+        raise Exception("Couldn't read nfc tag.")
+    return tag
+
+
+def tag_uid(dev, tag=None) -> str:
+    """
+    UID of the read tag, the reader is only asked if there is no tag yet
+    """
+    uid = getattr(tag, "uid", None) if tag is not None else None
+    if not uid:
+        uid = getattr(dev, "uid", None)
+    if not uid:
+        uid = dev.getUID()
+    return bytes(uid).hex() if uid else ""
+
+
+def cmd_read(args, logger) -> int:
+    driver, dev = open_reader(args, logger)
+    try:
+        tag = read_tag(driver, dev)
+        uid = tag_uid(dev, tag)
+    finally:
+        dev.close()
+    fields, uri = decode_tag(bytes(tag.data), logger=logger)
+    result = dict(uid=uid, reader=driver.name)
+    if uri:
+        result["uri"] = uri
+    result.update(fields)
+    output(result, args.output, args.json)
+    return 0
+
+
+def cmd_dump(args, logger) -> int:
+    driver, dev = open_reader(args, logger)
+    try:
+        tag = read_tag(driver, dev, lazy=False)
+    finally:
+        dev.close()
+    if args.pm3:
+        # uid, system info, locks and data, the format "hf 15 restore" and write --pm3 take
+        tag.save(filename=args.output)
+    else:
+        with open(args.output, "wb") as wf:
+            wf.write(bytes(tag.data[:tag.pagesCount * tag.bytesPerPage]))
+    logger(f"Wrote {tag.pagesCount} blocks of {tag.bytesPerPage} bytes to {args.output}")
+    return 0
+
+
+def write_tag(driver, dev, data, full: bool = False) -> bool:
+    restore_args = driver.restore_args()
+    if full:
+        restore_args["diff"] = False
+    return dev.restore(data_or_filename=data, **restore_args)
+
+
+def cmd_write(args, logger) -> int:
+    if not os.path.exists(args.filename):
+        raise Exception(f"Filename {args.filename} doesn't exist")
+    # A filename makes the drivers load the PM3 dump format themselves
+    data = args.filename if args.pm3 else bytearray(open(args.filename, "rb").read())
+    driver, dev = open_reader(args, logger)
+    try:
+        if not write_tag(driver, dev, data, full=args.full):
+            raise Exception("Error on writing nfc tag")
+    finally:
+        dev.close()
+    logger("Succeeded writing nfc tag")
+    return 0
+
+
+def cmd_decode(args, logger) -> int:
+    result = []
+    for filename in args.filenames:
+        data = open(filename, "rb").read()
+        fields, uri = decode_tag(data, logger=logger)
+        entry = dict(file=filename)
+        if uri:
+            entry["uri"] = uri
+        entry.update(fields)
+        result.append(entry)
+    output(result[0] if len(result) == 1 else result, args.output, args.json)
+    return 0
+
+
+def load_specs(filename: str) -> list:
+    """
+    A spec is {"main": {...}, "aux": {...}, "uri": ..., "name": ...}, a dict without main/aux is taken as
+    the main region. Files hold one spec or a list of them, YAML or JSON.
+    """
+    with open(filename, "r", encoding="utf-8") as rf:
+        if filename.endswith(".json"):
+            content = json.load(rf)
+        else:
+            import yaml
+            content = yaml.safe_load(rf)
+    if isinstance(content, dict):
+        content = [content]
+    if not isinstance(content, list):
+        raise Exception(f"{filename}: expected a tag or a list of tags")
+    specs = []
+    for idx, entry in enumerate(content):
+        if not isinstance(entry, dict):
+            raise Exception(f"{filename}: entry {idx} is not a mapping")
+        entry = dict(entry)
+        uri = entry.pop("uri", None)
+        name = entry.pop("name", None)
+        if "main" not in entry and "aux" not in entry:
+            entry = dict(main=entry)
+        if name is None:
+            main = entry.get("main", {})
+            name = (str(main.get("brand_name", "tag")).replace(" ", "_").replace("-", "_") + "_" +
+                    str(main.get("material_name", idx)).replace(" ", "_").replace("-", "_"))
+        specs.append(dict(update_data=entry, uri=uri, name=name, source=f"{filename}:{idx}"))
+    return specs
+
+
+def wait_for_tag(driver, dev, args, previous_uid: str):
+    """
+    Polls until a tag other than previous_uid is on the reader, returns (dev, uid). The reader stays
+    open while there is no tag, it is only reopened if the port itself fails.
+    """
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        try:
+            if dev is None:
+                dev = driver.open(port=args.port, logger=quiet)
+            uid = dev.getUID()
+        except OSError:
+            # Port went away, e.g. the reader was unplugged
+            if dev is not None:
+                try:
+                    dev.close()
+                except Exception:
+                    pass
+            dev = None
+            uid = b""
+        except Exception:
+            # No tag in the field yet, ask again on the same handle
+            uid = b""
+        if uid and bytes(uid).hex() != previous_uid:
+            return dev, bytes(uid).hex()
+        time.sleep(CLI_TAG_POLL_INTERVAL)
+    if dev is not None:
+        dev.close()
+    raise Exception("Timeout waiting for the next tag")
+
+
+def cmd_encode(args, logger) -> int:
+    specs = []
+    for filename in args.filenames:
+        specs.extend(load_specs(filename))
+    os.makedirs(args.output, exist_ok=True)
+    encoded = []
+    failed = 0
+    for spec in specs:
+        try:
+            data = encode_tag(spec["update_data"], uri=spec["uri"], size=args.size, aux_region=args.aux_region)
+        except Exception as e:
+            message = str(e.__notes__) if hasattr(e, "__notes__") else str(e)
+            logger(f"{spec['source']}: failed to generate tag data: {message}")
+            failed += 1
+            continue
+        filename = os.path.join(args.output, spec["name"] + ".bin")
+        with open(filename, "wb") as wf:
+            wf.write(data)
+        logger(f"{spec['source']}: wrote {filename}")
+        encoded.append((spec, data))
+
+    if args.write and encoded:
+        driver, port = find_reader(args.reader, args.port)
+        args.port = port
+        previous_uid = None
+        dev = None
+        try:
+            for idx, (spec, data) in enumerate(encoded):
+                logger(f"[{idx + 1}/{len(encoded)}] Place the tag for {spec['name']} on the {driver.label} reader ...")
+                dev, previous_uid = wait_for_tag(driver, dev, args, previous_uid)
+                if write_tag(driver, dev, bytearray(data), full=True):
+                    logger(f"[{idx + 1}/{len(encoded)}] Wrote {spec['name']} to {previous_uid}")
+                else:
+                    logger(f"[{idx + 1}/{len(encoded)}] Error on writing {spec['name']} to {previous_uid}")
+                    failed += 1
+        finally:
+            if dev is not None:
+                dev.close()
+    return 1 if failed else 0
+
+
+def cmd_bench(args, logger) -> int:
+    if args.emulator:
+        from openprinttaggui.Library.pm3_nfc.pm3_bench import bench
+        bench(repeat=args.repeat, rf_scale=args.rf_scale, usb=args.usb)
+        return 0
+    driver, dev = open_reader(args, logger)
+    try:
+        uid = tag_uid(dev)
+        print(f"{driver.label} tag {uid}: {driver.capabilities()}")
+        best = None
+        for run in range(args.repeat):
+            start = time.perf_counter()
+            tag = read_tag(driver, dev, lazy=False)
+            elapsed = time.perf_counter() - start
+            print(f"  dump {run + 1}: {elapsed * 1000:8.1f} ms  {tag.pagesCount / elapsed:8.1f} blocks/s")
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"  best:   {best * 1000:8.1f} ms")
+    finally:
+        dev.close()
+    print("\nPer command latencies:")
+    print("\n".join(NFC_METRICS.summary()))
+    return 0
+
+
+def cmd_db(args, logger) -> int:
+    from openprinttaggui.Library.database_cache import DB_Cache
+    cache = DB_Cache(logger=logger)
+    if args.rebuild:
+        cache.clear()
+    cache.update()
+    print(f"{cache.filename}: {len(cache.files)} files, {cache.stats['loaded']} from cache, "
+          f"{cache.stats['parsed']} parsed, {cache.stats['removed']} removed, "
+          f"load {cache.stats['load_ms']:.1f} ms, update {cache.stats['update_ms']:.1f} ms")
+    for filename, error in cache.errors.items():
+        logger(f"YAML Error in {filename}: {error}")
+    if args.gtin:
+        from openprinttaggui.Library.database_cache import database_index, gtin_index, gtin_key
+        gtins = gtin_index(database_index(cache))
+        result = []
+        for code in args.gtin:
+            entry = gtins.get(gtin_key(code))
+            if entry is None:
+                logger(f"GTIN {code} not found")
+                continue
+            vendor, material, filename = entry
+            result.append(dict(gtin=code, vendor=vendor, material=material, package=cache.cached_yaml(filename)))
+        output(result, None, args.json)
+        return 0 if len(result) == len(args.gtin) else 1
+    return 1 if cache.errors else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="openprinttaggui", description="OpenPrintTag command line interface")
+    parser.add_argument("--reader", help="pm3, s9, acs or the reader id, default is the first one found")
+    parser.add_argument("--port", help="serial port or device path of the reader, without --reader it has to be "
+                                       "a detected reader")
+    parser.add_argument("--record", metavar="TRACE", help="record the reader I/O to a trace file")
+    parser.add_argument("--replay", metavar="TRACE", help="replay the reader I/O from a trace file")
+    parser.add_argument("--replay-scale", type=float, default=1.0, help="time scale of the replay, 0 = no delays")
+    parser.add_argument("--metrics", metavar="FILE", help="save the reader latencies, .prom or JSON")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no status messages")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("read", help="read and decode the tag on the reader")
+    p.add_argument("-o", "--output", help="output file, default stdout")
+    p.add_argument("--json", action="store_true", help="JSON instead of YAML")
+    p.set_defaults(func=cmd_read)
+
+    p = sub.add_parser("dump", help="save the raw tag memory")
+    p.add_argument("-o", "--output", required=True, help="output file")
+    p.add_argument("--pm3", action="store_true", help="save in the proxmark3 hf 15 dump format")
+    p.set_defaults(func=cmd_dump)
+
+    p = sub.add_parser("write", help="write a tag binary to the tag on the reader")
+    p.add_argument("filename")
+    p.add_argument("--pm3", action="store_true", help="file is in the proxmark3 hf 15 dump format")
+    p.add_argument("--full", action="store_true", help="write all blocks, not only the changed ones")
+    p.set_defaults(func=cmd_write)
+
+    p = sub.add_parser("decode", help="decode tag binaries")
+    p.add_argument("filenames", nargs="+")
+    p.add_argument("-o", "--output", help="output file, default stdout")
+    p.add_argument("--json", action="store_true", help="JSON instead of YAML")
+    p.set_defaults(func=cmd_decode)
+
+    p = sub.add_parser("encode", help="encode YAML/JSON tag descriptions to tag binaries")
+    p.add_argument("filenames", nargs="+")
+    p.add_argument("-o", "--output", default=".", help="directory for the .bin files")
+    p.add_argument("--write", action="store_true", help="write the tags one after another to the reader")
+    p.add_argument("--timeout", type=float, default=CLI_TAG_TIMEOUT, help="seconds to wait for each tag")
+    p.add_argument("--size", type=int, default=304, help="tag memory size, 136 for the smaller chip")
+    p.add_argument("--aux-region", type=int, default=32, help="aux region size, 16 for the smaller chip")
+    p.set_defaults(func=cmd_encode)
+
+    p = sub.add_parser("bench", help="time tag dumps on the reader, or against the emulated proxmark3")
+    p.add_argument("--emulator", action="store_true", help="benchmark PM3_HF15 against the pty emulator")
+    p.add_argument("--repeat", type=int, default=3, help="runs, best one is reported")
+    p.add_argument("--rf-scale", type=float, default=1.0, help="emulator: multiplier for the rf latencies")
+    p.add_argument("--usb", type=float, default=1.0, help="emulator: usb latency per frame in ms")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("db", help="build or refresh the compiled database cache")
+    p.add_argument("--rebuild", action="store_true", help="parse all YAML files again")
+    p.add_argument("--gtin", nargs="+", help="look packages up by their GTIN")
+    p.add_argument("--json", action="store_true", help="JSON instead of YAML")
+    p.set_defaults(func=cmd_db)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    logger = quiet if args.quiet else log
+    if args.replay is not None:
+        start_replay(args.replay, scale=args.replay_scale)
+    elif args.record is not None:
+        start_recording(args.record)
+    try:
+        return args.func(args, logger)
+    except Exception as e:
+        log(f"Error: {str(e)}")
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        stop_transport()
+        if args.metrics is not None:
+            save_metrics(args.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
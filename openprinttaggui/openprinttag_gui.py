@@ -2,20 +2,25 @@
 # (c) B.Kerler 2025
 # GPLv3 License
 
+import multiprocessing
 import os
 import sys
 from collections import deque
-from types import SimpleNamespace
 
 import requests
-import yaml
 from PySide6.QtCore import Qt, QLocale, QDate, QDateTime, Signal, QObject, QThread, QTimer, Slot, QRunnable, QThreadPool
-from PySide6.QtGui import QValidator, QColor, QPixmap
+from PySide6.QtGui import QValidator, QColor, QPixmap, QFontDatabase
 from PySide6.QtWidgets import QMainWindow, QApplication, QCalendarWidget, QVBoxLayout, QDialog, \
-    QColorDialog, QFileDialog, QLabel, QMessageBox, QLineEdit
+    QColorDialog, QFileDialog, QLabel, QMessageBox, QLineEdit, QPlainTextEdit, QDialogButtonBox
 
+from openprinttaggui.Library.database_cache import DB_Cache, DB_LRU, DB_LRU_VENDORS, DB_LRU_MATERIALS, \
+    vendor_materials, material_packages, gtin_index, gtin_key
+from openprinttaggui.Library.database_loader import DatabaseLoaderWorker, DatabasePrefetchWorker
 from openprinttaggui.Library.device_detector import DeviceDetectorWorker, device_list
-from openprinttaggui.Library.nfc_handler import NFC_ReadTagWorker, NFC_WriteTagWorker, NFC_ReadTagDetect
+from openprinttaggui.Library.iso15693 import get_dirty_blocks
+from openprinttaggui.Library.nfc_handler import NFC_ReaderSession, NFC_ReaderPool
+from openprinttaggui.Library.nfc_metrics import NFC_METRICS, save_metrics
+from openprinttaggui.Library.tag_codec import encode_tag, decode_tag, update_aux_region
 
 script_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, os.path.dirname(script_path))
@@ -24,9 +29,6 @@ sys.path.insert(2, os.path.join(script_path, "Library", "OpenPrintTag", "utils")
 
 from GUI.colorconversion import ral_to_hex, hex_to_ral
 from GUI.gui import Ui_OpenPrintTagGui
-from Library.OpenPrintTag.utils.record import Record
-from Library.OpenPrintTag.utils.common import default_config_file
-from Library.OpenPrintTag.utils.nfc_initialize import nfc_initialize, Args
 from Library.td1s import collect_data, DataCollectorThread
 
 class DateValidator(QValidator):
@@ -85,30 +87,85 @@ class DatePickerPopup(QDialog):
 
 
 
+class DiagnosticsDialog(QDialog):
+    """
+    Per-command reader latencies collected by nfc_metrics, refreshed every second
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(self.tr("Reader diagnostics"))
+        self.resize(900, 400)
+        layout = QVBoxLayout(self)
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.text)
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Save | QDialogButtonBox.StandardButton.Reset |
+                                   QDialogButtonBox.StandardButton.Close)
+        buttons.button(QDialogButtonBox.StandardButton.Save).clicked.connect(self.export)
+        buttons.button(QDialogButtonBox.StandardButton.Reset).clicked.connect(self.reset)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def refresh(self):
+        lines = NFC_METRICS.summary()
+        if not NFC_METRICS.enabled:
+            lines = [self.tr("Metrics are disabled (OPENPRINTTAG_METRICS=0)")]
+        elif not lines:
+            lines = [self.tr("No reader commands yet")]
+        self.text.setPlainText("\n".join(lines))
+
+    def reset(self):
+        NFC_METRICS.reset()
+        self.refresh()
+
+    def export(self):
+        filename, selfilter = QFileDialog.getSaveFileName(self, self.tr("Export reader metrics"),
+                                                          dir="openprinttag_metrics.json",
+                                                          filter="JSON (*.json);;Prometheus (*.prom)")
+        if filename:
+            save_metrics(filename)
+
+
 class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.filecache = {}
-        self.packages = {}
+        self.packages = []
         self.vendors = {}
         self.readers = {}
         self.port = None
         self.reader = None
+        self.session = None
+        self.pool = None
+        self.pool_progress = {}
         self.threadpool = QThreadPool()
         self.td1sthread = None
         self.aux_region_size = None
         self.aux_region_offset = None
         self.main_region_size = None
         self.main_region_offset = None
+        self.last_tag_data = None
+        self.last_tag_uid = None
+        self.last_tag_blocksize = 4
         self.filaments = {}
         self.default_manufacturers = {}
         self.default_filamenttypes = {}
         self.setupUi(self)
+        # Parsed YAML databases, only new or changed files get parsed again. self.msg only gets the
+        # messages of the GUI thread, the loader thread reports through its status signal
+        self.dbcache = DB_Cache(logger=self.msg)
+        self.material_cache = DB_LRU(self.dbcache, DB_LRU_VENDORS)
+        self.package_cache = DB_LRU(self.dbcache, DB_LRU_MATERIALS)
         self.select_first_brandname()
         self.setup_material()
         self.add_default_material_properties()
-        self.cache_filenames()
-        self.read_vendors_from_database()
+        self.setup_vendors()
         self.colorlabel.mousePressEvent = self.open_color_picker
         self.secondary_colorlabel_0.mousePressEvent = self.open_secondary0_color_picker
         self.secondary_colorlabel_1.mousePressEvent = self.open_secondary1_color_picker
@@ -122,14 +179,21 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         self.setup_date_view()
         self.actionLoad.triggered.connect(self.on_load_file)
         self.actionSave.triggered.connect(self.on_save_file)
+        self.actionMultiReader.toggled.connect(self.on_multi_reader_toggled)
+        self.actionDiagnostics.triggered.connect(self.on_diagnostics)
         self.gtinedit.setValidator(GTINValidator(self.gtinedit))
+        # Typing or scanning a known GTIN selects brand, material and package
+        self.gtinedit.textEdited.connect(self.on_gtin_edited)
+        self.gtinedit.returnPressed.connect(self.on_gtin_entered)
 
         # Setup nfc reader detection
         self.readtagbtn.clicked.connect(self.on_read_tag)
         self.writetagbtn.clicked.connect(self.on_write_tag)
+        self.updateweightbtn.clicked.connect(self.on_update_weight)
         self.td1sbutton.clicked.connect(self.on_readtd1s)
         self.readtagbtn.setDisabled(True)
         self.writetagbtn.setDisabled(True)
+        self.updateweightbtn.setDisabled(True)
         self.td1sbutton.setDisabled(True)
 
         # NFC Reader support
@@ -151,7 +215,9 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         self.last_read_uid = None          # to avoid reading the same tag repeatedly
         self.auto_read_enabled = False
 
-        # We default to Prusament here
+        # We default to Prusament here, selected once it is loaded unless the user picked a brand before
+        self.wanted_brand = "Prusament"
+        self.brandnamebox.activated.connect(self.on_brand_activated)
         self.brandnamebox.setCurrentText("Prusament")
         self.materialnamebox.setCurrentIndex(0)
 
@@ -164,30 +230,6 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         except Exception:
             pass
 
-    def cache_filenames(self):
-        for (root, dirs, files) in os.walk(os.path.join(script_path, "Library", "openprinttag-database", "data", "brands"), topdown=True):
-            for file in files:
-                filename = os.path.join(root, file)
-                if ".yaml" == filename[-5:]:
-                    vendorname = os.path.basename(filename).replace(".yaml", "")
-                    vendorpath = os.path.join(script_path, "Library", "openprinttag-database", "data", "materials", vendorname)
-                    for (root, dirs, files) in os.walk(vendorpath, topdown=True):
-                        for file in files:
-                            filename = os.path.join(root, file)
-                            if ".yaml" == filename[-5:]:
-                                if vendorname not in self.filecache:
-                                    self.filecache[vendorname] = {}
-                                materialname = os.path.basename(filename).replace(".yaml", "")
-                                materialpackagepath = os.path.join(script_path, "Library", "openprinttag-database", "data",
-                                                          "material-packages", vendorname)
-                                if materialname not in self.filecache[vendorname]:
-                                    self.filecache[vendorname][materialname] = []
-                                for (root, dirs, files) in os.walk(materialpackagepath, topdown=True):
-                                    for file in files:
-                                        filename = os.path.join(root, file)
-                                        if ".yaml" == filename[-5:] and materialname in file:
-                                            self.filecache[vendorname][materialname].append(filename)
-
     def on_td1s_removed(self):
         self.msg("TD1S removed.")
         self.td1sbutton.setDisabled(True)
@@ -209,33 +251,109 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
                 self.reader = reader
                 if "port" in info:
                     self.port = info["port"]
+                if self.pool is not None and reader == 3:
+                    self.pool.refresh()
+                else:
+                    self.open_session()
                 if not self.readtagbtn.isEnabled():
                     self.readtagbtn.setDisabled(False)
                     if not self.auto_read_enabled:
-                        self.auto_read_timer.start(1000)
                         self.auto_read_enabled = True
+                        self.start_auto_read()
                 if not self.writetagbtn.isEnabled():
                     self.writetagbtn.setDisabled(False)
+                if not self.updateweightbtn.isEnabled():
+                    self.updateweightbtn.setDisabled(False)
+
+    def open_session(self):
+        if self.session is not None:
+            if self.session.reader == self.reader and self.session.port == self.port:
+                return
+            self.close_session()
+        self.session = NFC_ReaderSession(reader=self.reader, port=self.port)
+        self.session.detected.connect(self.on_tag_detected)
+        self.session.written.connect(self.handle_tag_write_success)
+        self.session.signals.progress.connect(self.set_progress)
+        self.session.signals.status.connect(self.msg)
+        self.session.signals.error.connect(self.handle_tag_error)
+        self.session.signals.finished.connect(self.handle_tag_read_success)
+
+    def close_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def on_diagnostics(self):
+        DiagnosticsDialog(self).exec()
+
+    def on_multi_reader_toggled(self, checked: bool):
+        if checked:
+            # The pool takes over all PC/SC readers
+            if self.session is not None and self.session.reader == 3:
+                self.close_session()
+            self.pool = NFC_ReaderPool()
+            self.pool.detected.connect(self.on_pool_tag_detected)
+            self.pool.progress.connect(self.on_pool_progress)
+            self.pool.status.connect(self.on_pool_status)
+            self.pool.error.connect(self.on_pool_error)
+            self.pool.finished.connect(self.on_pool_read_success)
+            self.pool.written.connect(self.on_pool_write_success)
+            names = self.pool.refresh()
+            self.msg(f"Using {len(names)} PC/SC readers.")
+        else:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+            self.pool_progress = {}
+            if self.reader == 3:
+                self.open_session()
+
+    def on_pool_tag_detected(self, name: str, uid):
+        if uid != b"":
+            self.msg(f"{name}: tag {bytearray(uid).hex()} detected.")
+
+    def on_pool_progress(self, name: str, value: int):
+        self.pool_progress[name] = value
+        self.set_progress(sum(self.pool_progress.values()) // len(self.pool_progress))
+
+    def on_pool_status(self, name: str, text: str):
+        self.msg(f"{name}: {text}")
+
+    def on_pool_error(self, name: str, text: str):
+        # The reader is done, it must not hold the averaged progress back
+        self.msg(f"{name}: {text}")
+        self.pool_progress.pop(name, None)
+        if not self.pool_progress:
+            self.set_progress(0)
+
+    def on_pool_read_success(self, name: str, tag):
+        self.pool_progress.pop(name, None)
+        self.handle_tag_read_success(tag)
+
+    def on_pool_write_success(self, name: str):
+        self.pool_progress.pop(name, None)
+        self.msg(f"{name}: Tag written successfully.")
+        if not self.pool_progress:
+            self.set_progress(0)
 
     def on_tag_detected(self, uid):
         if self.last_read_uid != uid and uid != b"":
             self.on_read_tag()
         self.last_read_uid = uid
 
+    def start_auto_read(self):
+        # Readers with presence events trigger reads on their own
+        if self.session is not None and self.session.presence_events:
+            self.auto_read_timer.stop()
+            return
+        self.auto_read_timer.start(1000)
+
     def try_auto_read_tag(self):
         if not self.auto_read_enabled:
             return
-        if self.reader is None or self.reader <= 0:
+        if self.reader is None or self.reader <= 0 or self.session is None:
             return  # no reader connected
-        try:
-            worker = NFC_ReadTagDetect(reader=self.reader, port=self.port)
-
-            # Connect signals to UI updates
-            worker.signals.finished.connect(self.on_tag_detected)
-            self.threadpool.start(worker)
-
-        except Exception as e:
-            pass
+        self.session.poll()
 
     def on_device_removed(self, info: dict):
         if "name" in info:
@@ -249,6 +367,10 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
             elif reader > 0:
                 if reader in self.readers:
                     self.readers[reader] -= 1
+                    if self.readers[reader] <= 0 and self.session is not None and self.session.reader == reader:
+                        self.close_session()
+                if self.pool is not None and reader == 3:
+                    self.pool.refresh()
             enabled = False
             for reader in self.readers:
                 if self.readers[reader] > 0:
@@ -256,6 +378,7 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
             if not enabled:
                 self.reader = 0
                 self.port = None
+                self.close_session()
                 if self.readtagbtn.isEnabled():
                     self.readtagbtn.setDisabled(True)
                     if self.auto_read_enabled:
@@ -263,6 +386,8 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
                         self.auto_read_enabled = False
                 if self.writetagbtn.isEnabled():
                     self.writetagbtn.setDisabled(True)
+                if self.updateweightbtn.isEnabled():
+                    self.updateweightbtn.setDisabled(True)
 
     def msg(self, text, value: int = 0):
         self.statusbar.showMessage(self.tr(text), value)
@@ -275,46 +400,75 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         self.auto_read_timer.stop()
         self.progressBar.setValue(0)
         self.msg("Starting...")
-
-        worker = NFC_ReadTagWorker(reader=self.reader, port=self.port)
-
-        # Connect signals to UI updates
-        worker.signals.progress.connect(self.set_progress)
-        worker.signals.status.connect(self.msg)
-        worker.signals.error.connect(self.handle_tag_error)  # Reuse your existing msg method
-        worker.signals.finished.connect(self.handle_tag_read_success)
-        # Start the worker in the thread pool
-        self.threadpool.start(worker)
+        if self.pool is not None:
+            names = self.pool.readers_with_tag()
+            if not names:
+                self.msg("No tag on any PC/SC reader.")
+                return
+            self.pool_progress = {names[0]: 0}
+            self.pool.read(names[0])
+            return
+        if self.session is None:
+            return
+        self.session.request_read.emit()
 
     def handle_tag_error(self, msg):
         self.msg(str(msg))
-        self.auto_read_timer.start(1000)
+        self.start_auto_read()
 
     def handle_tag_read_success(self, tag):
         try:
             self.load_tag_data(tag.data)
+            self.last_tag_data = bytes(tag.data)
+            self.last_tag_uid = bytes(tag.uid)
+            self.last_tag_blocksize = tag.bytesPerPage
             self.msg("Tag read and parsed successfully.")
         except Exception as e:
             self.msg(f"Error on parsing nfc tag: {str(e)}")
         finally:
             self.set_progress(0)
             self.msg("")
-        self.auto_read_timer.start(1000)
+        self.start_auto_read()
 
     def on_write_tag(self):
         self.set_progress(0)
+        # The tag gets rewritten entirely, the last read contents are no longer a valid base for aux updates
+        self.last_tag_data = None
         self.msg("Generating tag data...")
+        if self.session is None and self.pool is None:
+            return
+        try:
+            tagdata = self.generate_tag_data()
+        except Exception as e:
+            self.msg(f"Failed to generate tag data: {str(e)}")
+            return
+        if self.pool is not None:
+            # Same contents for every tag on every reader, written in parallel
+            names = self.pool.write_all(tagdata)
+            self.pool_progress = {name: 0 for name in names}
+            self.msg(f"Writing {len(names)} tags ...")
+            return
+        self.session.request_write.emit(tagdata, None, None)
 
-        worker = NFC_WriteTagWorker(parent=self, reader=self.reader, port=self.port)
-
-        # Connect signals to UI updates
-        worker.signals.progress.connect(self.set_progress)
-        worker.signals.status.connect(self.msg)
-        worker.signals.error.connect(lambda msg: self.msg(msg))  # Reuse your existing msg method
-        worker.signals.finished.connect(self.handle_tag_write_success)
-
-        # Start the worker in the thread pool
-        self.threadpool.start(worker)
+    def on_update_weight(self):
+        self.set_progress(0)
+        self.msg("Updating consumed weight...")
+        if self.session is None and self.pool is None:
+            return
+        try:
+            tagdata, blocklist, uid = self.generate_aux_data()
+        except Exception as e:
+            self.msg(f"Failed to generate tag data: {str(e)}")
+            return
+        if self.pool is not None:
+            name = self.pool.find_reader(uid)
+            if name is None:
+                self.msg("Tag differs from the last read tag, please read it first.")
+                return
+            self.pool_progress = {name: 0}
+            self.pool.write(name, tagdata, blocklist, uid)
+            return
+        self.session.request_write.emit(tagdata, blocklist, uid)
 
     def handle_tag_write_success(self):
         try:
@@ -377,19 +531,9 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         msg.exec()
 
     def generate_tag_data(self):
-        args = Args(
-            size=304,  # 136 for smaller chip
-            aux_region=32,  # 16 for smaller chip
-            config_file=default_config_file)
-
+        uri = None
         if self.includeurlcheckbox.isChecked():
-            args.ndef_uri = self.urledit.toPlainText()
-
-        # Create empty tag
-        emptytag_data = nfc_initialize(args)
-
-        # Fill empty tag with data
-        record = Record(args.config_file, memoryview(bytearray(emptytag_data)))
+            uri = self.urledit.toPlainText()
 
         update_data = {}
         consumed_weight = self.consumedweightbox.value()
@@ -471,11 +615,19 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         for category in items:
             for prop in items[category]:
                 update_data["main"]["tags"].append(self.matpropwidget.get_tag(prop))
-        for region_name, region in record.regions.items():
-            region.update(
-                update_fields=update_data.get(region_name, dict())
-            )
-        return record.data.tobytes()
+        return encode_tag(update_data, uri=uri)
+
+    def generate_aux_data(self):
+        """
+        Re-encodes only the aux region of the last read tag, returns the tag data,
+        the blocks that changed and the uid of the tag it belongs to
+        """
+        if self.last_tag_data is None or self.aux_region_offset is None:
+            raise Exception("No aux region known, please read the tag first")
+        data = update_aux_region(self.last_tag_data, dict(consumed_weight=self.consumedweightbox.value()))
+        blocklist = get_dirty_blocks(self.last_tag_data, data, self.last_tag_blocksize,
+                                     len(data) // self.last_tag_blocksize)
+        return bytes(data), blocklist, self.last_tag_uid
 
     def on_save_file(self):
         fn = (self.brandnamebox.currentText().replace(" ", "_").replace("-", "_") + "_" +
@@ -519,6 +671,7 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         if "main" in fields:
             main = fields["main"]
             if "brand_name" in main:
+                self.wanted_brand = main["brand_name"]
                 self.brandnamebox.setCurrentText(main["brand_name"])
             if "material_name" in main:
                 self.materialnamebox.setCurrentText(main["material_name"])
@@ -803,7 +956,7 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
             self.show_message_box(title=self.tr("Error"),
                                   message=self.tr(f"Couldn't find material class database at {mc_filename}"),
                                   icon=QMessageBox.Icon.Critical)
-        mc = yaml.safe_load(open(mc_filename, encoding="utf8").read())
+        mc = self.dbcache.load_yaml(mc_filename)
         for item in mc:
             materialclasses[item["name"]] = item["description"]
         return materialclasses
@@ -815,14 +968,14 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
             self.show_message_box(title=self.tr("Error"),
                                   message=self.tr(f"Couldn't find categories database at {mcc_filename}"),
                                   icon=QMessageBox.Icon.Critical)
-        mcc = yaml.safe_load(open(mcc_filename, encoding="utf8").read())
+        mcc = self.dbcache.load_yaml(mcc_filename)
 
         mc_filename = os.path.join(script_path, "Library", "OpenPrintTag", "data", "tags_enum.yaml")
         if not os.path.exists(mc_filename):
             self.show_message_box(title=self.tr("Error"),
                                   message=self.tr(f"Couldn't find tags database at {mc_filename}"),
                                   icon=QMessageBox.Icon.Critical)
-        mc = yaml.safe_load(open(mc_filename, encoding="utf8").read())
+        mc = self.dbcache.load_yaml(mc_filename)
         for citem in mcc:
             if "display_name" in citem and "name" in citem:
                 category = citem["display_name"]
@@ -846,13 +999,13 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
             self.show_message_box(title=self.tr("Error"),
                                   message=self.tr(f"Couldn't find material temp database at {mt_filename}"),
                                   icon=QMessageBox.Icon.Critical)
-        default_filamenttypes = yaml.safe_load(open(mt_filename).read())
+        default_filamenttypes = self.dbcache.load_yaml(mt_filename)
         mc_filename = os.path.join(script_path, "Library", "OpenPrintTag", "data", "material_type_enum.yaml")
         if not os.path.exists(mc_filename):
             self.show_message_box(title=self.tr("Error"),
                                   message=self.tr(f"Couldn't find material type database at {mc_filename}"),
                                   icon=QMessageBox.Icon.Critical)
-        mc = yaml.safe_load(open(mc_filename).read())
+        mc = self.dbcache.load_yaml(mc_filename)
         for item in mc:
             abbr = item["abbreviation"]
             materialtypes[abbr] = dict(name=item["name"], desc=item["description"])
@@ -1130,56 +1283,55 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         if manufacturername in self.vendors:
             if hasattr(self.vendors[manufacturername], "slug"):
                 manufacturer = self.vendors[manufacturername].slug
-                self.filaments = self.read_filaments_from_database(manufacturer)
-                if manufacturer not in self.filaments:
-                    self.filaments[manufacturer] = self.read_filaments_from_database(manufacturer)
-                filaments = self.filaments[manufacturer]
+                filaments = self.read_filaments_from_database(manufacturer, logger=self.msg)
+                self.filaments = filaments
                 if not filaments:
                     return
                 self.materialnamebox.clear()
                 for entry in filaments:
                     prefs = filaments[entry]
                     if hasattr(prefs, "slug"):
-                        if prefs.slug not in self.packages:
-                            packages = self.read_packages_from_database(vendorname=manufacturer,materialname=prefs.slug)
-                            if packages:
-                                self.packages[prefs.slug] = packages
-                                for package in packages:
+                        packages = self.read_packages_from_database(vendorname=manufacturer,materialname=prefs.slug,
+                                                                    logger=self.msg)
+                        if packages:
+                            for package in packages:
+                                if hasattr(package, "nominal_netto_full_weight"):
+                                    nominal_netto_full_weight = "%.02fKg" % (package.nominal_netto_full_weight/1000)
+                                else:
+                                    nominal_netto_full_weight = ""
+
+                                # toDo: filament_diameter is in mm, but database has incorrect format
+                                # The packages are cached, so convert a copy and leave the package as it is
+                                filament_diameter = package.filament_diameter/1000
+                                # End of change
+
+                                diameter = "%.02fmm" % (filament_diameter)
+                                class info:
+                                    materialname=prefs.slug
                                     if hasattr(package, "nominal_netto_full_weight"):
-                                        nominal_netto_full_weight = "%.02fKg" % (package.nominal_netto_full_weight/1000)
-                                    else:
-                                        nominal_netto_full_weight = ""
-
-                                    # toDo: filament_diameter is in mm, but database has incorrect format
-                                    package.filament_diameter = package.filament_diameter/1000
-                                    # End of change
-
-                                    diameter = "%.02fmm" % (package.filament_diameter)
-                                    class info:
-                                        materialname=prefs.slug
-                                        if hasattr(package, "nominal_netto_full_weight"):
-                                            nominal_netto_full_weight=package.nominal_netto_full_weight
-                                        if hasattr(package, "filament_diameter"):
-                                            diameter=package.filament_diameter
-                                        if hasattr(package, "empty_container_weight"):
-                                            empty_container_weight=package.empty_container_weight
-                                    if hasattr(prefs,"name"):
-                                        name = prefs.name
-                                        self.materialnamebox.addItem(f"{name} [{nominal_netto_full_weight} {diameter}]",info())
-                            else:
+                                        nominal_netto_full_weight=package.nominal_netto_full_weight
+                                    if hasattr(package, "filament_diameter"):
+                                        diameter=filament_diameter
+                                    if hasattr(package, "empty_container_weight"):
+                                        empty_container_weight=package.empty_container_weight
                                 if hasattr(prefs,"name"):
                                     name = prefs.name
-                                    class info:
-                                        materialname=prefs.slug
-                                        diameter=1750
-                                        nominal_netto_full_weight=1000
-                                        empty_container_weight=0
-                                    self.materialnamebox.addItem(f"{name}", info())
+                                    self.materialnamebox.addItem(f"{name} [{nominal_netto_full_weight} {diameter}]",info())
+                        else:
+                            if hasattr(prefs,"name"):
+                                name = prefs.name
+                                class info:
+                                    materialname=prefs.slug
+                                    diameter=1750
+                                    nominal_netto_full_weight=1000
+                                    empty_container_weight=0
+                                self.materialnamebox.addItem(f"{name}", info())
                     else:
                         self.materialnamebox.addItem(entry)
                 self.materialnamebox.model().sort(0, Qt.AscendingOrder)
                 self.materialnamebox.setCurrentIndex(0)
                 self.matpropwidget.filter_check.setChecked(False)
+                self.prefetch_neighbour_vendors()
 
     def update_color_label(self, hex_color: str, colorlabel: QLabel):
         # Fill a tiny pixmap with the chosen color
@@ -1220,7 +1372,8 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
         itemdata = self.materialnamebox.currentData()
         if itemdata and hasattr(itemdata,"materialname"):
             materialslug = itemdata.materialname
-            self.packages = self.read_packages_from_database(vendorname=vendorslug,materialname=materialslug)
+            self.packages = self.read_packages_from_database(vendorname=vendorslug,materialname=materialslug,
+                                                             logger=self.msg)
             if hasattr(itemdata,"diameter") and hasattr(itemdata,"nominal_netto_full_weight"):
                 nominal_netto_full_weight = itemdata.nominal_netto_full_weight
                 diameter = itemdata.diameter
@@ -1273,78 +1426,162 @@ class GUI_OpenPrintTag(QMainWindow, Ui_OpenPrintTagGui):
 #        self.brandnamebox.model().sort(0, Qt.AscendingOrder)
 #    """
 
-    def read_vendors_from_database(self):
+    def setup_vendors(self):
         self.vendors = {}
-        for vendorname in self.filecache:
-            fn = os.path.join(script_path, "Library", "openprinttag-database", "data", "brands", vendorname+".yaml")
-            if os.path.exists(fn):
-                vendor_dict = yaml.safe_load(open(fn, "r"))
-                if "name" in vendor_dict and "slug" in vendor_dict:
-                    class Vendor_T:
-                        slug = vendor_dict["slug"]
-                        countries_of_origin = vendor_dict["countries_of_origin"]
-
-                    self.vendors[vendor_dict["name"]] = Vendor_T()
-
-        for brand_name in self.vendors:
-            self.brandnamebox.addItem(brand_name)
+        self.filecache = {}
+        self.gtins = {}  # gtin -> (brand name, vendor slug, material slug, package file)
         self.brandnamebox.setStyleSheet("""
                     combobox-popup: 0;
                     QListWidget::item { padding: 4px; }
                     QListWidget { border: 1px solid #999; }
                 """)
         self.brandnamebox.currentTextChanged.connect(self.on_manufacturer_changed)
-        self.brandnamebox.model().sort(0, Qt.AscendingOrder)
+        # Vendors arrive one by one from the loader thread, parsing runs in a process pool
+        self.database_thread = QThread()
+        self.database_worker = DatabaseLoaderWorker(cache=self.dbcache)
+        self.database_worker.moveToThread(self.database_thread)
+        self.database_thread.started.connect(self.database_worker.run)
+        self.database_worker.vendor_loaded.connect(self.on_vendor_loaded, Qt.QueuedConnection)
+        self.database_worker.status.connect(self.msg, Qt.QueuedConnection)
+        self.database_worker.finished.connect(self.on_database_loaded, Qt.QueuedConnection)
+        self.database_worker.finished.connect(self.database_thread.quit, Qt.QueuedConnection)
+        self.database_worker.finished.connect(self.database_worker.deleteLater, Qt.QueuedConnection)
+        self.database_thread.start()
+
+    def on_vendor_loaded(self, vendorname: str, vendor_dict, index):
+        if not isinstance(vendor_dict, dict) or "name" not in vendor_dict or "slug" not in vendor_dict:
+            return
+        self.filecache[vendorname] = index
+
+        class Vendor_T:
+            slug = vendor_dict["slug"]
+            countries_of_origin = vendor_dict["countries_of_origin"]
 
-    def read_filaments_from_database(self, vendorname:str):
-        # self.filecache[vendorname][materialname]
-        filaments = {}
+        brand_name = vendor_dict["name"]
+        self.vendors[brand_name] = Vendor_T()
+        for gtin, (_, materialslug, package_file) in gtin_index({vendorname: index}).items():
+            self.gtins[gtin] = (brand_name, vendorname, materialslug, package_file)
+        self.brandnamebox.addItem(brand_name)
+        self.brandnamebox.model().sort(0, Qt.AscendingOrder)
+        if brand_name == self.wanted_brand:
+            if self.brandnamebox.currentText() == brand_name:
+                self.on_manufacturer_changed()
+            else:
+                self.brandnamebox.setCurrentText(brand_name)
+
+    def on_database_loaded(self):
+        self.wanted_brand = None
+        stats = self.dbcache.stats
+        self.msg(f"Loaded {len(self.vendors)} brands, {stats['parsed']} files parsed with {stats['workers']} "
+                 f"processes, {stats['loaded']} from cache")
+
+    def on_brand_activated(self, index: int):
+        # The user picked a brand, don't switch to the default one when it arrives
+        self.wanted_brand = None
+
+    def closeEvent(self, event):
+        if self.database_thread.isRunning():
+            self.database_worker.stop()
+            self.database_thread.quit()
+            self.database_thread.wait(5000)
+        super().closeEvent(event)
+
+    def on_gtin_edited(self, text: str):
+        # EAN-13 is complete, shorter codes wait for return (barcode scanners send one)
+        if len(text) == 13:
+            self.select_gtin(text)
+
+    def on_gtin_entered(self):
+        text = self.gtinedit.text()
+        # 13 digits were already looked up while typing
+        if text and len(text) != 13:
+            self.select_gtin(text)
+
+    def select_gtin(self, text: str) -> bool:
+        """
+        Selects brand, material and package of a GTIN from the database
+        """
+        gtin = gtin_key(text)
+        entry = self.gtins.get(gtin) if gtin is not None else None
+        if entry is None:
+            self.msg(f"GTIN {text} not found in database")
+            return False
+        brand_name, vendorname, materialslug, package_file = entry
+        self.wanted_brand = None
+        if self.brandnamebox.currentText() != brand_name:
+            self.brandnamebox.setCurrentText(brand_name)
+        package = None
+        for item in self.read_packages_from_database(vendorname=vendorname, materialname=materialslug,
+                                                     logger=self.msg):
+            if gtin_key(getattr(item, "gtin", None)) == gtin:
+                package = item
+                break
+        row = -1
+        for idx in range(self.materialnamebox.count()):
+            info = self.materialnamebox.itemData(idx)
+            if getattr(info, "materialname", None) != materialslug:
+                continue
+            if row == -1:
+                row = idx
+            if (package is not None and hasattr(package, "filament_diameter") and
+                    getattr(info, "nominal_netto_full_weight", None) == getattr(package, "nominal_netto_full_weight", None) and
+                    getattr(info, "diameter", None) == package.filament_diameter / 1000):
+                row = idx
+                break
+        if row != -1 and row != self.materialnamebox.currentIndex():
+            self.materialnamebox.setCurrentIndex(row)
+        # Selecting the material filled in the GTIN of its first package, show the scanned one
+        self.gtinedit.setText(text)
+        # The next scan replaces it
+        self.gtinedit.selectAll()
+        self.msg(f"GTIN {text}: {brand_name} {self.materialnamebox.currentText()}")
+        return True
+
+    def read_filaments_from_database(self, vendorname:str, logger=None):
+        # self.filecache[vendorname][materialslug]
         if not vendorname in self.filecache:
-            return filaments
-        for material in self.filecache[vendorname]:
-            fn = os.path.join(script_path, "Library", "openprinttag-database", "data", "materials", vendorname, material + ".yaml")
-            if os.path.exists(fn):
-                try:
-                    filament_dict = yaml.safe_load(open(os.path.join(fn), "r"))
-                    fd = SimpleNamespace(**filament_dict)
-                    if hasattr(fd, "slug"):
-                        filaments[fd.slug] = fd
-                except Exception as e:
-                    self.msg(f"YAML Error in {fn}: {str(e)}")
-        return filaments
-
-    def read_packages_from_database(self, vendorname:str, materialname:str) -> list:
-        packages = []
-        if vendorname not in self.filecache or materialname not in self.filecache[vendorname]:
-            return packages
+            return {}
+        index = self.filecache[vendorname]
+        return self.material_cache.get(vendorname, lambda log: vendor_materials(self.dbcache, index, logger=log),
+                                       logger=logger)
 
-        for fn in self.filecache[vendorname][materialname]:
-            try:
-                package_dict = yaml.safe_load(open(os.path.join(fn), "r"))
-                fd = SimpleNamespace(**package_dict)
-                if hasattr(fd,"material") and "slug" in fd.material:
-                    material_name = fd.material["slug"]
-                    if material_name == materialname:
-                        packages.append(fd)
-            except Exception as e:
-                self.msg(f"YAML Error in {fn}: {str(e)}")
-        return packages
+    def read_packages_from_database(self, vendorname:str, materialname:str, logger=None) -> list:
+        if vendorname not in self.filecache or materialname not in self.filecache[vendorname]:
+            return []
+        package_files = self.filecache[vendorname][materialname]["packages"]
+        return self.package_cache.get((vendorname, materialname),
+                                      lambda log: material_packages(self.dbcache, package_files, materialname,
+                                                                    logger=log),
+                                      logger=logger)
+
+    def prefetch_neighbour_vendors(self):
+        """
+        Reads the brands next to the current one in the background, flipping through the box hits the cache
+        """
+        idx = self.brandnamebox.currentIndex()
+        vendors = []
+        for offset in (1, -1, 2, -2):
+            if 0 <= idx + offset < self.brandnamebox.count():
+                vendor = self.vendors.get(self.brandnamebox.itemText(idx + offset))
+                if vendor is not None and vendor.slug not in self.material_cache:
+                    vendors.append(vendor.slug)
+        if vendors:
+            self.threadpool.start(DatabasePrefetchWorker(self.prefetch_vendors, vendors))
+
+    def prefetch_vendors(self, vendors: list):
+        # Runs in the thread pool, no logger as it must not touch the GUI. The caches keep the
+        # errors and the first read with a logger reports them
+        for vendorname in vendors:
+            for prefs in self.read_filaments_from_database(vendorname).values():
+                if hasattr(prefs, "slug"):
+                    self.read_packages_from_database(vendorname=vendorname, materialname=prefs.slug)
 
     def parse_tag_data(self, data):
-        uri = ""
-        record = Record(config_file=default_config_file, data=memoryview(data))
-        fields = {}
-        for name, region in record.regions.items():
-            unknown_fields = dict()
-            try:
-                fields[name] = region.read(out_unknown_fields=unknown_fields)
-            except Exception as err:
-                self.msg(str(err))
-        if hasattr(record, "uri"):
-            uri = record.uri
-        return fields, uri
+        return decode_tag(data, logger=self.msg)
 
 def main():
+    # Frozen builds start the database parser processes through this executable
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     info = "OpenPrintTagGUI v1.03 (c) B.Kerler"
     app.setApplicationName(info)
@@ -0,0 +1,73 @@
+from openprinttaggui.Library.iso15693 import ISO15_DUMP_CACHE_T, get_dirty_blocks, get_ndef_size
+
+
+def test_ndef_size_short_cc():
+    # 4 byte capability container, NDEF TLV of 0x20 bytes
+    data = bytes([0xE1, 0x40, 0x26, 0x01, 0x03, 0x20]) + bytes(0x20) + b"\xfe"
+    assert get_ndef_size(data) == 4 + 2 + 0x20
+
+
+def test_ndef_size_long_cc_and_length():
+    # MLEN 0 means an 8 byte capability container, a length of 0xFF is followed by a 16 bit length
+    data = bytes([0xE2, 0x40, 0x00, 0x01, 0x00, 0x00, 0x01, 0x00, 0x03, 0xFF, 0x01, 0x00])
+    assert get_ndef_size(data) == 8 + 4 + 0x100
+
+
+def test_ndef_size_skips_tlvs():
+    data = bytes([0xE1, 0x40, 0x26, 0x01, 0x00, 0x00, 0xFD, 0x02, 0xAA, 0xBB, 0x03, 0x05])
+    assert get_ndef_size(data) == 10 + 2 + 5
+
+
+def test_ndef_size_needs_more_data():
+    assert get_ndef_size(b"\xe1\x40") == 4
+    # Data ends right after the capability container or inside the TLV header
+    assert get_ndef_size(bytes([0xE1, 0x40, 0x26, 0x01])) == 8
+    assert get_ndef_size(bytes([0xE1, 0x40, 0x26, 0x01, 0x03])) == 8
+    assert get_ndef_size(bytes([0xE1, 0x40, 0x26, 0x01, 0x03, 0xFF, 0x01])) == 8
+
+
+def test_ndef_size_not_ndef():
+    assert get_ndef_size(bytes(16)) is None
+    assert get_ndef_size(bytes([0xE1, 0x40, 0x26, 0x01, 0xFE])) is None
+
+
+def test_dirty_blocks():
+    current = bytes(32)
+    new = bytearray(current)
+    new[0] = 1
+    new[13] = 2
+    new[31] = 3
+    assert get_dirty_blocks(current, bytes(new), 4, 8) == [0, 3, 7]
+    assert get_dirty_blocks(current, bytes(new), 4, 4) == [0, 3]
+    assert get_dirty_blocks(current, current, 4, 8) == []
+
+
+def test_dirty_blocks_short_current():
+    # Blocks missing from current count as dirty
+    assert get_dirty_blocks(bytes(8), bytes(16), 4, 4) == [2, 3]
+
+
+def test_dump_cache():
+    cache = ISO15_DUMP_CACHE_T()
+    uid = b"\xe0\x04\x01\x08\x00\x00\x00\x01"
+    assert cache.get(uid) is None
+    cache.store(uid, bytes(16))
+    assert cache.get(uid) == bytes(16)
+    assert cache.get(b"\x00" * 8) is None
+    cache.update(uid, b"\x11" * 16, [1, 3], 4)
+    assert cache.get(uid) == bytes(4) + b"\x11" * 4 + bytes(4) + b"\x11" * 4
+    cache.check_uid(uid)
+    assert cache.get(uid) is not None
+    cache.check_uid(None)
+    assert cache.get(uid) is None
+
+
+def test_dump_cache_update_without_dump():
+    # Without a cached dump only the blocks from 0 up to the first gap are known
+    cache = ISO15_DUMP_CACHE_T()
+    uid = b"\x01" * 8
+    cache.update(uid, bytes(range(16)), [0, 1, 3], 4)
+    assert cache.get(uid) == bytes(range(8))
+    cache.clear()
+    cache.update(uid, bytes(range(16)), [2], 4)
+    assert cache.get(uid) is None
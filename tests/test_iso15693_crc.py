@@ -0,0 +1,34 @@
+import os
+
+from openprinttaggui.Library.iso15693_crc import CRC16_TABLE, crc16, crc16_bitwise, crc16_check, crc16_check_batch
+
+
+def with_crc(data: bytes) -> bytes:
+    return data + crc16(data).to_bytes(2, "little")
+
+
+def test_crc16_check_value():
+    # CRC-16/X-25 check value, ISO15693 uses the same crc
+    assert crc16(b"123456789") == 0x906E
+
+
+def test_crc16_table_matches_bitwise():
+    assert len(CRC16_TABLE) == 256
+    for data in [b"", b"\x00", b"\xff" * 7, bytes(range(256)), os.urandom(33)]:
+        assert crc16(data) == crc16_bitwise(data)
+
+
+def test_crc16_check():
+    frame = with_crc(b"\x00\x01\x02\x03\x04")
+    assert crc16_check(frame)
+    assert not crc16_check(frame[:-1] + bytes([frame[-1] ^ 1]))
+    assert not crc16_check(b"\x00")
+
+
+def test_crc16_check_batch_matches_single():
+    frames = [with_crc(os.urandom(length)) for length in (0, 1, 4, 4, 4, 9, 32)]
+    frames[2] = frames[2][:-1] + bytes([frames[2][-1] ^ 0x80])
+    frames.append(b"\x01")
+    frames.append(memoryview(with_crc(b"\x22\x33")))
+    assert crc16_check_batch(frames) == [crc16_check(frame) for frame in frames]
+    assert crc16_check_batch([]) == []
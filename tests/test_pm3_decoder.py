@@ -0,0 +1,70 @@
+from openprinttaggui.Library.pm3_nfc.pm3_generic import PM3FrameDecoder, PM3_RESP_PREAMBLE, PM3_RESP_MAGIC, \
+    PM3_CMD_DATA_SIZE, PM3_MIX_ARGS_SIZE
+
+
+def make_frame(cmd: int, payload: bytes, status: int = 0, length: int = None) -> bytes:
+    if length is None:
+        length = len(payload)
+    return PM3_RESP_PREAMBLE.pack(PM3_RESP_MAGIC, length | 0x8000, status, 0, cmd) + payload + b"b3"
+
+
+def feed(decoder: PM3FrameDecoder, data: bytes):
+    decoder.compact()
+    decoder.buffer[decoder.end:decoder.end + len(data)] = data
+    decoder.end += len(data)
+
+
+def frames(decoder: PM3FrameDecoder):
+    result = []
+    while True:
+        resp, missing = decoder.next_frame()
+        if resp is None:
+            return result, missing
+        result.append((resp.cmd, bytes(resp.payload)))
+
+
+def test_decode_frames():
+    decoder = PM3FrameDecoder()
+    feed(decoder, make_frame(0x0109, b"\x01\x02") + make_frame(0x0330, b""))
+    assert frames(decoder) == ([(0x0109, b"\x01\x02"), (0x0330, b"")], PM3_RESP_PREAMBLE.size)
+
+
+def test_decode_partial_frame():
+    decoder = PM3FrameDecoder()
+    frame = make_frame(0x0109, bytes(range(16)))
+    feed(decoder, frame[:5])
+    assert frames(decoder) == ([], PM3_RESP_PREAMBLE.size - 5)
+    feed(decoder, frame[5:12])
+    assert frames(decoder) == ([], len(frame) - 12)
+    feed(decoder, frame[12:])
+    assert frames(decoder)[0] == [(0x0109, bytes(range(16)))]
+
+
+def test_resync_after_garbage():
+    decoder = PM3FrameDecoder()
+    feed(decoder, b"\x00PM3xyzPM" + make_frame(0x0109, b"\xaa"))
+    assert frames(decoder)[0] == [(0x0109, b"\xaa")]
+
+
+def test_garbage_keeps_magic_prefix():
+    decoder = PM3FrameDecoder()
+    frame = make_frame(0x0109, b"\xbb")
+    feed(decoder, bytes(20) + frame[:3])
+    assert frames(decoder)[0] == []
+    feed(decoder, frame[3:])
+    assert frames(decoder)[0] == [(0x0109, b"\xbb")]
+
+
+def test_oversized_length_resyncs():
+    decoder = PM3FrameDecoder()
+    bad = make_frame(0x0109, b"", length=PM3_CMD_DATA_SIZE + PM3_MIX_ARGS_SIZE + 1)[:PM3_RESP_PREAMBLE.size]
+    feed(decoder, bad + make_frame(0x0330, b"\x01"))
+    # Without the bounds check the decoder would wait for the bogus length
+    assert frames(decoder)[0] == [(0x0330, b"\x01")]
+
+
+def test_max_length_accepted():
+    decoder = PM3FrameDecoder(size=0x400)
+    payload = bytes(PM3_CMD_DATA_SIZE + PM3_MIX_ARGS_SIZE)
+    feed(decoder, make_frame(0x0109, payload))
+    assert frames(decoder)[0] == [(0x0109, payload)]
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("tty")
+from openprinttaggui.Library.pm3_nfc.pm3_emulator import PM3Emulator, ISO15693_READBLOCK
+from openprinttaggui.Library.pm3_nfc.pm3_hf15 import PM3_HF15, ISO15_COMMAND
+
+DATA = bytes(range(256))
+FLAGS = ISO15_COMMAND.ISO15_CONNECT.value | ISO15_COMMAND.ISO15_READ_RESPONSE.value | \
+        ISO15_COMMAND.ISO15_NO_DISCONNECT.value
+
+
+@pytest.fixture
+def emulator():
+    with PM3Emulator(data=DATA, latency={"usb": 0}, wtx_threshold=1e9) as emu:
+        yield emu
+
+
+def read_pipelined(pm3, uid, blocks, timeout=2500):
+    raw = bytearray([0x22]) + uid
+    got = []
+    pm3.start_pipeline()
+    try:
+        pm3.exchange_iso15([(FLAGS, pm3.read_blk_raw(raw, blocknum)) for blocknum in blocks],
+                           lambda idx, resp: got.append((idx, bytes(resp.payload[1:5]))) or True,
+                           timeout=timeout, depth=4)
+    finally:
+        pm3.stop_pipeline()
+    return got
+
+
+def test_pipeline_in_order(emulator):
+    pm3 = PM3_HF15(port=emulator.port, logger=[].append)
+    try:
+        uid = pm3.getUID()
+        got = read_pipelined(pm3, uid, range(8))
+        assert got == [(idx, DATA[idx * 4:idx * 4 + 4]) for idx in range(8)]
+    finally:
+        pm3.close()
+
+
+def test_pipeline_timeout_is_fatal(emulator):
+    pm3 = PM3_HF15(port=emulator.port, logger=[].append)
+    try:
+        uid = pm3.getUID()
+        emulator.latency[ISO15693_READBLOCK] = 150
+        with pytest.raises(Exception, match="Timeout"):
+            read_pipelined(pm3, uid, range(4), timeout=100)
+        # The late responses of the failed pipeline must not be taken for the answers of the next one
+        emulator.latency[ISO15693_READBLOCK] = 1
+        got = read_pipelined(pm3, uid, range(4, 8))
+        assert got == [(idx, DATA[(idx + 4) * 4:(idx + 4) * 4 + 4]) for idx in range(4)]
+    finally:
+        pm3.close()
@@ -0,0 +1,21 @@
+import pytest
+
+from openprinttaggui.Library.tag_codec import decode_tag, encode_tag, update_aux_region
+
+# encode_tag adds the OpenPrintTag utils to sys.path on import
+pytest.importorskip("Library.OpenPrintTag.utils.record", reason="OpenPrintTag submodule not checked out")
+
+
+def test_round_trip():
+    data = encode_tag({"main": {"brand_name": "Prusament", "material_name": "PLA Galaxy Black"}})
+    fields, _ = decode_tag(data)
+    assert fields["main"]["brand_name"] == "Prusament"
+    assert fields["main"]["material_name"] == "PLA Galaxy Black"
+
+
+def test_aux_update_keeps_main():
+    data = encode_tag({"main": {"brand_name": "Prusament"}})
+    data = update_aux_region(data, {"consumed_weight": 125})
+    fields, _ = decode_tag(data)
+    assert fields["main"]["brand_name"] == "Prusament"
+    assert fields["aux"]["consumed_weight"] == 125